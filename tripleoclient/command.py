@@ -16,13 +16,17 @@ from osc_lib.command import command
 
 
 from tripleoclient import utils
+from tripleoclient.workflows import timing
 
 
 class Command(command.Command):
 
     def run(self, parsed_args):
         utils.store_cli_param(self.cmd_name, parsed_args)
-        super(Command, self).run(parsed_args)
+        try:
+            super(Command, self).run(parsed_args)
+        finally:
+            timing.log_summary()
 
 
 class Lister(Command, command.Lister):
@@ -21,6 +21,14 @@ OVERCLOUD_ROLES_FILE = "roles_data.yaml"
 UNDERCLOUD_ROLES_FILE = "roles_data_undercloud.yaml"
 UNDERCLOUD_OUTPUT_DIR = os.path.join(os.environ.get('HOME'))
 STANDALONE_EPHEMERAL_STACK_VSTATE = '/var/lib/tripleo-heat-installer'
+# Migrated, empty databases of the ephemeral Heat, one per Heat version
+HEAT_DB_SNAPSHOT_DIR = os.path.join(STANDALONE_EPHEMERAL_STACK_VSTATE,
+                                    'heat-db')
+# uid and gid of the Heat user of the last HEAT_IDS_CACHE_SIZE Heat
+# container images and users used
+HEAT_IDS_CACHE_FILE = os.path.join(STANDALONE_EPHEMERAL_STACK_VSTATE,
+                                   'heat-ids.json')
+HEAT_IDS_CACHE_SIZE = 16
 UNDERCLOUD_LOG_FILE = "install-undercloud.log"
 UNDERCLOUD_CONF_PATH = os.path.join(UNDERCLOUD_OUTPUT_DIR, "undercloud.conf")
 OVERCLOUD_NETWORKS_FILE = "network_data.yaml"
@@ -32,6 +40,75 @@ PLAN_ENVIRONMENT = 'plan-environment.yaml'
 USER_ENVIRONMENT = 'user-environment.yaml'
 USER_PARAMETERS = 'user-environments/tripleoclient-parameters.yaml'
 
+# Concurrency and retries used when transferring plan objects to and from
+# Swift. The concurrency can be overridden with TRIPLEO_SWIFT_CONCURRENCY.
+SWIFT_CONCURRENCY = 8
+SWIFT_RETRIES = 2
+SWIFT_RETRY_BACKOFF = 1
+SWIFT_CHUNK_SIZE = 65536
+# Format of the archive used to upload a templates tree to a new plan. The
+# plan is usually uploaded to the undercloud's own Swift, where compressing
+# costs more than it saves. Can be overridden with TRIPLEO_PLAN_ARCHIVE_CODEC.
+PLAN_ARCHIVE_CODEC = 'tar'
+PLAN_ARCHIVE_COMPRESS_LEVEL = 1
+
+# Number of messages read per claim, and lifetime in seconds of the claims,
+# when reading the messages of a Zaqar queue to resume waiting for a workflow
+ZAQAR_REPLAY_BATCH_SIZE = 20
+ZAQAR_REPLAY_CLAIM_TTL = 60
+
+# Longest wait in seconds of a client reading the shared Zaqar websocket
+# before letting the other clients read, and number of messages kept for
+# executions which haven't been claimed by a client yet, and for each client
+ZAQAR_READ_INTERVAL = 1
+ZAQAR_UNCLAIMED_MESSAGES = 1000
+
+# Seconds a new client of a Zaqar websocket has to claim its execution
+# before the messages held back for it are given to the other clients
+ZAQAR_CLAIM_TIMEOUT = 60
+
+# Seconds between two lookups of a Mistral execution when polling for its
+# state: the interval starts small and doubles up to the maximum
+POLLING_INITIAL_INTERVAL = 1
+POLLING_MAX_INTERVAL = 30
+
+# Number of workflows a WorkflowRunner waits for concurrently
+WORKFLOW_CONCURRENCY = 4
+
+# Minimum number of seconds between two lookups of the state of a workflow
+# execution while its progress messages are received
+EXECUTION_STATE_CHECK_INTERVAL = 10
+
+# Seconds between two fetches of the events of a stack being deployed: the
+# interval doubles up to the maximum while no event arrives. Events are
+# fetched in pages of STACK_EVENTS_PAGE_SIZE
+STACK_EVENTS_INITIAL_INTERVAL = 1
+STACK_EVENTS_MAX_INTERVAL = 20
+STACK_EVENTS_PAGE_SIZE = 200
+
+# Seconds the events of a stack are waited for after the timeout of the
+# stack itself, by when Heat should have failed it, and number of lookups of
+# a stack whose action was never seen in progress after which its status is
+# trusted when it was updated since the wait started
+STACK_EVENTS_TIMEOUT_SLACK = 10 * 60
+STACK_EVENTS_STALE_POLLS = 5
+
+# Number of Heat API calls made at once when listing the failures of a
+# stack, and the number of failed resources shown
+STACK_FAILURES_CONCURRENCY = 8
+STACK_FAILURES_LIMIT = 20
+
+# Seconds waited for a local service to be ready, and between two probes of
+# its port: the interval starts small and doubles up to the maximum
+PORT_READY_TIMEOUT = 30
+PORT_READY_INITIAL_INTERVAL = 0.1
+PORT_READY_MAX_INTERVAL = 1
+
+# Maximum size in bytes of the on-disk cache of parsed YAML files, and how
+# many new entries are written between checks of that size
+YAML_CACHE_SIZE = 64 * 1024 * 1024
+YAML_CACHE_EVICT_INTERVAL = 100
+
 # This directory may contain additional environments to use during deploy
 DEFAULT_ENV_DIRECTORY = os.path.join(os.environ.get('HOME'),
                                      '.tripleo', 'environments')
@@ -99,6 +99,14 @@ class WorkflowActionError(Exception):
         super(WorkflowActionError, self).__init__(message)
 
 
+class ProcessExited(RuntimeError):
+    """A process exited while it was waited for"""
+
+
+class RemoteExecuteError(RuntimeError):
+    """Remote execution failed on some of the servers"""
+
+
 class DownloadError(Exception):
     """Download attempt failed"""
 
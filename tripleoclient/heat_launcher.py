@@ -14,18 +14,25 @@
 #
 from __future__ import print_function
 
+import collections
 import datetime
-import grp
 import json
 import logging
 import os
 import pwd
+import re
+import shutil
 import signal
+import stat
 import subprocess
 import tempfile
 
+from oslo_concurrency import lockutils
 from oslo_utils import timeutils
 
+from tripleoclient import constants
+from tripleoclient import utils
+
 log = logging.getLogger(__name__)
 
 NEXT_DAY = (timeutils.utcnow() + datetime.timedelta(days=2)).isoformat()
@@ -110,6 +117,10 @@ FAKE_TOKEN_RESPONSE = {
 
 class HeatBaseLauncher(object):
 
+    # Name of the launcher in its database snapshots, those of the other
+    # launchers are kept
+    db_snapshot_kind = 'heat'
+
     # The init function will need permission to touch these files
     # and chown them accordingly for the heat user
     def __init__(self, api_port, container_image, user='heat'):
@@ -173,6 +184,84 @@ class HeatBaseLauncher(object):
         gid = int(self.get_heat_gid())
         os.chown(self.install_tmp, uid, gid)
         os.chown(self.config_file, uid, gid)
+        self.heat_uid = uid
+        self.heat_gid = gid
+        # Looked up by prepare_heat_db
+        self.db_snapshot = None
+
+    def _get_db_snapshot_path(self):
+        """Return where the migrated database of this Heat is kept
+
+        The snapshot directory is only accessible to the current user, which
+        should be root: only the copies of the database are given to the
+        Heat user. None is returned when the snapshot can't be used.
+        """
+        try:
+            version = self.get_heat_version()
+        except Exception as e:
+            log.warning('Could not get the Heat version, the database will '
+                        'be synced: %s' % e)
+            return None
+        if not version:
+            return None
+        snapshot_dir = constants.HEAT_DB_SNAPSHOT_DIR
+        try:
+            if not os.path.isdir(snapshot_dir):
+                os.makedirs(snapshot_dir, mode=0o700)
+            st = os.lstat(snapshot_dir)
+        except OSError as e:
+            log.warning('Could not create %s, the database will be synced: '
+                        '%s' % (snapshot_dir, e))
+            return None
+        if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() or
+                stat.S_IMODE(st.st_mode) & 0o077):
+            log.warning('Not using %s for the Heat database snapshot, it '
+                        'must be a directory owned by the current user with '
+                        'mode 0700' % snapshot_dir)
+            return None
+        return os.path.join(snapshot_dir, 'heat-%s-%s.sqlite' % (
+            self.db_snapshot_kind, re.sub(r'[^\w.-]', '_', version)))
+
+    def prepare_heat_db(self):
+        """Create the database of Heat
+
+        It is copied from the snapshot taken after the last db_sync of the
+        same Heat version. Otherwise db_sync is run and its result becomes
+        the snapshot. This must be called as root, the database is then
+        given to the Heat user.
+        """
+        # The connection in heat.conf adds the .db suffix
+        sql_db_file = '%s.db' % self.sql_db
+        self.db_snapshot = self._get_db_snapshot_path()
+        if self.db_snapshot and os.path.isfile(self.db_snapshot):
+            try:
+                shutil.copyfile(self.db_snapshot, sql_db_file)
+                if os.geteuid() == 0:
+                    os.chown(sql_db_file, self.heat_uid, self.heat_gid)
+                log.info('Heat database copied from %s' % self.db_snapshot)
+                return
+            except (IOError, OSError) as e:
+                log.warning('Could not copy the Heat database from %s, '
+                            'syncing it: %s' % (self.db_snapshot, e))
+        self.heat_db_sync()
+        if self.db_snapshot:
+            self._save_db_snapshot(sql_db_file)
+
+    def _save_db_snapshot(self, sql_db_file):
+        snapshot_dir, snapshot_name = os.path.split(self.db_snapshot)
+        prefix = 'heat-%s-' % self.db_snapshot_kind
+        try:
+            with open(sql_db_file, 'rb') as src:
+                with utils.replace_file(self.db_snapshot, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            # Only the snapshot of the current version is useful
+            for name in os.listdir(snapshot_dir):
+                if (name.startswith(prefix) and name.endswith('.sqlite') and
+                        name != snapshot_name):
+                    os.remove(os.path.join(snapshot_dir, name))
+        except (IOError, OSError) as e:
+            log.warning('Could not save the Heat database snapshot %s: %s' %
+                        (self.db_snapshot, e))
 
     def _write_heat_config(self, config_file, sqlite_db, log_file, api_port,
                            policy_file, token_file):
@@ -231,7 +320,12 @@ limit_iterators=9000
 
 class HeatDockerLauncher(HeatBaseLauncher):
 
+    db_snapshot_kind = 'docker'
+
     def __init__(self, api_port, container_image, user='heat'):
+        # The base class looks them up while it initializes
+        self._image_id = None
+        self._heat_ids = None
         super(HeatDockerLauncher, self).__init__(api_port, container_image,
                                                  user)
 
@@ -266,31 +360,92 @@ class HeatDockerLauncher(HeatBaseLauncher):
         log.debug(' '.join(cmd))
         subprocess.check_call(cmd)
 
-    def get_heat_uid(self):
+    def get_heat_version(self):
+        # The id of the image changes with its content
+        if self._image_id is None:
+            cmd = ['docker', 'inspect', '--format', '{{.Id}}',
+                   self.container_image]
+            log.debug(' '.join(cmd))
+            self._image_id = subprocess.check_output(cmd).decode(
+                'utf-8').strip()
+        return self._image_id
+
+    def _get_heat_ids(self):
+        """Return the uid and gid of the Heat user of the container image
+
+        They are looked up in a single container, and kept in
+        HEAT_IDS_CACHE_FILE for the id of the image and the user name.
+        """
+        if self._heat_ids is not None:
+            return self._heat_ids
+        try:
+            key = '%s:%s' % (self.get_heat_version(), self.user)
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.warning('Could not get the id of %s, the Heat user ids will '
+                        'not be cached: %s' % (self.container_image, e))
+            key = None
+        ids = self._read_heat_ids_cache().get(key)
+        if ids:
+            self._heat_ids = tuple(ids)
+        else:
+            self._heat_ids = self._lookup_heat_ids()
+            if key:
+                self._write_heat_ids_cache(key, self._heat_ids)
+        return self._heat_ids
+
+    def _lookup_heat_ids(self):
         cmd = [
             'docker', 'run', '--rm',
             self.container_image,
-            'getent', 'passwd', self.user
+            'sh', '-c', 'getent passwd "$0" && getent group "$0"', self.user
         ]
         log.debug(' '.join(cmd))
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        result = p.communicate()[0]
-        if result:
-            return result.split(':')[2]
-        raise Exception('Could not find heat uid')
+        result = p.communicate()[0].decode('utf-8').splitlines()
+        if len(result) < 2:
+            raise Exception('Could not find heat uid and gid')
+        return int(result[0].split(':')[2]), int(result[1].split(':')[2])
+
+    def _read_heat_ids_cache(self):
+        try:
+            with open(constants.HEAT_IDS_CACHE_FILE) as f:
+                cache = json.load(f,
+                                  object_pairs_hook=collections.OrderedDict)
+        except (IOError, ValueError):
+            return collections.OrderedDict()
+        if not isinstance(cache, dict):
+            return collections.OrderedDict()
+        return cache
+
+    def _write_heat_ids_cache(self, key, ids):
+        """Add the ids of key to HEAT_IDS_CACHE_FILE
+
+        The file is read again and replaced while holding a lock, so the ids
+        saved meanwhile by other commands are kept. Only the
+        HEAT_IDS_CACHE_SIZE ids saved last are.
+        """
+        cache_dir = os.path.dirname(constants.HEAT_IDS_CACHE_FILE)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, mode=0o700)
+            with lockutils.lock('heat-ids', external=True,
+                                lock_path=cache_dir):
+                cache = self._read_heat_ids_cache()
+                cache.pop(key, None)
+                cache[key] = list(ids)
+                while len(cache) > constants.HEAT_IDS_CACHE_SIZE:
+                    cache.popitem(last=False)
+                with utils.replace_file(constants.HEAT_IDS_CACHE_FILE) as f:
+                    json.dump(cache, f)
+        except (IOError, OSError) as e:
+            log.warning('Could not save the Heat user ids in %s: %s' %
+                        (constants.HEAT_IDS_CACHE_FILE, e))
+
+    def get_heat_uid(self):
+        return self._get_heat_ids()[0]
 
     def get_heat_gid(self):
-        cmd = [
-            'docker', 'run', '--rm',
-            self.container_image,
-            'getent', 'group', self.user
-        ]
-        log.debug(' '.join(cmd))
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        result = p.communicate()[0]
-        if result:
-            return result.split(':')[2]
-        raise Exception('Could not find heat gid')
+        return self._get_heat_ids()[1]
 
     def kill_heat(self, pid):
         cmd = ['docker', 'rm', '-f', 'heat_all']
@@ -301,6 +456,8 @@ class HeatDockerLauncher(HeatBaseLauncher):
 
 class HeatNativeLauncher(HeatBaseLauncher):
 
+    db_snapshot_kind = 'native'
+
     def __init__(self, api_port, container_image, user='heat'):
         super(HeatNativeLauncher, self).__init__(api_port, container_image,
                                                  user)
@@ -309,14 +466,28 @@ class HeatNativeLauncher(HeatBaseLauncher):
         os.execvp('heat-all', ['heat-all', '--config-file', self.config_file])
 
     def heat_db_sync(self):
+        # Run as the Heat user, which must own the database and logs
         subprocess.check_call(['heat-manage', '--config-file',
-                               self.config_file, 'db_sync'])
+                               self.config_file, 'db_sync'],
+                              preexec_fn=self._drop_privileges)
+
+    def _drop_privileges(self):
+        if os.geteuid() == 0:
+            # Don't keep the supplementary groups of root
+            os.setgroups([])
+            os.setgid(self.heat_gid)
+            os.setuid(self.heat_uid)
+
+    def get_heat_version(self):
+        return subprocess.check_output(
+            ['heat-manage', '--version'],
+            stderr=subprocess.STDOUT).decode('utf-8').strip()
 
     def get_heat_uid(self):
-        return pwd.getpwnam('heat').pw_uid
+        return pwd.getpwnam(self.user).pw_uid
 
     def get_heat_gid(self):
-        return grp.getgrnam('heat').gr_gid
+        return pwd.getpwnam(self.user).pw_gid
 
     def kill_heat(self, pid):
         os.kill(pid, signal.SIGKILL)
@@ -0,0 +1,348 @@
+#   Copyright 2018 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Concurrent transfers of objects to and from Swift"""
+
+import bz2
+from concurrent import futures
+import copy
+import logging
+import os
+import tarfile
+import threading
+import time
+import zlib
+
+from swiftclient import client as swiftclient
+from swiftclient import exceptions as swift_exc
+
+from tripleoclient import constants
+from tripleoclient import exceptions
+from tripleoclient import utils
+
+LOG = logging.getLogger(__name__)
+
+
+# Archive formats understood by Swift's extract-archive middleware
+ARCHIVE_CODECS = ('tar', 'tar.gz', 'tar.bz2')
+
+
+def get_concurrency(concurrency=None):
+    """Return the number of concurrent Swift requests to use
+
+    An explicit value takes precedence over the TRIPLEO_SWIFT_CONCURRENCY
+    environment variable, which takes precedence over the default.
+    """
+    if concurrency is None:
+        concurrency = os.environ.get('TRIPLEO_SWIFT_CONCURRENCY',
+                                     constants.SWIFT_CONCURRENCY)
+    return max(1, int(concurrency))
+
+
+def get_archive_codec(codec=None):
+    """Return the archive format to use when uploading a templates tree
+
+    An explicit value takes precedence over the TRIPLEO_PLAN_ARCHIVE_CODEC
+    environment variable, which takes precedence over the default.
+    """
+    if codec is None:
+        codec = os.environ.get('TRIPLEO_PLAN_ARCHIVE_CODEC',
+                               constants.PLAN_ARCHIVE_CODEC)
+    if codec not in ARCHIVE_CODECS:
+        raise exceptions.InvalidConfiguration(
+            "Unsupported plan archive format {0}, must be one of "
+            "{1}".format(codec, ", ".join(ARCHIVE_CODECS)))
+    return codec
+
+
+class _ConnectionPool(object):
+    """Hand out one Swift connection per worker thread
+
+    A swiftclient Connection holds a single HTTP connection and retry state,
+    so it can't be shared between threads. Each thread gets a shallow copy
+    which opens its own HTTP connection but reuses the token and endpoint.
+    The copies don't retry failed requests themselves, _run does it, so a
+    failing object isn't retried by both. Anything which isn't a swiftclient
+    Connection is shared as is.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._local = threading.local()
+
+    def get(self):
+        if not isinstance(self._connection, swiftclient.Connection):
+            return self._connection
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = copy.copy(self._connection)
+            conn.http_conn = None
+            conn.os_options = dict(self._connection.os_options)
+            conn.retries = 0
+            self._local.connection = conn
+        return conn
+
+
+def _call_with_retries(func, name, retries, backoff):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return func()
+        except swift_exc.ClientException as e:
+            if attempt > retries:
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            LOG.debug("Attempt {0} for {1} failed, retrying in {2}s: "
+                      "{3}".format(attempt, name, delay, e))
+            time.sleep(delay)
+
+
+def _run(swift_client, action, items, task, concurrency, retries, backoff):
+    """Run task(connection, *item) for each item, concurrently
+
+    Returns a dict mapping each item name (its first element) to the time
+    in seconds it took, including retries. The first failure is raised once
+    all running tasks have finished.
+    """
+    items = list(items)
+    if not items:
+        return {}
+
+    pool = _ConnectionPool(swift_client)
+    timings = {}
+
+    def run_one(item):
+        start = time.time()
+        _call_with_retries(lambda: task(pool.get(), *item), item[0],
+                           retries, backoff)
+        timings[item[0]] = time.time() - start
+        LOG.debug("{0} {1} in {2:.2f}s".format(
+            action, item[0], timings[item[0]]))
+
+    start = time.time()
+    concurrency = min(get_concurrency(concurrency), len(items))
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [executor.submit(run_one, item) for item in items]
+    for result in results:
+        result.result()
+
+    LOG.debug("{0} {1} objects in {2:.2f}s using {3} workers".format(
+        action, len(items), time.time() - start, concurrency))
+    return timings
+
+
+def _put_object(connection, name, container, contents):
+    if callable(contents):
+        contents = contents()
+    try:
+        connection.put_object(container, name, contents)
+    finally:
+        if hasattr(contents, 'close'):
+            contents.close()
+
+
+def upload_objects(swift_client, container, objects, concurrency=None,
+                   retries=constants.SWIFT_RETRIES,
+                   backoff=constants.SWIFT_RETRY_BACKOFF):
+    """Upload objects to a Swift container concurrently
+
+    :param swift_client: Instance of swiftclient
+    :type  swift_client: swiftclient.client.Connection
+
+    :param container: Name of the container to upload to
+    :type  container: string
+
+    :param objects: Iterable of (object name, contents) tuples. contents can
+                    be a string, or a callable returning a string or a file
+                    like object, which is called again on every attempt and
+                    closed after use.
+    :type  objects: iterable
+
+    :param concurrency: Maximum number of concurrent uploads
+    :type  concurrency: integer
+
+    :param retries: How many times to retry a failed upload
+    :type  retries: integer
+
+    :param backoff: Seconds to wait before the first retry, doubled on every
+                    further retry
+    :type  backoff: float
+
+    :return dict mapping object names to upload times in seconds
+    """
+    return _run(swift_client, "Uploaded",
+                ((name, container, contents) for name, contents in objects),
+                _put_object, concurrency, retries, backoff)
+
+
+def local_file(path):
+    """Return a callable which opens path for upload_objects"""
+    return lambda: open(path, 'rb')
+
+
+def delete_objects(swift_client, container, names, concurrency=None,
+                   retries=constants.SWIFT_RETRIES,
+                   backoff=constants.SWIFT_RETRY_BACKOFF):
+    """Delete objects from a Swift container concurrently
+
+    Accepts the same arguments as upload_objects, with names being an
+    iterable of object names.
+    """
+    return _run(swift_client, "Deleted",
+                ((name, container) for name in names),
+                lambda conn, name, container: conn.delete_object(
+                    container, name),
+                concurrency, retries, backoff)
+
+
+def _get_object(connection, name, container, path, chunk_size):
+    size = 0
+    body = connection.get_object(container, name,
+                                 resp_chunk_size=chunk_size)[1]
+    # A file of a linked templates tree is replaced, not written through
+    with utils.replace_file(path, 'wb') as f:
+        for chunk in body:
+            f.write(chunk)
+            size += len(chunk)
+    return size
+
+
+def download_objects(swift_client, container, objects, concurrency=None,
+                     chunk_size=constants.SWIFT_CHUNK_SIZE,
+                     retries=constants.SWIFT_RETRIES,
+                     backoff=constants.SWIFT_RETRY_BACKOFF):
+    """Download objects from a Swift container to local files concurrently
+
+    Objects are streamed to disk in chunks of chunk_size bytes rather than
+    being buffered in memory. Missing parent directories are created before
+    any download starts.
+
+    :param objects: Iterable of (object name, local path) tuples
+    :type  objects: iterable
+
+    Accepts the same other arguments as upload_objects.
+
+    :return dict mapping object names to download times in seconds
+    """
+    objects = list(objects)
+    for dirname in sorted(set(os.path.dirname(path) for _, path in objects)):
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+    sizes = {}
+
+    def get_object(connection, name, container, path):
+        sizes[name] = _get_object(connection, name, container, path,
+                                  chunk_size)
+
+    start = time.time()
+    timings = _run(swift_client, "Downloaded",
+                   ((name, container, path) for name, path in objects),
+                   get_object, concurrency, retries, backoff)
+    if objects:
+        elapsed = max(time.time() - start, 0.001)
+        total = sum(sizes.values())
+        LOG.info("Downloaded {0} objects ({1:.1f} KiB) from {2} in {3:.2f}s, "
+                 "{4:.1f} KiB/s".format(len(objects), total / 1024.0,
+                                        container, elapsed,
+                                        total / 1024.0 / elapsed))
+    return timings
+
+
+class _StreamBuffer(object):
+    """Write only file like object collecting the output of tarfile"""
+
+    def __init__(self, compressor=None):
+        self._chunks = []
+        self._compressor = compressor
+        self.size = 0
+
+    def write(self, data):
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        if data:
+            self._chunks.append(data)
+            self.size += len(data)
+
+    def close(self):
+        if self._compressor is not None:
+            self._chunks.append(self._compressor.flush())
+            self._compressor = None
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def archive_stream(files, codec='tar', chunk_size=constants.SWIFT_CHUNK_SIZE):
+    """Generate a tar archive of local files without writing it to disk
+
+    :param files: dict mapping names in the archive to local paths
+    :type  files: dict
+
+    :param codec: One of ARCHIVE_CODECS
+    :type  codec: string
+
+    :param chunk_size: Approximate size of the generated chunks
+    :type  chunk_size: integer
+    """
+    compressor = None
+    if codec == 'tar.gz':
+        # wbits of 16 + MAX_WBITS writes a gzip header and trailer
+        compressor = zlib.compressobj(constants.PLAN_ARCHIVE_COMPRESS_LEVEL,
+                                      zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif codec == 'tar.bz2':
+        compressor = bz2.BZ2Compressor(constants.PLAN_ARCHIVE_COMPRESS_LEVEL)
+
+    buf = _StreamBuffer(compressor)
+    tar = tarfile.open(fileobj=buf, mode='w|')
+    for name in sorted(files):
+        tar.add(files[name], arcname=name, recursive=False)
+        if buf.size >= chunk_size:
+            yield buf.pop()
+    tar.close()
+    buf.close()
+    data = buf.pop()
+    if data:
+        yield data
+
+
+def upload_archive(swift_client, container, files, codec=None,
+                   chunk_size=constants.SWIFT_CHUNK_SIZE):
+    """Upload local files to a container using Swift's extract-archive
+
+    The archive is generated while it is being uploaded with a chunked
+    transfer, so it is never written to disk or held in memory as a whole.
+
+    :param files: dict mapping object names to local paths
+    :type  files: dict
+
+    :param codec: One of ARCHIVE_CODECS, see get_archive_codec
+    :type  codec: string
+    """
+    codec = get_archive_codec(codec)
+    start = time.time()
+    swift_client.put_object(
+        container=container,
+        obj='',
+        contents=archive_stream(files, codec, chunk_size),
+        query_string='extract-archive={0}'.format(codec),
+        headers={'X-Detect-Content-Type': 'true'}
+    )
+    LOG.debug("Uploaded {0} files to {1} as a {2} stream in {3:.2f}s".format(
+        len(files), container, codec, time.time() - start))
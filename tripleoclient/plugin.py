@@ -15,16 +15,23 @@
 
 """OpenStackClient Plugin interface"""
 
+import atexit
+import collections
 import json
 import logging
 import socket
+import threading
+import time
 import uuid
 
 from osc_lib import utils
 from swiftclient import client as swift_client
 import websocket
 
+from tripleoclient import constants
 from tripleoclient import exceptions
+from tripleoclient.workflows import base as workflows_base
+from tripleoclient.workflows import timing
 
 LOG = logging.getLogger(__name__)
 
@@ -65,13 +72,69 @@ def build_option_parser(parser):
     return parser
 
 
-class WebsocketClient(object):
+def _execution_id(message):
+    try:
+        return message['body']['payload']['execution']['id']
+    except (KeyError, TypeError):
+        return None
+
+
+def _root_execution_id(message):
+    """Return the id of the top level execution a message is about
 
-    def __init__(self, instance, queue_name="tripleo"):
+    Only newer versions of Mistral give it, None is returned otherwise.
+    """
+    try:
+        return message['body']['payload']['execution']['root_execution_id']
+    except (KeyError, TypeError):
+        return None
+
+
+def _payload_key(payload):
+    return json.dumps(payload, sort_keys=True)
+
+
+class _WebsocketConnection(object):
+    """A Zaqar websocket subscribed to a queue
+
+    The connection is shared by all the WebsocketClients returned for the
+    queue, so the authentication and subscription are only done once per
+    process. There is no reader thread: whichever client is waiting for a
+    message reads from the socket and dispatches what it receives.
+
+    Messages about an execution a client is waiting for, or about one of its
+    sub-workflows when Mistral gives their root execution, are only given to
+    that client. Messages about executions nobody claimed yet are kept, so a
+    client which starts a workflow before waiting for it gets all of them.
+    Other messages, e.g. from sub-workflows with no known root execution, are
+    also given to every open client, just like when each of them had its own
+    subscription. That is delayed while a new client may still claim them:
+    a client is expected to start its workflow after being created, and
+    until it waits for its execution, no message is given to the others.
+    A client which doesn't do so within ZAQAR_CLAIM_TIMEOUT seconds, e.g.
+    because starting its workflow failed and it was never cleaned up, stops
+    delaying them. At most ZAQAR_UNCLAIMED_MESSAGES messages are kept for
+    each client, so one which is never read doesn't grow without limit.
+    """
+
+    def __init__(self, instance, queue_name="tripleo", subscribe=True):
+        self._instance = instance
         self._project_id = None
         self._ws = None
         self._websocket_client_id = None
         self._queue_name = queue_name
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._clients = []
+        self._claims = {}
+        # Clients which may start an execution they haven't claimed yet,
+        # with the time they were registered at
+        self._expecting = {}
+        self._unclaimed = collections.deque(
+            maxlen=constants.ZAQAR_UNCLAIMED_MESSAGES)
+        self._held = collections.deque(
+            maxlen=constants.ZAQAR_UNCLAIMED_MESSAGES)
+        self.closed = False
 
         endpoint = instance.get_endpoint_for_service_type(
             'messaging-websocket')
@@ -82,25 +145,21 @@ class WebsocketClient(object):
         self._websocket_client_id = str(uuid.uuid4())
 
         LOG.debug('Instantiating messaging websocket client: %s', endpoint)
-        try:
-            self._ws = websocket.create_connection(endpoint)
-        except socket.error:
-            LOG.error("Could not establish a connection to the Zaqar "
-                      "websocket. The command was sent but the answer "
-                      "could not be read.")
-            raise
+        self._ws = websocket.create_connection(endpoint)
 
         self.send('authenticate', extra_headers={'X-Auth-Token': token})
 
         # create and subscribe to a queue
         # NOTE: if the queue exists it will 204
         self.send('queue_create', {'queue_name': queue_name})
-        self.send('subscription_create', {
-            'queue_name': queue_name,
-            'ttl': 10000
-        })
-
-    def cleanup(self):
+        if subscribe:
+            self.send('subscription_create', {
+                'queue_name': queue_name,
+                'ttl': 10000
+            })
+
+    def close(self):
+        self.closed = True
         self._ws.close()
 
     def send(self, action, body=None, extra_headers=None):
@@ -125,7 +184,206 @@ class WebsocketClient(object):
     def recv(self):
         return json.loads(self._ws.recv())
 
-    def wait_for_messages(self, timeout=None):
+    def list_messages(self):
+        """Return the messages still in the queue, oldest first
+
+        Zaqar only gives the next messages of a queue to a new claim, so the
+        queue is read by claiming batches of messages until none is left.
+        The claims are then released. This must not be used on a subscribed
+        connection, where the answers could be mixed with the messages.
+        """
+        messages = []
+        claims = []
+        try:
+            while True:
+                data = self.send('claim_create', {
+                    'queue_name': self._queue_name,
+                    'ttl': constants.ZAQAR_REPLAY_CLAIM_TTL,
+                    'grace': constants.ZAQAR_REPLAY_CLAIM_TTL,
+                    'limit': constants.ZAQAR_REPLAY_BATCH_SIZE,
+                })
+                body = data.get('body') or {}
+                if not body.get('messages'):
+                    break
+                claims.append(body['claim_id'])
+                messages.extend(body['messages'])
+        finally:
+            for claim_id in claims:
+                self.send('claim_delete', {'queue_name': self._queue_name,
+                                           'claim_id': claim_id})
+        return messages
+
+    def register(self, client):
+        with self._lock:
+            self._clients.append(client)
+            self._expecting[client] = time.time()
+
+    def unregister(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+            for execution_id, owner in list(self._claims.items()):
+                if owner is client:
+                    del self._claims[execution_id]
+            self._stop_expecting(client)
+
+    def claim(self, client, execution_id):
+        """Route the messages about execution_id to client only
+
+        The messages already received about it are given to client. The
+        execution_id can be None for a client which doesn't wait for a
+        particular execution.
+        """
+        with self._lock:
+            if execution_id is not None:
+                self._claims[execution_id] = client
+                unclaimed = list(self._unclaimed)
+                self._unclaimed.clear()
+                for key, message in unclaimed:
+                    if key == execution_id:
+                        client.messages.append(message)
+                    else:
+                        self._unclaimed.append((key, message))
+                held = list(self._held)
+                self._held.clear()
+                self._held.extend((key, message) for key, message in held
+                                  if key != execution_id)
+            self._stop_expecting(client)
+
+    def _stop_expecting(self, client):
+        self._expecting.pop(client, None)
+        if not self._expecting:
+            while self._held:
+                key, message = self._held.popleft()
+                self._broadcast(message)
+
+    def _broadcast(self, message):
+        for client in self._clients:
+            if client not in self._expecting:
+                client.messages.append(message)
+
+    def _expire_expecting(self):
+        expired = time.time() - constants.ZAQAR_CLAIM_TIMEOUT
+        for client, registered in list(self._expecting.items()):
+            if registered < expired:
+                LOG.debug("No execution claimed after %s seconds, not "
+                          "holding messages back anymore",
+                          constants.ZAQAR_CLAIM_TIMEOUT)
+                self._stop_expecting(client)
+
+    def _dispatch(self, message):
+        execution_id = _execution_id(message)
+        root_execution_id = _root_execution_id(message)
+        owner = (self._claims.get(execution_id) or
+                 self._claims.get(root_execution_id))
+        if owner is not None:
+            owner.messages.append(message)
+            return
+        key = root_execution_id or execution_id
+        self._unclaimed.append((key, message))
+        if root_execution_id is not None:
+            # Its owner hasn't claimed it yet
+            return
+        self._expire_expecting()
+        if self._expecting:
+            self._held.append((key, message))
+        else:
+            self._broadcast(message)
+
+    def read(self, client, deadline=None):
+        """Receive and dispatch one message, unless client already has one
+
+        The socket is read for at most ZAQAR_READ_INTERVAL seconds at a time
+        while holding the read lock, so the other clients waiting to read get
+        a chance to find what was dispatched to them and to read with their
+        own deadline. WebSocketTimeoutException is raised once deadline, a
+        time.time(), is reached.
+        """
+        while True:
+            with self._read_lock:
+                with self._lock:
+                    if client.messages:
+                        return
+                wait = constants.ZAQAR_READ_INTERVAL
+                if deadline is not None:
+                    left = deadline - time.time()
+                    if left <= 0:
+                        raise websocket.WebSocketTimeoutException(
+                            "No message received before the deadline")
+                    wait = min(wait, left)
+                self._ws.settimeout(wait)
+                try:
+                    message = self.recv()
+                except websocket.WebSocketTimeoutException:
+                    continue
+                except Exception:
+                    # Let the next client get a new connection
+                    self.closed = True
+                    raise
+                with self._lock:
+                    self._dispatch(message)
+                return
+
+
+class WebsocketClient(object):
+    """A client for the messages of a Zaqar queue
+
+    Clients of the same queue share a single _WebsocketConnection, so
+    creating one doesn't need any request to Zaqar.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._queue_name = connection._queue_name
+        self.messages = collections.deque(
+            maxlen=constants.ZAQAR_UNCLAIMED_MESSAGES)
+        self._warned_no_timeout = False
+        self._replayed = collections.Counter()
+        connection.register(self)
+
+    def cleanup(self):
+        self._connection.unregister(self)
+
+    def send(self, action, body=None, extra_headers=None):
+        return self._connection.send(action, body, extra_headers)
+
+    def recv(self, timeout=None, deadline=None):
+        if timeout is not None:
+            end = time.time() + timeout
+            deadline = end if deadline is None else min(deadline, end)
+        while not self.messages:
+            self._connection.read(self, deadline)
+        return self.messages.popleft()
+
+    def replay(self, execution_id):
+        """Return the payloads about execution_id still in the queue
+
+        This is used to reattach to an execution after the client waiting for
+        it was disconnected. The execution is claimed first, so the messages
+        sent while the queue is read are not lost. Those also read from the
+        queue are then not given again by wait_for_messages.
+        """
+        self._connection.claim(self, execution_id)
+        connection = _WebsocketConnection(self._connection._instance,
+                                          self._queue_name, subscribe=False)
+        try:
+            messages = connection.list_messages()
+        finally:
+            connection.close()
+
+        payloads = []
+        for message in messages:
+            if _execution_id(message) != execution_id:
+                continue
+            payload = message['body']['payload']
+            self._replayed[_payload_key(payload)] += 1
+            payloads.append(payload)
+        LOG.debug("Replayed {} messages about execution {}".format(
+            len(payloads), execution_id))
+        return payloads
+
+    def wait_for_messages(self, timeout=None, execution_id=None,
+                          deadline=None):
         """Wait for messages on a Zaqar queue
 
         A timeout can be provided in seconds, if no timeout is provided it
@@ -136,19 +394,36 @@ class WebsocketClient(object):
         If no timeout is provided this method will never stop waiting for new
         messages. It is the responsibility of the consumer to stop consuming
         messages.
+
+        When an execution_id is given, messages about that execution are only
+        given to this client and not to the other clients of the queue.
+
+        The timeout starts again with every message. A deadline can also be
+        given, as the time.time() after which no message is waited for.
         """
 
-        if timeout is None:
+        if (timeout is None and deadline is None and
+                not self._warned_no_timeout):
             LOG.warning("Waiting for messages on queue '{}' with no timeout."
                         .format(self._queue_name))
+            self._warned_no_timeout = True
 
-        self._ws.settimeout(timeout)
+        self._connection.claim(self, execution_id)
 
         while True:
             try:
-                message = self.recv()
+                message = self.recv(timeout, deadline)
                 LOG.debug(message)
-                yield message['body']['payload']
+                payload = message['body']['payload']
+                if self._replayed:
+                    key = _payload_key(payload)
+                    if key in self._replayed:
+                        # Already given by replay()
+                        self._replayed[key] -= 1
+                        if not self._replayed[key]:
+                            del self._replayed[key]
+                        continue
+                yield payload
             except websocket.WebSocketTimeoutException:
                 raise exceptions.WebSocketTimeout()
 
@@ -167,6 +442,8 @@ class ClientWrapper(object):
         self._instance = instance
         self._object_store = None
         self._local_orchestration = None
+        self._websocket_connections = {}
+        self._websocket_unavailable = False
 
     def local_orchestration(self, api_port):
         """Returns an local_orchestration service client"""
@@ -196,8 +473,35 @@ class ClientWrapper(object):
         return self._local_orchestration
 
     def messaging_websocket(self, queue_name='tripleo'):
-        """Returns a websocket for the messaging service"""
-        return WebsocketClient(self._instance, queue_name)
+        """Returns a websocket for the messaging service
+
+        The websockets for a queue share a single connection, which is
+        created on first use and closed when the process exits.
+
+        If the Zaqar websocket can't be reached, a client polling Mistral for
+        the end of the workflows is returned instead, for the rest of the
+        process.
+        """
+        if self._websocket_unavailable:
+            return workflows_base.PollingClient(
+                self._instance.workflow_engine)
+        connection = self._websocket_connections.get(queue_name)
+        if connection is None or connection.closed:
+            start = time.time()
+            try:
+                connection = _WebsocketConnection(self._instance, queue_name)
+            except (socket.error, websocket.WebSocketException):
+                LOG.warning("Could not establish a connection to the Zaqar "
+                            "websocket. Polling Mistral for the state of the "
+                            "workflows instead, their progress will not be "
+                            "shown.")
+                self._websocket_unavailable = True
+                return workflows_base.PollingClient(
+                    self._instance.workflow_engine)
+            timing.record('queue_setup', queue_name, time.time() - start)
+            self._websocket_connections[queue_name] = connection
+            atexit.register(connection.close)
+        return WebsocketClient(connection)
 
     @property
     def object_store(self):
@@ -0,0 +1,557 @@
+#   Copyright 2018 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""In-process stand-ins for the Mistral, Zaqar and Swift services
+
+They implement the subset of the APIs tripleoclient uses, behind the objects
+it talks to: the Mistral client, the websocket-client connection read by
+plugin.WebsocketClient and the swiftclient Connection. Everything above them,
+including the Zaqar protocol handling, is the real client code.
+
+Every API call waits for api_latency seconds and the workflows wait for
+message_interval seconds before each message they send, so the client side
+overhead of the workflows can be measured without an undercloud.
+"""
+
+import collections
+import copy
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+import threading
+import time
+import uuid
+
+import mock
+import six
+from six.moves import queue
+from swiftclient import exceptions as swift_exc
+import websocket
+import yaml
+
+from tripleoclient import constants
+from tripleoclient import plugin
+from tripleoclient.workflows import baremetal
+from tripleoclient.workflows import deployment
+from tripleoclient.workflows import plan_management
+
+LOG = logging.getLogger(__name__)
+
+
+def _md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def _read(contents):
+    if isinstance(contents, six.text_type):
+        return contents.encode('utf-8')
+    if isinstance(contents, six.binary_type):
+        return contents
+    if hasattr(contents, 'read'):
+        return _read(contents.read())
+    return b''.join(_read(chunk) for chunk in contents)
+
+
+class FakeSwift(object):
+    """A swiftclient Connection storing the objects in memory"""
+
+    def __init__(self, services):
+        self._services = services
+        self._lock = threading.Lock()
+        self.containers = {}
+        self.headers = {}
+        self.calls = collections.Counter()
+
+    def _call(self, name):
+        self._services.wait()
+        with self._lock:
+            self.calls[name] += 1
+
+    def _objects(self, container):
+        try:
+            return self.containers[container]
+        except KeyError:
+            raise swift_exc.ClientException('Container not found',
+                                            http_status=404)
+
+    def put_container(self, container, headers=None, **kwargs):
+        self._call('put_container')
+        with self._lock:
+            self.containers.setdefault(container, {})
+            self.headers.setdefault(container, {}).update(headers or {})
+
+    def get_container(self, container, full_listing=False, **kwargs):
+        self._call('get_container')
+        with self._lock:
+            listing = [{'name': name, 'hash': _md5(data),
+                        'bytes': len(data)}
+                       for name, data in sorted(
+                           self._objects(container).items())]
+            return dict(self.headers.get(container, {})), listing
+
+    def delete_container(self, container, **kwargs):
+        self._call('delete_container')
+        with self._lock:
+            self._objects(container)
+            del self.containers[container]
+            self.headers.pop(container, None)
+
+    def put_object(self, container, obj, contents, query_string=None,
+                   headers=None, **kwargs):
+        self._call('put_object')
+        data = _read(contents)
+        with self._lock:
+            objects = self._objects(container)
+            if query_string and query_string.startswith('extract-archive'):
+                tar = tarfile.open(fileobj=io.BytesIO(data), mode='r:*')
+                for member in tar.getmembers():
+                    if member.isfile():
+                        objects[member.name] = tar.extractfile(member).read()
+                tar.close()
+            else:
+                objects[obj] = data
+        return _md5(data)
+
+    def get_object(self, container, obj, resp_chunk_size=None, **kwargs):
+        self._call('get_object')
+        with self._lock:
+            try:
+                data = self._objects(container)[obj]
+            except KeyError:
+                raise swift_exc.ClientException('Object not found',
+                                                http_status=404)
+        headers = {'etag': _md5(data), 'content-length': str(len(data))}
+        if resp_chunk_size:
+            return headers, iter([data[i:i + resp_chunk_size] for i in
+                                  range(0, len(data), resp_chunk_size)])
+        return headers, data
+
+    def head_object(self, container, obj, **kwargs):
+        return self.get_object(container, obj)[0]
+
+    def delete_object(self, container, obj, **kwargs):
+        self._call('delete_object')
+        with self._lock:
+            try:
+                del self._objects(container)[obj]
+            except KeyError:
+                raise swift_exc.ClientException('Object not found',
+                                                http_status=404)
+
+
+class FakeExecution(object):
+
+    def __init__(self, workflow_name, workflow_input):
+        self.id = str(uuid.uuid4())
+        self.workflow_name = workflow_name
+        self.input = json.dumps(workflow_input)
+        self.state = 'RUNNING'
+        self.state_info = None
+        self.output = '{}'
+
+
+class _FakeExecutions(object):
+
+    def __init__(self, services):
+        self._services = services
+        self._executions = {}
+        self._threads = []
+
+    def create(self, identifier, workflow_input=None, **kwargs):
+        self._services.calls['executions.create'] += 1
+        self._services.wait()
+        workflow_input = workflow_input or {}
+        execution = FakeExecution(identifier, workflow_input)
+        self._executions[execution.id] = execution
+        thread = threading.Thread(target=self._run,
+                                  args=(execution, workflow_input))
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+        return copy.copy(execution)
+
+    def get(self, id):
+        self._services.calls['executions.get'] += 1
+        self._services.wait()
+        return copy.copy(self._executions[id])
+
+    def _run(self, execution, workflow_input):
+        services = self._services
+        queue_name = workflow_input.get('queue_name', 'tripleo')
+        workflow = services.workflows.get(execution.workflow_name,
+                                          _default_workflow)
+        payload = {}
+        try:
+            for payload in workflow(services, workflow_input):
+                time.sleep(services.message_interval)
+                payload = dict(payload, execution={'id': execution.id})
+                payload.setdefault('status', 'RUNNING')
+                services.zaqar.post(queue_name, {
+                    'type': execution.workflow_name, 'payload': payload})
+        except Exception as e:
+            LOG.exception("Fake workflow %s failed", execution.workflow_name)
+            execution.state_info = str(e)
+            payload = {'status': 'FAILED', 'message': str(e),
+                       'execution': {'id': execution.id}}
+            services.zaqar.post(queue_name, {
+                'type': execution.workflow_name, 'payload': payload})
+        # Like on Mistral, the execution ends after its messages are sent,
+        # so the client should not find it finished before reading them
+        services.zaqar.wait_read(queue_name)
+        execution.output = json.dumps(payload)
+        execution.state = ('SUCCESS' if payload.get('status') == 'SUCCESS'
+                           else 'ERROR')
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+class _FakeActionExecutions(object):
+
+    def __init__(self, services):
+        self._services = services
+
+    def create(self, action, input_=None, save_result=False, run_sync=False,
+               **kwargs):
+        self._services.calls['action_executions.create'] += 1
+        self._services.wait()
+        result = mock.Mock(state='SUCCESS')
+        try:
+            output = self._services.actions.get(action, _default_action)(
+                self._services, **(input_ or {}))
+        except Exception as e:
+            result.state = 'ERROR'
+            output = str(e)
+        result.output = json.dumps({'result': output})
+        return result
+
+
+class FakeMistral(object):
+    """A Mistral client running the workflows in threads"""
+
+    def __init__(self, services):
+        self.executions = _FakeExecutions(services)
+        self.action_executions = _FakeActionExecutions(services)
+
+
+class FakeZaqarWebsocket(object):
+    """A websocket-client connection to the fake Zaqar"""
+
+    def __init__(self, zaqar):
+        self._zaqar = zaqar
+        self._incoming = queue.Queue()
+        self._timeout = None
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def send(self, data):
+        request = json.loads(data)
+        action = request['action']
+        body = request.get('body') or {}
+        self._zaqar.services.wait()
+        response = {'request': request, 'headers': {'status': 201}}
+        if action == 'claim_create':
+            claim_id, messages = self._zaqar.claim(body['queue_name'],
+                                                   body.get('limit', 10))
+            if messages:
+                response['body'] = {'claim_id': claim_id,
+                                    'messages': messages}
+            else:
+                response['headers']['status'] = 204
+        elif action == 'claim_delete':
+            self._zaqar.release(body['queue_name'], body['claim_id'])
+            response['headers']['status'] = 204
+        self._incoming.put(response)
+        # Subscribe after answering, so the answer comes first
+        if action == 'subscription_create':
+            self._zaqar.subscribe(body['queue_name'], self)
+
+    def push(self, message):
+        self._incoming.put(message)
+
+    def read(self):
+        """Whether all the messages sent to the client were received"""
+        return self._incoming.empty()
+
+    def recv(self):
+        try:
+            message = self._incoming.get(timeout=self._timeout)
+        except queue.Empty:
+            raise websocket.WebSocketTimeoutException('Connection timed out')
+        return json.dumps(message)
+
+    def close(self):
+        self._zaqar.unsubscribe(self)
+
+
+class FakeZaqar(object):
+    """Zaqar queues, their subscriptions and claims"""
+
+    def __init__(self, services):
+        self.services = services
+        self._lock = threading.Lock()
+        self.queues = collections.defaultdict(list)
+        self._subscribers = collections.defaultdict(list)
+
+    def connect(self, endpoint, **kwargs):
+        self.services.calls['websocket.connect'] += 1
+        self.services.wait()
+        return FakeZaqarWebsocket(self)
+
+    def subscribe(self, queue_name, ws):
+        with self._lock:
+            self._subscribers[queue_name].append(ws)
+
+    def unsubscribe(self, ws):
+        with self._lock:
+            for subscribers in self._subscribers.values():
+                if ws in subscribers:
+                    subscribers.remove(ws)
+
+    def post(self, queue_name, body):
+        with self._lock:
+            self.queues[queue_name].append(
+                {'id': str(uuid.uuid4()), 'body': body, 'claim_id': None})
+            subscribers = list(self._subscribers[queue_name])
+        for ws in subscribers:
+            ws.push({'body': body, 'headers': {'status': 200}})
+
+    def wait_read(self, queue_name, timeout=5):
+        """Wait until the subscribers of the queue read all its messages"""
+        with self._lock:
+            subscribers = list(self._subscribers[queue_name])
+        deadline = time.time() + timeout
+        for ws in subscribers:
+            while not ws.read() and time.time() < deadline:
+                time.sleep(0.001)
+
+    def claim(self, queue_name, limit):
+        claim_id = str(uuid.uuid4())
+        with self._lock:
+            messages = [m for m in self.queues[queue_name]
+                        if m['claim_id'] is None][:limit]
+            for message in messages:
+                message['claim_id'] = claim_id
+            return claim_id, [{'id': m['id'], 'body': m['body']}
+                              for m in messages]
+
+    def release(self, queue_name, claim_id):
+        with self._lock:
+            for message in self.queues[queue_name]:
+                if message['claim_id'] == claim_id:
+                    message['claim_id'] = None
+
+
+class _FakeInstance(object):
+    """The parts of the OSC client manager used by plugin.ClientWrapper"""
+
+    _region_name = 'regionOne'
+    session = None
+
+    def __init__(self, services):
+        self.workflow_engine = services.mistral
+        self.auth = mock.Mock()
+        self.auth.get_token.return_value = 'TOKEN'
+        self.auth_ref = mock.Mock(project_id='PROJECT')
+
+    def get_endpoint_for_service_type(self, service_type, **kwargs):
+        return 'ws://fake-zaqar' if service_type == 'messaging-websocket' \
+            else 'http://fake-swift'
+
+
+class FakeServices(object):
+    """Mistral, Zaqar and Swift stand-ins sharing one latency setting
+
+    Use it as a context manager, so websocket connections are made to the
+    fake Zaqar, and pass the result of client_manager() to the functions of
+    tripleoclient.workflows.
+
+    workflows and actions map Mistral workflow and action names to functions
+    called with the services and the input. Workflow functions yield the
+    payloads of the messages they send; the last one gives the status.
+    """
+
+    def __init__(self, api_latency=0.0, message_interval=0.0):
+        self.api_latency = api_latency
+        self.message_interval = message_interval
+        self.calls = collections.Counter()
+        self.swift = FakeSwift(self)
+        self.mistral = FakeMistral(self)
+        self.zaqar = FakeZaqar(self)
+        self.workflows = dict(WORKFLOWS)
+        self.actions = dict(ACTIONS)
+        self._wrapper = None
+        self._patch = mock.patch('websocket.create_connection',
+                                 self.zaqar.connect)
+
+    def wait(self):
+        if self.api_latency:
+            time.sleep(self.api_latency)
+
+    def client_manager(self):
+        """Return a client manager using the fake services
+
+        Each call returns a new ClientWrapper, so a new websocket connection
+        is opened by the first workflow using it. The connections of the
+        previous one are closed, as they would be at the end of a command.
+        """
+        self._close_connections()
+        self._wrapper = plugin.ClientWrapper(_FakeInstance(self))
+        self._wrapper._object_store = self.swift
+        return mock.Mock(workflow_engine=self.mistral,
+                         tripleoclient=self._wrapper)
+
+    def _close_connections(self):
+        if self._wrapper is not None:
+            for connection in self._wrapper._websocket_connections.values():
+                if not connection.closed:
+                    connection.close()
+
+    def api_calls(self):
+        """Return a Counter of the calls made to every service"""
+        calls = collections.Counter(self.calls)
+        calls.update(dict(('swift.' + name, count)
+                          for name, count in self.swift.calls.items()))
+        return calls
+
+    def __enter__(self):
+        self._patch.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.mistral.executions.join()
+        self._close_connections()
+        self._patch.stop()
+
+
+def _default_workflow(services, workflow_input):
+    yield {'status': 'SUCCESS', 'message': 'Done.'}
+
+
+def _default_action(services, **input_):
+    return None
+
+
+def _create_container(services, container):
+    if container in services.swift.containers:
+        return "A container with the name %s already exists." % container
+    services.swift.put_container(
+        container, headers={'x-container-meta-usage-tripleo': 'plan'})
+
+
+def _process_plan(services, workflow_input):
+    container = workflow_input['container']
+    yield {'message': 'Processing templates in the directory /tmp/plan'}
+    _, plan_env = services.swift.get_object(container,
+                                            constants.PLAN_ENVIRONMENT)
+    env = yaml.safe_load(plan_env) or {}
+    env.setdefault('passwords', {}).setdefault('AdminPassword', 'fake')
+    services.swift.put_object(container, constants.PLAN_ENVIRONMENT,
+                              yaml.safe_dump(env, default_flow_style=False))
+    yield {'status': 'SUCCESS', 'message': 'Plan updated.'}
+
+
+def _deploy_plan(services, workflow_input):
+    yield {'message': 'Processing templates in the directory /tmp/plan'}
+    yield {'message': 'Creating the stack'}
+    yield {'status': 'SUCCESS', 'message': 'Stack create started'}
+
+
+def _register_or_update(services, workflow_input):
+    nodes = []
+    for node in workflow_input['nodes_json']:
+        nodes.append({'uuid': str(uuid.uuid4()), 'name': node.get('name')})
+        yield {'message': 'Registered node %s' % nodes[-1]['uuid']}
+    yield {'status': 'SUCCESS', 'message': 'Nodes registered.',
+           'registered_nodes': nodes}
+
+
+def _per_node(message):
+    def workflow(services, workflow_input):
+        for node_uuid in workflow_input['node_uuids']:
+            yield {'message': message % node_uuid}
+        yield {'status': 'SUCCESS', 'message': 'Done.'}
+    return workflow
+
+
+WORKFLOWS = {
+    'tripleo.plan_management.v1.create_deployment_plan': _process_plan,
+    'tripleo.plan_management.v1.update_deployment_plan': _process_plan,
+    'tripleo.deployment.v1.deploy_plan': _deploy_plan,
+    'tripleo.baremetal.v1.register_or_update': _register_or_update,
+    'tripleo.baremetal.v1.introspect': _per_node(
+        'Introspection of node %s completed.'),
+    'tripleo.baremetal.v1.provide': _per_node('Node %s is available.'),
+}
+
+ACTIONS = {
+    'tripleo.plan.create_container': _create_container,
+}
+
+
+def make_templates(path, count=100, size=1024):
+    """Write a fake templates tree of count files to path"""
+    for i in range(count):
+        dirname = os.path.join(path, 'dir%d' % (i % 10))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(os.path.join(dirname, 'template%d.yaml' % i), 'w') as f:
+            f.write('heat_template_version: rocky\n')
+            f.write('description: %s\n' % ('x' * size))
+    with open(os.path.join(path, constants.PLAN_ENVIRONMENT), 'w') as f:
+        yaml.safe_dump({'version': 1.0, 'name': 'overcloud',
+                        'environments': []}, f, default_flow_style=False)
+
+
+def create_plan(services, tht_root, name='overcloud'):
+    plan_management.create_plan_from_templates(
+        services.client_manager(), name, tht_root)
+
+
+def update_plan(services, tht_root, name='overcloud'):
+    plan_management.update_plan_from_templates(
+        services.client_manager(), name, tht_root)
+
+
+def deploy(services, tht_root, name='overcloud'):
+    deployment.deploy(LOG, services.client_manager(), container=name,
+                      run_validations=False, skip_deploy_identifier=False,
+                      timeout=240)
+
+
+def register_and_provide_nodes(services, tht_root, count=10):
+    clients = services.client_manager()
+    nodes = baremetal.register_or_update(
+        clients, nodes_json=[{'name': 'node%d' % i} for i in range(count)],
+        instance_boot_option='local')
+    node_uuids = [node['uuid'] for node in nodes]
+    baremetal.introspect(clients, node_uuids=node_uuids,
+                         run_validations=False)
+    baremetal.provide(clients, node_uuids=node_uuids)
+
+
+# Scenarios run by test_benchmark_workflows, in this order. The plan
+# is created by the first one and used by the next ones.
+SCENARIOS = collections.OrderedDict([
+    ('create_plan', create_plan),
+    ('update_plan', update_plan),
+    ('deploy', deploy),
+    ('baremetal', register_and_provide_nodes),
+])
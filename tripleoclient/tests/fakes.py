@@ -44,7 +44,7 @@ class FakeClientManager(object):
 
 class FakeWebSocket(object):
 
-    def wait_for_messages(self, timeout=None):
+    def wait_for_messages(self, timeout=None, execution_id=None):
         yield {
             'execution': {'id': 'IDID'},
             'status': 'SUCCESS',
@@ -0,0 +1,108 @@
+#   Copyright 2018 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Measure the client side overhead of the workflows
+
+The plan, deployment and baremetal workflows are run against the in-process
+services of fake_services, with a configurable latency for every API call,
+and the time they take is printed for each scenario. This is only run by
+``tox -e bench``, which sets TRIPLEO_BENCHMARK. It is configured with these
+environment variables:
+
+TRIPLEO_BENCHMARK_API_LATENCY
+    Seconds waited by every API call, 0.005 by default.
+TRIPLEO_BENCHMARK_MESSAGE_INTERVAL
+    Seconds waited by the workflows before each message they send, 0 by
+    default.
+TRIPLEO_BENCHMARK_TEMPLATES
+    Templates directory to use for the plan. A generated one is used by
+    default.
+TRIPLEO_BENCHMARK_FILES
+    Number of files of the generated templates, 500 by default.
+TRIPLEO_BENCHMARK_REPEAT
+    Number of runs of each scenario, 3 by default.
+TRIPLEO_BENCHMARK_SCENARIOS
+    Comma separated scenarios to report, all of them by default.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+import fixtures
+import testtools
+
+from tripleoclient.tests import base
+from tripleoclient.tests import fake_services
+
+
+@testtools.skipUnless(
+    os.environ.get('TRIPLEO_BENCHMARK') in base._TRUE_VALUES,
+    "Benchmarks are only run by tox -e bench")
+class TestBenchmarkWorkflows(base.TestCase):
+
+    def setUp(self):
+        super(TestBenchmarkWorkflows, self).setUp()
+        self.api_latency = float(
+            os.environ.get('TRIPLEO_BENCHMARK_API_LATENCY', 0.005))
+        self.message_interval = float(
+            os.environ.get('TRIPLEO_BENCHMARK_MESSAGE_INTERVAL', 0))
+        self.repeat = int(os.environ.get('TRIPLEO_BENCHMARK_REPEAT', 3))
+        self.names = [name for name in os.environ.get(
+            'TRIPLEO_BENCHMARK_SCENARIOS', '').split(',') if name]
+        unknown = set(self.names) - set(fake_services.SCENARIOS)
+        if unknown:
+            self.fail("Unknown scenarios: {0}".format(', '.join(unknown)))
+        self.names = self.names or list(fake_services.SCENARIOS)
+
+        self.tht_root = os.environ.get('TRIPLEO_BENCHMARK_TEMPLATES')
+        if not self.tht_root:
+            self.tht_root = self.useFixture(fixtures.TempDir()).path
+            fake_services.make_templates(
+                self.tht_root,
+                int(os.environ.get('TRIPLEO_BENCHMARK_FILES', 500)))
+
+    def test_workflows(self):
+        report = sys.stdout
+        timings = dict((name, []) for name in fake_services.SCENARIOS)
+        calls = {}
+        with open(os.devnull, 'w') as devnull:
+            for _ in range(self.repeat):
+                with fake_services.FakeServices(
+                        self.api_latency, self.message_interval) as fake:
+                    # Every scenario depends on the ones before it
+                    for name, scenario in fake_services.SCENARIOS.items():
+                        before = fake.api_calls()
+                        start = time.time()
+                        with fixtures.MonkeyPatch('sys.stdout', devnull):
+                            scenario(fake, self.tht_root)
+                        timings[name].append(time.time() - start)
+                        calls[name] = fake.api_calls() - before
+
+        print("\nAPI latency {0}s, {1} runs".format(self.api_latency,
+                                                    self.repeat),
+              file=report)
+        for name in self.names:
+            values = sorted(timings[name])
+            print("{0:12} min {1:.3f}s  median {2:.3f}s  max {3:.3f}s  "
+                  "{4} API calls".format(name, values[0],
+                                         values[len(values) // 2],
+                                         values[-1],
+                                         sum(calls[name].values())),
+                  file=report)
+            for call, count in sorted(calls[name].items()):
+                print("    {0:28} {1}".format(call, count), file=report)
@@ -0,0 +1,81 @@
+#   Copyright 2018 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import os
+
+import fixtures
+import mock
+
+from tripleoclient import constants
+from tripleoclient.tests import base
+from tripleoclient.tests import fake_services
+
+
+class TestFakeServices(base.TestCase):
+
+    def setUp(self):
+        super(TestFakeServices, self).setUp()
+        self.tht_root = self.useFixture(fixtures.TempDir()).path
+        fake_services.make_templates(self.tht_root, count=20, size=16)
+        self.useFixture(fixtures.MockPatch('sys.stdout'))
+        self.services = self.useFixture(_FakeServicesFixture()).services
+
+    def _templates(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.tht_root)
+            for root, _, names in os.walk(self.tht_root) for name in names)
+
+    def test_scenarios(self):
+        for name, scenario in fake_services.SCENARIOS.items():
+            before = self.services.api_calls()
+            scenario(self.services, self.tht_root)
+            calls = self.services.api_calls() - before
+            self.assertEqual(1, calls['websocket.connect'], name)
+            self.assertLessEqual(calls['executions.get'],
+                                 calls['executions.create'], name)
+
+        objects = self.services.swift.containers['overcloud']
+        self.assertEqual(self._templates(), sorted(objects))
+        self.assertIn(b'AdminPassword',
+                      objects[constants.PLAN_ENVIRONMENT])
+
+    def test_failed_workflow(self):
+        def failing(services, workflow_input):
+            yield {'message': 'Working'}
+            raise Exception('Boom')
+
+        self.services.workflows[
+            'tripleo.deployment.v1.deploy_plan'] = failing
+
+        self.assertRaises(ValueError, fake_services.deploy, self.services,
+                          self.tht_root)
+        execution, = self.services.mistral.executions._executions.values()
+        self.services.mistral.executions.join()
+        self.assertEqual('ERROR', execution.state)
+        self.assertEqual('Boom', execution.state_info)
+
+    def test_api_latency(self):
+        self.services.api_latency = 0.5
+        with mock.patch('time.sleep') as mock_sleep:
+            fake_services.SCENARIOS['deploy'](self.services, self.tht_root)
+        mock_sleep.assert_any_call(0.5)
+
+
+class _FakeServicesFixture(fixtures.Fixture):
+
+    def _setUp(self):
+        self.services = fake_services.FakeServices()
+        self.services.__enter__()
+        self.addCleanup(self.services.__exit__, None, None, None)
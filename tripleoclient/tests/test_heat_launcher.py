@@ -0,0 +1,239 @@
+#   Copyright 2018 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import json
+import os
+
+import fixtures
+import mock
+
+from tripleoclient import heat_launcher
+from tripleoclient.tests import base
+
+
+class TestHeatLauncherDbSnapshot(base.TestCase):
+
+    def setUp(self):
+        super(TestHeatLauncherDbSnapshot, self).setUp()
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        self.install_tmp = os.path.join(tmp_dir, 'install')
+        os.mkdir(self.install_tmp)
+        self.snapshot_dir = os.path.join(tmp_dir, 'heat-db')
+
+        isdir = os.path.isdir
+        self.useFixture(fixtures.MockPatch(
+            'os.path.isdir',
+            side_effect=lambda path: (path == '/var/log/heat-launcher' or
+                                      isdir(path))))
+        popen = self.useFixture(fixtures.MockPatch('subprocess.Popen')).mock
+        popen.return_value.communicate.return_value = ('', '')
+        popen.return_value.returncode = 0
+        self.useFixture(fixtures.MockPatch('tempfile.mkdtemp',
+                                           return_value=self.install_tmp))
+        self.chown = self.useFixture(fixtures.MockPatch('os.chown')).mock
+        self.useFixture(fixtures.MockPatch(
+            'tripleoclient.constants.HEAT_DB_SNAPSHOT_DIR',
+            self.snapshot_dir))
+        for name, value in (('get_heat_uid', 1000), ('get_heat_gid', 1000),
+                            ('get_heat_version', '11.0.0')):
+            self.useFixture(fixtures.MockPatchObject(
+                heat_launcher.HeatNativeLauncher, name, return_value=value))
+        self.db_sync = self.useFixture(fixtures.MockPatchObject(
+            heat_launcher.HeatNativeLauncher, 'heat_db_sync',
+            side_effect=self._db_sync)).mock
+
+    def _db_sync(self):
+        with open(os.path.join(self.install_tmp, 'heat.sqlite.db'), 'w') as f:
+            f.write('schema')
+
+    def _launcher(self):
+        return heat_launcher.HeatNativeLauncher(8006, 'heat-image')
+
+    def _read_db(self):
+        with open(os.path.join(self.install_tmp, 'heat.sqlite.db')) as f:
+            return f.read()
+
+    def test_prepare_heat_db_snapshot(self):
+        os.makedirs(self.snapshot_dir, 0o700)
+        old_snapshot = os.path.join(self.snapshot_dir,
+                                    'heat-native-10.0.0.sqlite')
+        docker_snapshot = os.path.join(self.snapshot_dir,
+                                       'heat-docker-sha256_1234.sqlite')
+        for path in (old_snapshot, docker_snapshot):
+            open(path, 'w').close()
+
+        launcher = self._launcher()
+        self.assertIsNone(launcher.db_snapshot)
+        launcher.prepare_heat_db()
+
+        self.db_sync.assert_called_once_with()
+        self.assertEqual(['heat-docker-sha256_1234.sqlite',
+                          'heat-native-11.0.0.sqlite'],
+                         sorted(os.listdir(self.snapshot_dir)))
+
+        db_file = os.path.join(self.install_tmp, 'heat.sqlite.db')
+        os.remove(db_file)
+        launcher = self._launcher()
+        self.chown.reset_mock()
+        launcher.prepare_heat_db()
+
+        self.db_sync.assert_called_once_with()
+        self.assertEqual('schema', self._read_db())
+        # Only the copy is given to the Heat user
+        if os.geteuid() == 0:
+            self.chown.assert_called_once_with(db_file, 1000, 1000)
+        else:
+            self.assertFalse(self.chown.called)
+
+    def test_prepare_heat_db_snapshot_dir_mode(self):
+        os.makedirs(self.snapshot_dir, 0o700)
+        os.chmod(self.snapshot_dir, 0o770)
+
+        launcher = self._launcher()
+        launcher.prepare_heat_db()
+
+        self.assertIsNone(launcher.db_snapshot)
+        self.db_sync.assert_called_once_with()
+        self.assertEqual([], os.listdir(self.snapshot_dir))
+
+    def test_prepare_heat_db_no_version(self):
+        heat_launcher.HeatNativeLauncher.get_heat_version.side_effect = (
+            OSError('No heat-manage'))
+
+        launcher = self._launcher()
+        launcher.prepare_heat_db()
+
+        self.assertIsNone(launcher.db_snapshot)
+        self.db_sync.assert_called_once_with()
+        self.assertEqual('schema', self._read_db())
+        self.assertFalse(os.path.exists(self.snapshot_dir))
+
+
+class TestHeatNativeLauncherUser(base.TestCase):
+
+    def setUp(self):
+        super(TestHeatNativeLauncherUser, self).setUp()
+        self.launcher = heat_launcher.HeatNativeLauncher.__new__(
+            heat_launcher.HeatNativeLauncher)
+        self.launcher.user = 'heat-admin'
+        self.launcher.heat_uid = 1001
+        self.launcher.heat_gid = 1002
+
+    @mock.patch('pwd.getpwnam', autospec=True)
+    def test_get_heat_ids(self, mock_getpwnam):
+        mock_getpwnam.return_value = mock.Mock(pw_uid=1001, pw_gid=1002)
+
+        self.assertEqual(1001, self.launcher.get_heat_uid())
+        self.assertEqual(1002, self.launcher.get_heat_gid())
+        mock_getpwnam.assert_called_with('heat-admin')
+
+    @mock.patch('os.setuid', autospec=True)
+    @mock.patch('os.setgid', autospec=True)
+    @mock.patch('os.setgroups', autospec=True)
+    @mock.patch('os.geteuid', autospec=True, return_value=0)
+    def test_drop_privileges(self, mock_geteuid, mock_setgroups,
+                             mock_setgid, mock_setuid):
+        calls = mock.Mock()
+        calls.attach_mock(mock_setgroups, 'setgroups')
+        calls.attach_mock(mock_setgid, 'setgid')
+        calls.attach_mock(mock_setuid, 'setuid')
+
+        self.launcher._drop_privileges()
+
+        self.assertEqual([mock.call.setgroups([]), mock.call.setgid(1002),
+                          mock.call.setuid(1001)], calls.mock_calls)
+
+
+class TestHeatDockerLauncherIds(base.TestCase):
+
+    def setUp(self):
+        super(TestHeatDockerLauncherIds, self).setUp()
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        self.install_tmp = os.path.join(tmp_dir, 'install')
+        os.mkdir(self.install_tmp)
+        self.cache_file = os.path.join(tmp_dir, 'vstate', 'heat-ids.json')
+
+        isdir = os.path.isdir
+        self.useFixture(fixtures.MockPatch(
+            'os.path.isdir',
+            side_effect=lambda path: (path == '/var/log/heat-launcher' or
+                                      isdir(path))))
+        self.popen = self.useFixture(
+            fixtures.MockPatch('subprocess.Popen',
+                               side_effect=self._popen)).mock
+        self.image_id = b'sha256:1234\n'
+        self.inspect = self.useFixture(fixtures.MockPatch(
+            'subprocess.check_output',
+            side_effect=lambda cmd: self.image_id)).mock
+        self.useFixture(fixtures.MockPatch('tempfile.mkdtemp',
+                                           return_value=self.install_tmp))
+        self.chown = self.useFixture(fixtures.MockPatch('os.chown')).mock
+        self.useFixture(fixtures.MockPatch(
+            'tripleoclient.constants.HEAT_IDS_CACHE_FILE', self.cache_file))
+        self.useFixture(fixtures.MockPatch(
+            'tripleoclient.constants.HEAT_DB_SNAPSHOT_DIR',
+            os.path.join(tmp_dir, 'heat-db')))
+
+    def _popen(self, cmd, **kwargs):
+        p = mock.Mock(returncode=0)
+        if cmd[:2] == ['docker', 'run']:
+            p.communicate.return_value = (
+                b'heat:x:187:188::/var/lib/heat:/sbin/nologin\n'
+                b'heat:x:188:\n', None)
+        else:
+            p.communicate.return_value = ('', '')
+        return p
+
+    def _lookups(self):
+        return [c for c in self.popen.call_args_list
+                if c[0][0][:2] == ['docker', 'run']]
+
+    def _launcher(self):
+        return heat_launcher.HeatDockerLauncher(8006, 'heat-image')
+
+    def test_heat_ids(self):
+        launcher = self._launcher()
+
+        self.assertEqual((187, 188), (launcher.heat_uid, launcher.heat_gid))
+        self.chown.assert_any_call(self.install_tmp, 187, 188)
+        self.assertEqual(1, len(self._lookups()))
+        self.assertEqual(1, self.inspect.call_count)
+
+        launcher = self._launcher()
+
+        self.assertEqual((187, 188), (launcher.heat_uid, launcher.heat_gid))
+        self.assertEqual(1, len(self._lookups()))
+
+    def test_heat_ids_new_image(self):
+        self._launcher()
+        self.image_id = b'sha256:5678\n'
+        self._launcher()
+
+        self.assertEqual(2, len(self._lookups()))
+        with open(self.cache_file) as f:
+            self.assertEqual({'sha256:1234:heat': [187, 188],
+                              'sha256:5678:heat': [187, 188]}, json.load(f))
+
+    def test_heat_ids_cache_size(self):
+        self.useFixture(fixtures.MockPatch(
+            'tripleoclient.constants.HEAT_IDS_CACHE_SIZE', 2))
+        for image_id in (b'a', b'b', b'c'):
+            self.image_id = image_id
+            self._launcher()
+
+        # The ids saved first are dropped
+        with open(self.cache_file) as f:
+            self.assertEqual({'b:heat': [187, 188], 'c:heat': [187, 188]},
+                             json.load(f))
@@ -0,0 +1,247 @@
+#   Copyright 2018 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import fixtures
+import io
+import mock
+import os
+import tarfile
+
+from swiftclient import client as swiftclient
+from swiftclient import exceptions as swift_exc
+
+from tripleoclient import exceptions
+from tripleoclient import object_transfer
+from tripleoclient.tests import base
+
+
+class TestUploadObjects(base.TestCase):
+
+    def setUp(self):
+        super(TestUploadObjects, self).setUp()
+        self.swift_client = mock.Mock()
+        sleep_patch = mock.patch('time.sleep')
+        self.mock_sleep = sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
+
+    def test_upload_objects(self):
+        timings = object_transfer.upload_objects(
+            self.swift_client, 'overcloud',
+            [('a.yaml', 'a'), ('b.yaml', 'b'), ('c.yaml', 'c')],
+            concurrency=2)
+
+        self.swift_client.put_object.assert_has_calls([
+            mock.call('overcloud', 'a.yaml', 'a'),
+            mock.call('overcloud', 'b.yaml', 'b'),
+            mock.call('overcloud', 'c.yaml', 'c'),
+        ], any_order=True)
+        self.assertEqual(['a.yaml', 'b.yaml', 'c.yaml'], sorted(timings))
+
+    def test_upload_objects_empty(self):
+        self.assertEqual({}, object_transfer.upload_objects(
+            self.swift_client, 'overcloud', []))
+        self.swift_client.put_object.assert_not_called()
+
+    def test_upload_local_file(self):
+        path = os.path.join(self.useFixture(
+            fixtures.TempDir()).path, 'roles_data.yaml')
+        with open(path, 'w') as f:
+            f.write('roles')
+        contents = []
+        self.swift_client.put_object.side_effect = (
+            lambda container, name, f: contents.append(f.read()))
+
+        object_transfer.upload_objects(
+            self.swift_client, 'overcloud',
+            [('roles_data.yaml', object_transfer.local_file(path))])
+
+        self.assertEqual([b'roles'], contents)
+
+    def test_upload_retries(self):
+        self.swift_client.put_object.side_effect = [
+            swift_exc.ClientException('error'), None]
+
+        object_transfer.upload_objects(
+            self.swift_client, 'overcloud', [('a.yaml', 'a')],
+            retries=1, backoff=2)
+
+        self.assertEqual(2, self.swift_client.put_object.call_count)
+        self.mock_sleep.assert_called_once_with(2)
+
+    def test_upload_fails_after_retries(self):
+        self.swift_client.put_object.side_effect = (
+            swift_exc.ClientException('error'))
+
+        self.assertRaises(swift_exc.ClientException,
+                          object_transfer.upload_objects,
+                          self.swift_client, 'overcloud',
+                          [('a.yaml', 'a'), ('b.yaml', 'b')],
+                          retries=2, backoff=1)
+
+        self.assertEqual(6, self.swift_client.put_object.call_count)
+        self.mock_sleep.assert_has_calls([mock.call(1), mock.call(2)])
+
+    def test_delete_objects(self):
+        object_transfer.delete_objects(
+            self.swift_client, 'overcloud', ['a.yaml', 'b.yaml'])
+
+        self.swift_client.delete_object.assert_has_calls([
+            mock.call('overcloud', 'a.yaml'),
+            mock.call('overcloud', 'b.yaml'),
+        ], any_order=True)
+
+    @mock.patch.dict(os.environ, {'TRIPLEO_SWIFT_CONCURRENCY': '3'})
+    def test_get_concurrency(self):
+        self.assertEqual(3, object_transfer.get_concurrency())
+        self.assertEqual(5, object_transfer.get_concurrency(5))
+        self.assertEqual(1, object_transfer.get_concurrency(0))
+
+
+class TestDownloadObjects(base.TestCase):
+
+    def setUp(self):
+        super(TestDownloadObjects, self).setUp()
+        self.swift_client = mock.Mock()
+        self.swift_client.get_object.side_effect = (
+            lambda container, name, resp_chunk_size: (
+                {}, iter([b'content of ', name.encode('utf-8')])))
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+
+    def test_download_objects(self):
+        objects = [
+            ('overcloud.yaml', os.path.join(self.tmp_dir, 'overcloud.yaml')),
+            ('puppet/controller-role.yaml',
+             os.path.join(self.tmp_dir, 'puppet', 'controller-role.yaml')),
+        ]
+
+        timings = object_transfer.download_objects(
+            self.swift_client, 'overcloud', objects, chunk_size=1024)
+
+        for name, path in objects:
+            with open(path, 'rb') as f:
+                self.assertEqual(b'content of ' + name.encode('utf-8'),
+                                 f.read())
+        self.swift_client.get_object.assert_has_calls([
+            mock.call('overcloud', 'overcloud.yaml', resp_chunk_size=1024),
+            mock.call('overcloud', 'puppet/controller-role.yaml',
+                      resp_chunk_size=1024),
+        ], any_order=True)
+        self.assertEqual(sorted(name for name, _ in objects),
+                         sorted(timings))
+
+    def test_download_objects_replaces_links(self):
+        source = os.path.join(self.tmp_dir, 'source.yaml')
+        path = os.path.join(self.tmp_dir, 'overcloud.yaml')
+        with open(source, 'wb') as f:
+            f.write(b'source')
+        os.link(source, path)
+
+        object_transfer.download_objects(
+            self.swift_client, 'overcloud', [('overcloud.yaml', path)])
+
+        with open(path, 'rb') as f:
+            self.assertEqual(b'content of overcloud.yaml', f.read())
+        with open(source, 'rb') as f:
+            self.assertEqual(b'source', f.read())
+
+    def test_download_objects_empty(self):
+        self.assertEqual({}, object_transfer.download_objects(
+            self.swift_client, 'overcloud', []))
+        self.swift_client.get_object.assert_not_called()
+
+
+class TestUploadArchive(base.TestCase):
+
+    def setUp(self):
+        super(TestUploadArchive, self).setUp()
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+        self.files = {}
+        for name in ('overcloud.yaml', 'puppet/role.role.j2.yaml'):
+            path = os.path.join(self.tmp_dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write('content of %s' % name)
+            self.files[name] = path
+
+    def _extract(self, stream, mode):
+        archive = tarfile.open(fileobj=io.BytesIO(b''.join(stream)),
+                               mode=mode)
+        return dict((m.name, archive.extractfile(m).read())
+                    for m in archive.getmembers())
+
+    def _assert_stream(self, codec, mode):
+        stream = object_transfer.archive_stream(self.files, codec,
+                                                chunk_size=512)
+        self.assertEqual({
+            'overcloud.yaml': b'content of overcloud.yaml',
+            'puppet/role.role.j2.yaml': b'content of puppet/role.role.j2.yaml'
+        }, self._extract(stream, mode))
+
+    def test_archive_stream_tar(self):
+        self._assert_stream('tar', 'r:')
+
+    def test_archive_stream_gzip(self):
+        self._assert_stream('tar.gz', 'r:gz')
+
+    def test_archive_stream_bzip2(self):
+        self._assert_stream('tar.bz2', 'r:bz2')
+
+    def test_upload_archive(self):
+        swift_client = mock.Mock()
+        streams = []
+        swift_client.put_object.side_effect = (
+            lambda **kwargs: streams.append(b''.join(kwargs['contents'])))
+
+        object_transfer.upload_archive(swift_client, 'overcloud',
+                                       self.files, codec='tar.gz')
+
+        swift_client.put_object.assert_called_once_with(
+            container='overcloud', obj='', contents=mock.ANY,
+            query_string='extract-archive=tar.gz',
+            headers={'X-Detect-Content-Type': 'true'})
+        self.assertEqual(sorted(self.files), sorted(self._extract(
+            streams, 'r:gz')))
+
+    @mock.patch.dict(os.environ, {'TRIPLEO_PLAN_ARCHIVE_CODEC': 'tar.bz2'})
+    def test_get_archive_codec(self):
+        self.assertEqual('tar.bz2', object_transfer.get_archive_codec())
+        self.assertEqual('tar', object_transfer.get_archive_codec('tar'))
+        self.assertRaises(exceptions.InvalidConfiguration,
+                          object_transfer.get_archive_codec, 'tar.zst')
+
+
+class TestConnectionPool(base.TestCase):
+
+    def test_connection_per_thread(self):
+        connection = swiftclient.Connection(preauthurl='http://swift',
+                                            preauthtoken='token')
+        connection.http_conn = mock.Mock()
+        pool = object_transfer._ConnectionPool(connection)
+
+        conn = pool.get()
+
+        self.assertIsNot(connection, conn)
+        self.assertIs(conn, pool.get())
+        self.assertIsNone(conn.http_conn)
+        self.assertEqual('http://swift', conn.url)
+        self.assertEqual('token', conn.token)
+        self.assertEqual(0, conn.retries)
+        self.assertEqual(5, connection.retries)
+
+    def test_other_clients_are_shared(self):
+        client = mock.Mock()
+        pool = object_transfer._ConnectionPool(client)
+        self.assertIs(client, pool.get())
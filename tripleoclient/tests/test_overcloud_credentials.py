@@ -26,6 +26,7 @@ class TestOvercloudCredentials(test_plugin.TestPluginV1):
 
         self.cmd = overcloud_credentials.OvercloudCredentials(self.app, None)
         self.app.client_manager.workflow_engine = self.workflow = mock.Mock()
+        self.workflow.executions.create.return_value = mock.Mock(id="IDID")
         self.tripleoclient = mock.Mock()
         self.websocket = mock.Mock()
         self.websocket.__enter__ = lambda s: self.websocket
@@ -12,13 +12,20 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+from concurrent import futures
 import json
 import mock
 import socket
+import time
 
+import websocket
+
+from tripleoclient import constants
+from tripleoclient import exceptions
 from tripleoclient import plugin
 from tripleoclient.tests import base
 from tripleoclient.tests import fakes
+from tripleoclient.workflows import base as workflows_base
 
 
 class TestPlugin(base.TestCase):
@@ -43,12 +50,16 @@ class TestPlugin(base.TestCase):
 
         plugin.make_client(clientmgr)
 
-        # And the functions should only be called when the client is created:
-        self.assertEqual(clientmgr.auth.get_token.call_count, 2)
-        self.assertEqual(clientmgr.get_endpoint_for_service_type.call_count, 2)
-        ws_create_connection.assert_called_with("ws://0.0.0.0")
+        # But the clients share a single connection:
+        self.assertEqual(clientmgr.auth.get_token.call_count, 1)
+        self.assertEqual(clientmgr.get_endpoint_for_service_type.call_count, 1)
+        ws_create_connection.assert_called_once_with("ws://0.0.0.0")
+
+        # Unless they are for another queue
+        client.messaging_websocket('other')
+        self.assertEqual(ws_create_connection.call_count, 2)
 
-    @mock.patch.object(plugin.WebsocketClient, "recv")
+    @mock.patch.object(plugin._WebsocketConnection, "recv")
     @mock.patch("websocket.create_connection")
     def test_handle_websocket_multiple(self, ws_create_connection, recv_mock):
 
@@ -58,8 +69,8 @@ class TestPlugin(base.TestCase):
             }
         }
 
-        # Creating the websocket sends three messages and closing sends one.
-        # The one being tested is wrapped between these
+        # Creating the websocket sends three messages, the one being tested
+        # comes after them
         recv_mock.side_effect = [send_ack, send_ack, send_ack, {
             "body": {
                 "payload": {
@@ -68,7 +79,7 @@ class TestPlugin(base.TestCase):
                     "execution": {"id": "IDID"},
                 }
             }
-        }, send_ack]
+        }]
 
         clientmgr = mock.MagicMock()
         clientmgr.get_endpoint_for_service_type.return_value = fakes.WS_URL
@@ -85,8 +96,6 @@ class TestPlugin(base.TestCase):
                     "execution": {"id": "IDID"},
                 })
                 # We only want to test the first message, as there is only one.
-                # The last one, the send_ack will be used by the context
-                # manager when it is closed.
                 break
 
     @mock.patch("websocket.create_connection")
@@ -101,8 +110,190 @@ class TestPlugin(base.TestCase):
 
         client = plugin.make_client(clientmgr)
 
-        msg = ("Could not establish a connection to the Zaqar websocket. The "
-               "command was sent but the answer could not be read.")
         with mock.patch('tripleoclient.plugin.LOG') as mock_log:
-            self.assertRaises(socket.error, client.messaging_websocket)
-            mock_log.error.assert_called_once_with(msg)
+            ws = client.messaging_websocket()
+            self.assertTrue(mock_log.warning.called)
+
+        self.assertIsInstance(ws, workflows_base.PollingClient)
+        # Polling is used from then on
+        self.assertIsInstance(client.messaging_websocket(),
+                              workflows_base.PollingClient)
+        ws_create_connection.assert_called_once_with(fakes.WS_URL)
+
+
+class TestWebsocketDispatch(base.TestCase):
+
+    def setUp(self):
+        super(TestWebsocketDispatch, self).setUp()
+        self.messages = []
+        create_patch = mock.patch("websocket.create_connection")
+        ws_create_connection = create_patch.start()
+        self.addCleanup(create_patch.stop)
+        ws = ws_create_connection.return_value
+        ack = json.dumps({"headers": {"status": 201}})
+        ws.recv.side_effect = (
+            lambda: self.messages.pop(0) if self.messages else ack)
+
+        clientmgr = mock.MagicMock()
+        clientmgr.get_endpoint_for_service_type.return_value = fakes.WS_URL
+        clientmgr.auth.get_token.return_value = "TOKEN"
+        clientmgr.auth_ref.project_id = "ID"
+        self.client = plugin.make_client(clientmgr)
+        # Connect and subscribe
+        self.client.messaging_websocket().cleanup()
+
+    def _message(self, execution_id, status='RUNNING', root=None):
+        execution = {"id": execution_id}
+        if root is not None:
+            execution["root_execution_id"] = root
+        return {"body": {"payload": {"status": status,
+                                     "execution": execution}}}
+
+    def _send(self, *execution_ids, **kwargs):
+        self.messages.extend(json.dumps(self._message(execution_id, **kwargs))
+                             for execution_id in execution_ids)
+
+    def test_route_by_execution(self):
+        ws_a = self.client.messaging_websocket()
+        ws_b = self.client.messaging_websocket()
+        messages_a = ws_a.wait_for_messages(execution_id="A")
+        messages_b = ws_b.wait_for_messages(execution_id="B")
+        # Start waiting, to claim the executions
+        self._send("A")
+        next(messages_a)
+
+        self._send("B", "sub-workflow", "A")
+
+        self.assertEqual("B", next(messages_b)['execution']['id'])
+        self.assertEqual("sub-workflow",
+                         next(messages_a)['execution']['id'])
+        self.assertEqual("A", next(messages_a)['execution']['id'])
+        self.assertEqual("sub-workflow",
+                         next(messages_b)['execution']['id'])
+        self.assertEqual(0, len(ws_a.messages))
+        self.assertEqual(0, len(ws_b.messages))
+
+    def _wait(self, ws, execution_id):
+        statuses = []
+        for payload in ws.wait_for_messages(timeout=5,
+                                            execution_id=execution_id):
+            self.assertEqual(execution_id,
+                             payload['execution'].get('root_execution_id',
+                                                      execution_id))
+            statuses.append(payload['status'])
+            if payload['status'] != 'RUNNING':
+                return statuses
+
+    def test_concurrent_executions(self):
+        ws_a = self.client.messaging_websocket()
+        # B is started before its client exists
+        self._send("B", root="B")
+        self._send("A", "sub-A", root="A")
+        self._send("B", status="SUCCESS", root="B")
+        self._send("A", status="SUCCESS", root="A")
+
+        with futures.ThreadPoolExecutor(max_workers=2) as executor:
+            future_a = executor.submit(self._wait, ws_a, "A")
+            ws_b = self.client.messaging_websocket()
+            future_b = executor.submit(self._wait, ws_b, "B")
+            self.assertEqual(['RUNNING', 'RUNNING', 'SUCCESS'],
+                             future_a.result())
+            self.assertEqual(['RUNNING', 'SUCCESS'], future_b.result())
+
+    def test_start_before_claim(self):
+        ws_a = self.client.messaging_websocket()
+        messages_a = ws_a.wait_for_messages(execution_id="A")
+        self._send("A")
+        next(messages_a)
+        # B is started by a new client, whose messages arrive before it
+        # waits for them, as does a message from a sub-workflow
+        ws_b = self.client.messaging_websocket()
+        self._send("B", "sub-workflow", "A")
+
+        self.assertEqual("A", next(messages_a)['execution']['id'])
+        self.assertEqual(0, len(ws_a.messages))
+
+        messages_b = ws_b.wait_for_messages(execution_id="B")
+        self.assertEqual("B", next(messages_b)['execution']['id'])
+        # The message nobody claimed is then given to both
+        self.assertEqual("sub-workflow",
+                         next(messages_b)['execution']['id'])
+        self.assertEqual("sub-workflow",
+                         next(messages_a)['execution']['id'])
+
+    def test_claim_timeout(self):
+        ws_a = self.client.messaging_websocket()
+        messages_a = ws_a.wait_for_messages(execution_id="A")
+        self._send("A")
+        next(messages_a)
+        # This client never waits for its execution, nor is cleaned up
+        ws_b = self.client.messaging_websocket()
+        self._send("sub-workflow")
+        with mock.patch('time.time',
+                        return_value=time.time() +
+                        constants.ZAQAR_CLAIM_TIMEOUT + 1):
+            self._send("other")
+            self.assertEqual("sub-workflow",
+                             next(messages_a)['execution']['id'])
+            self.assertEqual("other", next(messages_a)['execution']['id'])
+        self.assertEqual(2, len(ws_b.messages))
+
+    def test_client_messages_limit(self):
+        ws_a = self.client.messaging_websocket()
+        ws_b = self.client.messaging_websocket()
+        ws_b._connection.claim(ws_b, None)
+        messages_a = ws_a.wait_for_messages()
+        count = constants.ZAQAR_UNCLAIMED_MESSAGES + 10
+        self._send(*[str(i) for i in range(count)])
+        for i in range(count):
+            self.assertEqual(str(i), next(messages_a)['execution']['id'])
+
+        self.assertEqual(constants.ZAQAR_UNCLAIMED_MESSAGES,
+                         len(ws_b.messages))
+        self.assertEqual("10", ws_b.messages[0]['body']['payload'][
+            'execution']['id'])
+
+    def test_cleanup_releases_claims(self):
+        ws_a = self.client.messaging_websocket()
+        ws_b = self.client.messaging_websocket()
+        self._send("A")
+        next(ws_a.wait_for_messages(execution_id="A"))
+        ws_a.cleanup()
+        self._send("A")
+
+        message = next(ws_b.wait_for_messages())
+        self.assertEqual("A", message['execution']['id'])
+        self.assertEqual(0, len(ws_a.messages))
+
+    def test_replay(self):
+        ws = self.client.messaging_websocket()
+        listed = [self._message("A"), self._message("B"),
+                  self._message("A", "SUCCESS")]
+        claimed = json.dumps({"headers": {"status": 201},
+                              "body": {"claim_id": "C1",
+                                       "messages": listed}})
+        # The replay connection authenticates and creates the queue, then
+        # the second claim finds no message
+        ack = json.dumps({"headers": {"status": 204}})
+        self.messages.extend([ack, ack, claimed, ack])
+
+        replayed = ws.replay("A")
+
+        self.assertEqual(['RUNNING', 'SUCCESS'],
+                         [payload['status'] for payload in replayed])
+        # Messages already replayed are not given again
+        self.messages.extend(json.dumps(message) for message in
+                             [self._message("A"),
+                              self._message("A", "ERROR")])
+        message = next(ws.wait_for_messages(execution_id="A"))
+        self.assertEqual('ERROR', message['status'])
+
+    def test_timeout(self):
+        ws = self.client.messaging_websocket()
+        conn = self.client._websocket_connections['tripleo']
+        conn._ws.recv.side_effect = websocket.WebSocketTimeoutException
+        messages = ws.wait_for_messages(timeout=0.1)
+        self.assertRaises(exceptions.WebSocketTimeout, next, messages)
+        for call in conn._ws.settimeout.call_args_list:
+            self.assertLessEqual(call[0][0], 0.1)
+        self.assertFalse(conn.closed)
@@ -16,17 +16,24 @@
 
 import argparse
 import datetime
+import json
 import mock
 import os.path
+import shutil
+import stat
 import tempfile
+import time
 
 from heatclient import exc as hc_exc
+from heatclient.v1 import stacks
 
 from uuid import uuid4
 
 from unittest import TestCase
+import six
 import yaml
 
+from tripleoclient import constants
 from tripleoclient import exceptions
 from tripleoclient import utils
 
@@ -48,7 +55,7 @@ class TestWaitForStackUtil(TestCase):
         e.event_time = event_time
         return e
 
-    @mock.patch("heatclient.common.event_utils.get_events")
+    @mock.patch("heatclient.common.event_utils.get_events", return_value=[])
     def test_wait_for_stack_ready(self, mock_el):
         stack = mock.Mock()
         stack.stack_name = 'stack'
@@ -58,6 +65,21 @@ class TestWaitForStackUtil(TestCase):
         complete = utils.wait_for_stack_ready(self.mock_orchestration, 'stack')
         self.assertTrue(complete)
 
+    @mock.patch("tripleoclient.utils.poll_for_stack_events", autospec=True,
+                return_value=("UPDATE_COMPLETE", "done"))
+    def test_wait_for_stack_ready_timeout(self, mock_poll):
+        stack = mock.Mock()
+        self.mock_orchestration.stacks.get.return_value = stack
+
+        complete = utils.wait_for_stack_ready(
+            self.mock_orchestration, 'stack', 'marker', 'UPDATE',
+            timeout=3600)
+
+        self.assertTrue(complete)
+        mock_poll.assert_called_once_with(
+            self.mock_orchestration, stack, 'UPDATE', marker='marker',
+            out=mock.ANY, timeout=3600)
+
     def test_wait_for_stack_ready_no_stack(self):
         self.mock_orchestration.stacks.get.return_value = None
 
@@ -65,7 +87,7 @@ class TestWaitForStackUtil(TestCase):
 
         self.assertFalse(complete)
 
-    @mock.patch("heatclient.common.event_utils.get_events")
+    @mock.patch("heatclient.common.event_utils.get_events", return_value=[])
     def test_wait_for_stack_ready_failed(self, mock_el):
         stack = mock.Mock()
         stack.stack_name = 'stack'
@@ -76,18 +98,188 @@ class TestWaitForStackUtil(TestCase):
 
         self.assertFalse(complete)
 
-    @mock.patch("heatclient.common.event_utils.poll_for_events")
-    def test_wait_for_stack_in_progress(self, mock_poll_for_events):
+    def _stack(self):
+        stack = mock.Mock(id='ID', stack_status='UPDATE_COMPLETE')
+        stack.stack_name = 'stack'
+        return stack
 
-        mock_poll_for_events.return_value = ("CREATE_IN_PROGRESS", "MESSAGE")
+    def _stack_event(self, id, status):
+        event = self.mock_event('stack', id, 'Stack', status,
+                                '2018-01-01T00:00:00Z')
+        event.physical_resource_id = 'ID'
+        return event
 
-        stack = mock.Mock()
-        stack.stack_name = 'stack'
-        stack.stack_status = 'CREATE_IN_PROGRESS'
+    @mock.patch("heatclient.common.event_utils.get_events")
+    def test_poll_for_stack_events(self, mock_get_events):
+        resource = self.mock_event('Controller', 'b', 'state changed',
+                                   'UPDATE_COMPLETE', '2018-01-01T00:00:00Z')
+        mock_get_events.side_effect = [
+            [self._stack_event('a', 'UPDATE_IN_PROGRESS'), resource],
+            [self._stack_event('c', 'UPDATE_COMPLETE')],
+        ]
+        out = six.StringIO()
+
+        status, msg = utils.poll_for_stack_events(
+            self.mock_orchestration, self._stack(), 'UPDATE', marker='z',
+            out=out, page_size=2)
+
+        self.assertEqual('UPDATE_COMPLETE', status)
+        self.assertIn('Stack stack/ID UPDATE_COMPLETE', msg)
+        self.assertIn('Controller', out.getvalue())
+        self.assertEqual(['z', 'b'], [
+            c[1]['event_args']['marker']
+            for c in mock_get_events.call_args_list])
+        # The first page was full, the next one is fetched without waiting
+        self.assertFalse(time.sleep.called)
+        self.assertFalse(self.mock_orchestration.stacks.get.called)
+
+    @mock.patch("heatclient.common.event_utils.get_events", return_value=[])
+    def test_poll_for_stack_events_backoff(self, mock_get_events):
+        # The status of the previous update comes first
+        self.mock_orchestration.stacks.get.side_effect = [
+            mock.Mock(stack_status=status) for status in
+            ('UPDATE_COMPLETE', 'UPDATE_COMPLETE', 'UPDATE_IN_PROGRESS',
+             'UPDATE_IN_PROGRESS', 'UPDATE_FAILED')]
+
+        status, msg = utils.poll_for_stack_events(
+            self.mock_orchestration, self._stack(), 'UPDATE', marker='z',
+            out=six.StringIO(), interval=1, max_interval=3)
+
+        self.assertEqual('UPDATE_FAILED', status)
+        self.assertEqual([mock.call(1), mock.call(2), mock.call(3),
+                          mock.call(3)], time.sleep.call_args_list)
+        self.mock_orchestration.stacks.get.assert_called_with(
+            'stack/ID', resolve_outputs=False)
+
+    @mock.patch("heatclient.common.event_utils.get_events", return_value=[])
+    def test_poll_for_stack_events_not_seen_started(self, mock_get_events):
+        stack = self._stack()
+        stack.updated_time = '2018-01-01T00:00:00Z'
+        # The update went from the previous status to the next one between
+        # two lookups
+        self.mock_orchestration.stacks.get.side_effect = [
+            mock.Mock(stack_status='UPDATE_COMPLETE', updated_time=updated)
+            for updated in ['2018-01-01T00:00:00Z'] * 2 +
+            ['2018-01-01T01:00:00Z'] * 3]
+
+        status, msg = utils.poll_for_stack_events(
+            self.mock_orchestration, stack, 'UPDATE', marker='z',
+            out=six.StringIO(), interval=1, max_interval=1)
+
+        self.assertEqual('UPDATE_COMPLETE', status)
+        self.assertEqual(constants.STACK_EVENTS_STALE_POLLS,
+                         self.mock_orchestration.stacks.get.call_count)
+
+    @mock.patch("tripleoclient.utils.time.time")
+    @mock.patch("heatclient.common.event_utils.get_events", return_value=[])
+    def test_poll_for_stack_events_timeout(self, mock_get_events,
+                                           mock_time):
+        now = [0]
+        mock_time.side_effect = lambda: now[0]
+        time.sleep.side_effect = lambda wait: now.__setitem__(0,
+                                                              now[0] + wait)
+        stack = self._stack()
+        stack.updated_time = '2018-01-01T00:00:00Z'
+        self.mock_orchestration.stacks.get.return_value = mock.Mock(
+            stack_status='UPDATE_COMPLETE',
+            updated_time='2018-01-01T00:00:00Z')
+
+        status, msg = utils.poll_for_stack_events(
+            self.mock_orchestration, stack, 'UPDATE', marker='z',
+            out=six.StringIO(), interval=10, max_interval=10, timeout=60)
+
+        self.assertIsNone(status)
+        self.assertIn('timed out', msg)
+        self.assertEqual(60, now[0])
+
+    def _resource(self, name, status, resource_type='OS::Heat::Stack',
+                  nested=False):
+        rsc = mock.Mock(resource_name=name, resource_status=status,
+                        resource_type=resource_type,
+                        physical_resource_id='%s-ID' % name,
+                        resource_status_reason='%s failed' % name)
+        rsc.links = [{'rel': 'self'}]
+        if nested:
+            rsc.links.append({'rel': 'nested'})
+        return rsc
+
+    def test_print_stack_failures(self):
+        stack = self._stack()
+        stack.status = 'FAILED'
+        self.mock_orchestration.stacks.get.return_value = stack
+        resources = {
+            'ID': [
+                self._resource('Controller', 'UPDATE_FAILED', nested=True),
+                self._resource('Compute', 'UPDATE_FAILED', nested=True),
+                self._resource('Networks', 'UPDATE_COMPLETE', nested=True),
+            ],
+            'Controller-ID': [
+                self._resource('0', 'UPDATE_FAILED', nested=True),
+            ],
+            '0-ID': [
+                self._resource('Deployment', 'CREATE_FAILED',
+                               'OS::Heat::StructuredDeployment'),
+                self._resource('Config', 'CREATE_COMPLETE'),
+            ],
+        }
+
+        def list_resources(stack_id):
+            if stack_id not in resources:
+                raise hc_exc.HTTPNotFound()
+            return resources[stack_id]
+
+        self.mock_orchestration.resources.list.side_effect = list_resources
+        self.mock_orchestration.software_deployments.get.return_value = (
+            mock.Mock(output_values={
+                'deploy_stdout': '\n'.join(str(i) for i in range(100)),
+                'deploy_stderr': 'oops',
+                'deploy_status_code': 2}))
+        out = six.StringIO()
+
+        utils.print_stack_failures(self.mock_orchestration, 'stack', out=out)
+
+        output = out.getvalue()
+        self.assertIn('stack.Controller.0.Deployment:\n'
+                      '  resource_type: OS::Heat::StructuredDeployment\n'
+                      '  physical_resource_id: Deployment-ID\n'
+                      '  status: CREATE_FAILED\n', output)
+        self.assertIn('  deploy_stdout: |\n    ...\n    90\n', output)
+        self.assertIn('  deploy_stderr: |\n    oops\n', output)
+        self.assertIn('  deploy_status_code: 2\n', output)
+        # The nested stack of Compute is missing
+        self.assertIn('stack.Compute:\n', output)
+        self.assertNotIn('stack.Controller:', output)
+        self.assertNotIn('Networks', output)
+        self.mock_orchestration.software_deployments.get.\
+            assert_called_once_with(deployment_id='Deployment-ID')
+
+    def test_print_stack_failures_limit(self):
+        stack = self._stack()
+        stack.status = 'FAILED'
+        self.mock_orchestration.stacks.get.return_value = stack
+        self.mock_orchestration.resources.list.return_value = [
+            self._resource('Server%d' % i, 'CREATE_FAILED')
+            for i in range(5)]
+        out = six.StringIO()
+
+        utils.print_stack_failures(self.mock_orchestration, 'stack', out=out,
+                                   limit=2)
+
+        output = out.getvalue()
+        self.assertIn('stack.Server1:', output)
+        self.assertNotIn('stack.Server2:', output)
+        self.assertIn('3 more failed resources', output)
+
+    def test_print_stack_failures_not_failed(self):
+        stack = self._stack()
+        stack.status = 'COMPLETE'
         self.mock_orchestration.stacks.get.return_value = stack
+        out = six.StringIO()
+
+        utils.print_stack_failures(self.mock_orchestration, 'stack', out=out)
 
-        result = utils.wait_for_stack_ready(self.mock_orchestration, 'stack')
-        self.assertEqual(False, result)
+        self.assertEqual('', out.getvalue())
+        self.assertFalse(self.mock_orchestration.resources.list.called)
 
     @mock.patch('tripleoclient.utils.wait_for_provision_state')
     def test_set_nodes_state(self, wait_for_state_mock):
@@ -271,6 +463,83 @@ class TestGetEndpointMap(TestCase):
                          {'KeystonePublic': {'uri': 'http://foo:8000/'}})
 
 
+class TestStackOutputs(TestCase):
+
+    def _stack(self, **info):
+        info.setdefault('id', 'ID')
+        info.setdefault('stack_status', 'CREATE_COMPLETE')
+        info.setdefault('updated_time', None)
+        return stacks.Stack(mock.Mock(), info, loaded=True)
+
+    def test_get(self):
+        stack = self._stack(outputs=[
+            {'output_key': 'KeystoneURL', 'output_value': 'http://foo:5000'},
+            {'output_key': 'RoleNetIpMap',
+             'output_value': {'Controller': {'ctlplane': ['192.0.2.1']}}},
+        ])
+
+        with mock.patch.object(stack, 'to_dict') as mock_to_dict:
+            outputs = utils.StackOutputs.get(stack)
+            self.assertIs(outputs, utils.StackOutputs.get(stack))
+            self.assertEqual('http://foo:5000',
+                             utils.get_overcloud_endpoint(stack))
+            self.assertEqual({'Controller': {'ctlplane': ['192.0.2.1']}},
+                             utils.get_role_net_ip_map(stack))
+        self.assertFalse(mock_to_dict.called)
+        self.assertIsNone(outputs.value('HostsEntry'))
+        self.assertEqual({}, utils.get_endpoint_map(stack))
+
+    def test_get_updated_stack(self):
+        stack = self._stack(outputs=[
+            {'output_key': 'KeystoneURL', 'output_value': 'http://foo:5000'}])
+        outputs = utils.StackOutputs.get(stack)
+
+        updated = self._stack(
+            updated_time='2018-01-01T00:00:00Z',
+            stack_status='UPDATE_COMPLETE',
+            outputs=[{'output_key': 'KeystoneURL',
+                      'output_value': 'http://bar:5000'}])
+
+        self.assertIsNot(outputs, utils.StackOutputs.get(updated))
+        self.assertEqual('http://bar:5000',
+                         utils.get_overcloud_endpoint(updated))
+
+    def test_get_returns_copies(self):
+        stack = self._stack(outputs=[
+            {'output_key': 'RoleData',
+             'output_value': {'Controller': {'config': ['a']}}}])
+
+        utils.get_role_data(stack)['Controller']['config'].append('b')
+        utils.StackOutputs.get(stack)['RoleData'].clear()
+        utils.StackOutputs.get(stack).as_dict()['RoleData'].clear()
+
+        self.assertEqual({'Controller': {'config': ['a']}},
+                         utils.get_role_data(stack))
+
+    def test_get_refreshed_stack(self):
+        stack = self._stack(outputs=[
+            {'output_key': 'KeystoneURL', 'output_value': 'http://foo:5000'}])
+        outputs = utils.StackOutputs.get(stack)
+
+        # e.g. after stack.get(), even with the same status
+        stack._add_details({'outputs': [
+            {'output_key': 'KeystoneURL', 'output_value': 'http://bar:5000'}]})
+
+        self.assertIsNot(outputs, utils.StackOutputs.get(stack))
+        self.assertEqual('http://bar:5000',
+                         utils.get_overcloud_endpoint(stack))
+
+    def test_get_without_outputs(self):
+        stack = self._stack()
+
+        self.assertIsNone(utils.get_overcloud_endpoint(stack))
+
+        stack = self._stack(outputs=[
+            {'output_key': 'KeystoneURL', 'output_value': 'http://foo:5000'}])
+        self.assertEqual('http://foo:5000',
+                         utils.get_overcloud_endpoint(stack))
+
+
 class TestNodeGetCapabilities(TestCase):
     def test_with_capabilities(self):
         node = mock.Mock(properties={'capabilities': 'x:y,foo:bar'})
@@ -573,6 +842,72 @@ class TestReplaceLinks(TestCase):
             self.link_replacement, current_dir))
 
 
+class TestPruneUnreachableFiles(TestCase):
+
+    def setUp(self):
+        super(TestPruneUnreachableFiles, self).setUp()
+        env_patch = mock.patch.dict(os.environ,
+                                    {'TRIPLEO_YAML_CACHE_DIR': ''})
+        env_patch.start()
+        self.addCleanup(env_patch.stop)
+        self.template = {
+            'heat_template_version': 'rocky',
+            'resources': {
+                'Net': {'type': 'OS::TripleO::Network'},
+                'Config': {'type': 'file:///tht/config.yaml'},
+            }
+        }
+        self.files = {
+            'file:///tht/config.yaml': json.dumps({
+                'heat_template_version': 'rocky',
+                'resources': {'Script': {'properties': {
+                    'config': {'get_file': 'file:///tht/script.sh'}}}}}),
+            'file:///tht/script.sh': '#!/bin/bash',
+            'file:///tht/network.yaml': json.dumps({
+                'heat_template_version': 'rocky',
+                'resources': {'Port': {
+                    'type': 'file:///tht/port.yaml'}}}),
+            'file:///tht/port.yaml': json.dumps({
+                'heat_template_version': 'rocky'}),
+            'file:///tht/noop-network.yaml': json.dumps({
+                'heat_template_version': 'rocky'}),
+        }
+
+    def test_template_links(self):
+        self.assertEqual(
+            set(['OS::TripleO::Network', 'file:///tht/config.yaml']),
+            utils.template_links(self.template))
+
+    def test_file_link_graph(self):
+        self.assertEqual({
+            'file:///tht/config.yaml': ['file:///tht/script.sh'],
+            'file:///tht/script.sh': [],
+            'file:///tht/network.yaml': ['file:///tht/port.yaml'],
+            'file:///tht/port.yaml': [],
+            'file:///tht/noop-network.yaml': [],
+        }, utils.file_link_graph(self.files))
+
+    def test_prune_unreachable_files(self):
+        env = {'resource_registry': {
+            'OS::TripleO::Network': 'file:///tht/network.yaml',
+            'resources': {'Net': {'hooks': 'pre-create'}}}}
+
+        files = utils.prune_unreachable_files(self.files, self.template, env)
+
+        self.assertEqual(['file:///tht/config.yaml',
+                          'file:///tht/network.yaml',
+                          'file:///tht/port.yaml',
+                          'file:///tht/script.sh'], sorted(files))
+        self.assertEqual(self.files['file:///tht/script.sh'],
+                         files['file:///tht/script.sh'])
+
+    def test_prune_without_registry(self):
+        files = utils.prune_unreachable_files(self.files, self.template, {})
+
+        self.assertEqual(['file:///tht/config.yaml',
+                          'file:///tht/script.sh'], sorted(files))
+
+
 class TestBracketIPV6(TestCase):
     def test_basic(self):
         result = utils.bracket_ipv6('::1')
@@ -587,6 +922,77 @@ class TestBracketIPV6(TestCase):
         self.assertEqual('[::1]', result)
 
 
+class TestWaitForPort(TestCase):
+
+    def setUp(self):
+        self.now = [100]
+        for target, kwargs in (
+                ('tripleoclient.utils.time.time',
+                 {'side_effect': lambda: self.now[0]}),
+                ('tripleoclient.utils.time.sleep',
+                 {'side_effect': self._sleep}),
+                ('tripleoclient.utils.os.waitpid',
+                 {'return_value': (0, 0)}),
+                ('tripleoclient.utils.socket.create_connection', {})):
+            patcher = mock.patch(target, **kwargs)
+            self.addCleanup(patcher.stop)
+            setattr(self, target.rsplit('.', 1)[1], patcher.start())
+
+    def _sleep(self, seconds):
+        self.now[0] += seconds
+
+    def test_ready(self):
+        self.assertTrue(utils.wait_for_port(8006))
+
+        self.create_connection.assert_called_once_with(('127.0.0.1', 8006),
+                                                       timeout=1)
+        self.assertFalse(self.sleep.called)
+
+    def test_backoff(self):
+        self.create_connection.side_effect = [
+            utils.socket.error(), utils.socket.error(), utils.socket.error(),
+            mock.Mock()]
+
+        self.assertTrue(utils.wait_for_port(8006, interval=0.1,
+                                            max_interval=0.3))
+
+        self.assertEqual([mock.call(0.1), mock.call(0.2), mock.call(0.3)],
+                         self.sleep.call_args_list)
+
+    def test_timeout(self):
+        probe = mock.Mock(return_value=False)
+
+        self.assertFalse(utils.wait_for_port(8006, timeout=2.5, probe=probe,
+                                             interval=1, max_interval=1))
+
+        self.assertEqual([mock.call(1), mock.call(1), mock.call(0.5)],
+                         self.sleep.call_args_list)
+        self.assertEqual(4, probe.call_count)
+
+    def test_process_exited(self):
+        self.create_connection.side_effect = utils.socket.error()
+        self.waitpid.side_effect = [(0, 0), (42, 256)]
+
+        self.assertRaises(exceptions.ProcessExited, utils.wait_for_port,
+                          8006, pid=42)
+
+        self.waitpid.assert_called_with(42, os.WNOHANG)
+        self.assertEqual(1, self.sleep.call_count)
+
+    @mock.patch('tripleoclient.utils.request.urlopen')
+    def test_wait_api_port_ready(self, mock_urlopen):
+        mock_urlopen.side_effect = [
+            utils.url_error.HTTPError('http://127.0.0.1:8006/', 503,
+                                      'Unavailable', {}, None),
+            utils.url_error.HTTPError('http://127.0.0.1:8006/', 300,
+                                      'Multiple Choices', {}, None)]
+
+        self.assertTrue(utils.wait_api_port_ready(8006, pid=42))
+
+        mock_urlopen.assert_called_with('http://127.0.0.1:8006/', timeout=1)
+        self.assertEqual(1, self.sleep.call_count)
+
+
 class TestStoreCliParam(TestCase):
 
     def setUp(self):
@@ -684,6 +1090,8 @@ class ProcessMultipleEnvironments(TestCase):
             mock.call(env_path='./tmp/thtroot/notouch2.yaml'),
             mock.call(env_path='../outside.yaml')])
 
+    @mock.patch('heatclient.common.template_utils.'
+                'resolve_environment_urls', autospec=True)
     @mock.patch('heatclient.common.template_utils.'
                 'process_environment_and_files', return_value=({}, {}),
                 autospec=True)
@@ -695,17 +1103,17 @@ class ProcessMultipleEnvironments(TestCase):
     @mock.patch('heatclient.common.template_format.'
                 'parse', autospec=True, return_value=dict())
     @mock.patch('yaml.safe_dump', autospec=True)
-    @mock.patch('yaml.safe_load', autospec=True)
-    @mock.patch('six.moves.builtins.open')
+    @mock.patch('tripleoclient.yaml_cache.load_environment', autospec=True)
     @mock.patch('tempfile.NamedTemporaryFile', autospec=True)
     def test_rewrite_env_files(self,
-                               mock_temp, mock_open,
+                               mock_temp,
                                mock_yaml_load,
                                mock_yaml_dump,
                                mock_hc_templ_parse,
                                mock_hc_env_parse,
                                mock_hc_get_templ_cont,
-                               mock_hc_process):
+                               mock_hc_process,
+                               mock_hc_resolve):
 
         def hc_process(*args, **kwargs):
             if 'abs.yaml' in kwargs['env_path']:
@@ -738,6 +1146,70 @@ class ProcessMultipleEnvironments(TestCase):
 
         mock_yaml_dump.assert_has_calls([mock.call(rewritten_env,
                                         default_flow_style=False)])
+        mock_hc_resolve.assert_called_once_with(
+            rewritten_env['resource_registry'], {}, 'file:///twd/templates')
+
+    @mock.patch('heatclient.common.template_utils.'
+                'resolve_environment_urls', autospec=True)
+    @mock.patch('heatclient.common.template_utils.'
+                'process_environment_and_files', autospec=True)
+    @mock.patch('tripleoclient.yaml_cache.load_environment', autospec=True)
+    @mock.patch('tempfile.NamedTemporaryFile', autospec=True)
+    def test_rewrite_env_in_memory(self, mock_temp, mock_load,
+                                   mock_hc_process, mock_hc_resolve):
+        mock_hc_process.side_effect = hc_exc.CommandError
+        mock_load.side_effect = lambda path: {
+            'parameter_defaults': {'Foo': 'bar'},
+            'resource_registry': {'OS::Foo::Bar': './foo.yaml',
+                                  'OS::Foo::Baz': 'OS::Heat::None'}}
+
+        env_files, env = utils.process_multiple_environments(
+            ['/tmp/thtroot/a.yaml', '/tmp/thtroot/b.yaml'],
+            self.tht_root, self.user_tht_root)
+
+        self.assertEqual({'parameter_defaults': {'Foo': 'bar'},
+                          'resource_registry': {
+                              'OS::Foo::Bar': '/twd/templates/foo.yaml',
+                              'OS::Foo::Baz': 'OS::Heat::None'}}, env)
+        self.assertEqual(2, mock_hc_resolve.call_count)
+        mock_temp.assert_not_called()
+
+    @mock.patch('heatclient.common.template_utils.'
+                'process_environment_and_files', autospec=True)
+    def test_merge_in_order(self, mock_hc_process):
+        envs = {
+            'first.yaml': {'parameter_defaults': {'A': 1, 'B': {'C': 1}}},
+            'second.yaml': {'parameter_defaults': {'A': 2, 'B': {'D': 2}}},
+            'third.yaml': {'parameter_defaults': {'A': 3}},
+        }
+
+        def hc_process(env_path):
+            return ({env_path: 'contents'}, envs[env_path])
+
+        mock_hc_process.side_effect = hc_process
+
+        env_files, env = utils.process_multiple_environments(
+            ['first.yaml', 'second.yaml', 'third.yaml'],
+            self.tht_root, self.user_tht_root)
+
+        self.assertEqual(
+            {'parameter_defaults': {'A': 3, 'B': {'C': 1, 'D': 2}}}, env)
+        self.assertEqual(sorted(envs), sorted(env_files))
+
+    @mock.patch('heatclient.common.template_utils.'
+                'process_environment_and_files', autospec=True)
+    def test_process_failure(self, mock_hc_process):
+        def hc_process(env_path):
+            if env_path == 'bad.yaml':
+                raise ValueError('bad environment')
+            return ({}, {})
+
+        mock_hc_process.side_effect = hc_process
+
+        self.assertRaises(ValueError, utils.process_multiple_environments,
+                          ['good.yaml', 'bad.yaml', 'other.yaml'],
+                          self.tht_root, self.user_tht_root)
+        self.assertEqual(2, mock_hc_process.call_count)
 
 
 class GetTripleoAnsibleInventory(TestCase):
@@ -767,3 +1239,144 @@ class GetTripleoAnsibleInventory(TestCase):
                 ssh_user='heat_admin',
                 stack='foo-overcloud'
             )
+
+
+class TestLinkTemplatesTree(TestCase):
+
+    def setUp(self):
+        super(TestLinkTemplatesTree, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        geteuid = mock.patch('os.geteuid', return_value=1000)
+        self.mock_geteuid = geteuid.start()
+        self.addCleanup(geteuid.stop)
+        self.src = os.path.join(self.tmp_dir, 'src')
+        self.dst = os.path.join(self.tmp_dir, 'dst')
+        for name, contents in (('overcloud.j2.yaml', 'j2'),
+                               ('overcloud.yaml', 'rendered'),
+                               ('puppet/role.role.j2.yaml', 'role'),
+                               ('puppet/controller-role.yaml', 'controller'),
+                               ('puppet/services/foo.yaml', 'foo')):
+            self._write(os.path.join(self.src, name), contents)
+        os.symlink('foo.yaml', os.path.join(self.src, 'puppet/services',
+                                            'bar.yaml'))
+        os.symlink('puppet', os.path.join(self.src, 'extraconfig'))
+
+    def _write(self, path, contents):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_link_templates_tree(self):
+        utils.link_templates_tree(self.src, self.dst)
+
+        foo = os.path.join(self.dst, 'puppet/services/foo.yaml')
+        self.assertEqual('foo', self._read(foo))
+        self.assertEqual(os.stat(foo).st_ino, os.stat(
+            os.path.join(self.src, 'puppet/services/foo.yaml')).st_ino)
+        self.assertEqual('foo.yaml', os.readlink(
+            os.path.join(self.dst, 'puppet/services/bar.yaml')))
+        self.assertEqual('puppet', os.readlink(
+            os.path.join(self.dst, 'extraconfig')))
+
+    @mock.patch('os.link', side_effect=OSError(18, 'Invalid cross-device'))
+    def test_link_templates_tree_copies(self, mock_link):
+        with mock.patch('logging.Logger.warning') as mock_warning:
+            utils.link_templates_tree(self.src, self.dst)
+
+        foo = os.path.join(self.dst, 'puppet/services/foo.yaml')
+        self.assertEqual('foo', self._read(foo))
+        self.assertEqual(1, os.stat(foo).st_nlink)
+        self.assertEqual(1, mock_link.call_count)
+        self.assertEqual(1, mock_warning.call_count)
+
+    @mock.patch('os.link')
+    def test_link_templates_tree_root(self, mock_link):
+        self.mock_geteuid.return_value = 0
+
+        utils.link_templates_tree(self.src, self.dst)
+
+        self.assertFalse(mock_link.called)
+        for name in ('overcloud.j2.yaml', 'puppet/services/foo.yaml'):
+            self.assertEqual(1, os.stat(
+                os.path.join(self.dst, name)).st_nlink, name)
+        self.assertEqual('foo.yaml', os.readlink(
+            os.path.join(self.dst, 'puppet/services/bar.yaml')))
+
+    def test_link_templates_tree_copies_written_files(self):
+        for name in ('plan-environment.yaml', 'roles_data.yaml',
+                     'network_data.yaml'):
+            self._write(os.path.join(self.src, name), name)
+
+        utils.link_templates_tree(self.src, self.dst)
+
+        for name, nlink in (('plan-environment.yaml', 1),
+                            ('roles_data.yaml', 1),
+                            ('network_data.yaml', 1),
+                            ('overcloud.yaml', 1),
+                            ('overcloud.j2.yaml', 2),
+                            ('puppet/controller-role.yaml', 1),
+                            ('puppet/services/foo.yaml', 2)):
+            self.assertEqual(nlink, os.stat(
+                os.path.join(self.dst, name)).st_nlink, name)
+
+    def test_replace_file(self):
+        utils.link_templates_tree(self.src, self.dst)
+        foo = os.path.join(self.dst, 'puppet/services/foo.yaml')
+        os.chmod(foo, 0o640)
+
+        with utils.replace_file(foo) as f:
+            f.write('changed')
+
+        self.assertEqual('changed', self._read(foo))
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(foo).st_mode))
+        self.assertEqual('foo', self._read(
+            os.path.join(self.src, 'puppet/services/foo.yaml')))
+
+        new = os.path.join(self.dst, 'new.yaml')
+        with utils.replace_file(new, 'wb') as f:
+            f.write(b'new')
+        self.assertEqual('new', self._read(new))
+
+    def test_replace_file_error(self):
+        utils.link_templates_tree(self.src, self.dst)
+        foo = os.path.join(self.dst, 'puppet/services/foo.yaml')
+
+        def write():
+            with utils.replace_file(foo) as f:
+                f.write('partial')
+                raise ValueError()
+
+        self.assertRaises(ValueError, write)
+        self.assertEqual('foo', self._read(foo))
+        self.assertEqual(['bar.yaml', 'foo.yaml'],
+                         sorted(os.listdir(os.path.dirname(foo))))
+
+    def test_materialize_file(self):
+        utils.link_templates_tree(self.src, self.dst)
+        foo = os.path.join(self.dst, 'puppet/services/foo.yaml')
+
+        utils.materialize_file(foo)
+        self._write(foo, 'changed')
+
+        self.assertEqual(1, os.stat(foo).st_nlink)
+        self.assertEqual('foo', self._read(
+            os.path.join(self.src, 'puppet/services/foo.yaml')))
+        utils.materialize_file(os.path.join(self.dst, 'missing.yaml'))
+
+    def test_materialize_rendered_templates(self):
+        utils.link_templates_tree(self.src, self.dst)
+
+        utils.materialize_rendered_templates(self.dst)
+
+        for name, nlink in (('overcloud.yaml', 1),
+                            ('overcloud.j2.yaml', 2),
+                            ('puppet/controller-role.yaml', 1),
+                            ('puppet/services/foo.yaml', 2)):
+            self.assertEqual(nlink, os.stat(
+                os.path.join(self.dst, name)).st_nlink, name)
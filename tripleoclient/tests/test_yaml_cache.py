@@ -0,0 +1,129 @@
+#   Copyright 2018 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import os
+
+import fixtures
+import datetime
+import mock
+
+from tripleoclient.tests import base
+from tripleoclient import yaml_cache
+
+
+class TestYamlCache(base.TestCase):
+
+    def setUp(self):
+        super(TestYamlCache, self).setUp()
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.useFixture(fixtures.EnvironmentVariable(
+            'TRIPLEO_YAML_CACHE_DIR', self.cache_dir))
+        self.path = os.path.join(self.tmp_dir, 'env.yaml')
+        self._write('parameter_defaults:\n  Foo: bar\n')
+
+    def _write(self, contents):
+        with open(self.path, 'w') as f:
+            f.write(contents)
+
+    def test_get_cache_dir(self):
+        self.assertEqual(self.cache_dir, yaml_cache.get_cache_dir())
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': '/cache'}):
+            del os.environ['TRIPLEO_YAML_CACHE_DIR']
+            self.assertEqual('/cache/tripleo/yaml',
+                             yaml_cache.get_cache_dir())
+
+    def test_load_file(self):
+        expected = {'parameter_defaults': {'Foo': 'bar'}}
+        self.assertEqual(expected, yaml_cache.load_file(self.path))
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+        # Parsed again from the on-disk cache by a new process
+        with mock.patch.object(yaml_cache, '_caches', {}):
+            with mock.patch.object(yaml_cache, 'safe_load') as mock_load:
+                self.assertEqual(expected, yaml_cache.load_file(self.path))
+        mock_load.assert_not_called()
+
+    def test_load_file_returns_copies(self):
+        env = yaml_cache.load_file(self.path)
+        env['parameter_defaults']['Foo'] = 'baz'
+        self.assertEqual({'parameter_defaults': {'Foo': 'bar'}},
+                         yaml_cache.load_file(self.path))
+
+    def test_load_file_changed(self):
+        yaml_cache.load_file(self.path)
+        self._write('parameter_defaults:\n  Foo: changed\n')
+        self.assertEqual({'parameter_defaults': {'Foo': 'changed'}},
+                         yaml_cache.load_file(self.path))
+
+    def test_load_file_missing(self):
+        self.assertRaises(IOError, yaml_cache.load_file,
+                          os.path.join(self.tmp_dir, 'missing.yaml'))
+
+    def test_load_environment(self):
+        self._write('parameter_defaults:\n  Release: 2018-08-01\n')
+        self.assertEqual({'parameter_defaults': {'Release': '2018-08-01'}},
+                         yaml_cache.load_environment(self.path))
+
+        self._write('parameters_defaults: {}\n')
+        self.assertRaises(ValueError, yaml_cache.load_environment,
+                          self.path)
+
+    def test_cache_dir_disabled(self):
+        with mock.patch.dict(os.environ, {'TRIPLEO_YAML_CACHE_DIR': ''}):
+            self.assertEqual({'parameter_defaults': {'Foo': 'bar'}},
+                             yaml_cache.load_file(self.path))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_evict(self):
+        cache = yaml_cache.YamlCache(self.cache_dir)
+        cache.get_or_parse('old', lambda: 'x' * 100)
+        cache.get_or_parse('new', lambda: 'y' * 100)
+        old, new = [cache._entry_path(k) for k in ('old', 'new')]
+        os.utime(old, (1, 1))
+
+        cache.max_size = os.path.getsize(new)
+        cache.evict()
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    def test_load_file_dates(self):
+        self._write('Release: 2018-08-01\n')
+        self.assertEqual({'Release': datetime.date(2018, 8, 1)},
+                         yaml_cache.load_file(self.path))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_cache_dir_permissions(self):
+        os.mkdir(self.cache_dir, 0o755)
+        yaml_cache.load_file(self.path)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+        os.chmod(self.cache_dir, 0o700)
+        with mock.patch.object(yaml_cache, '_caches', {}):
+            yaml_cache.load_file(self.path)
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+    def test_cache_dir_owner(self):
+        with mock.patch('os.geteuid', return_value=os.geteuid() + 1):
+            yaml_cache.load_file(self.path)
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_cache_dir_link(self):
+        target = os.path.join(self.tmp_dir, 'target')
+        os.mkdir(target, 0o700)
+        os.symlink(target, self.cache_dir)
+        yaml_cache.load_file(self.path)
+        self.assertEqual([], os.listdir(target))
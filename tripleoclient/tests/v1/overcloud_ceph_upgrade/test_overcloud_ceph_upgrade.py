@@ -33,7 +33,7 @@ class TestCephUpgrade(fakes.TestCephUpgrade):
         self.cmd = overcloud_ceph_upgrade.CephUpgrade(self.app, self.app_args)
         uuid4_patcher = mock.patch('uuid.uuid4', return_value="UUID4")
         self.mock_uuid4 = uuid4_patcher.start()
-        self.addCleanup(self.mock_uuid4.stop)
+        self.addCleanup(uuid4_patcher.stop)
 
     @mock.patch('tripleoclient.utils.load_container_registry')
     @mock.patch('tripleoclient.utils.get_stack')
@@ -80,7 +80,7 @@ class TestCephUpgrade(fakes.TestCephUpgrade):
     @mock.patch('six.moves.builtins.open')
     @mock.patch('os.path.abspath')
     @mock.patch('yaml.load')
-    @mock.patch('shutil.copytree', autospec=True)
+    @mock.patch('tripleoclient.utils.link_templates_tree', autospec=True)
     @mock.patch(
         'tripleoclient.v1.overcloud_ceph_upgrade.DeployOvercloud.take_action')
     def test_ceph_upgrade_failed(
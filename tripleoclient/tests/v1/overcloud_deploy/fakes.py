@@ -120,10 +120,10 @@ class FakeObjectClient(object):
         self._instance = mock.Mock()
         self.put_object = mock.Mock()
 
-    def get_object(self, *args):
+    def get_object(self, *args, **kwargs):
         return [None, "fake"]
 
-    def get_container(self, *args):
+    def get_container(self, *args, **kwargs):
         return [None, [{"name": "fake"}]]
 
 
@@ -75,11 +75,11 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         mock_time.start()
         self.addCleanup(mock_time.stop)
 
-        # Mock copytree to avoid creating temporary templates
-        mock_copytree = mock.patch('shutil.copytree',
-                                   autospec=True)
-        mock_copytree.start()
-        self.addCleanup(mock_copytree.stop)
+        # Mock link_templates_tree to avoid creating temporary templates
+        mock_link_tree = mock.patch('tripleoclient.utils.link_templates_tree',
+                                    autospec=True)
+        mock_link_tree.start()
+        self.addCleanup(mock_link_tree.stop)
 
         # Mock sleep to reduce time of test
         mock_sleep = mock.patch('time.sleep', autospec=True)
@@ -100,7 +100,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         autospec=True)
     @mock.patch('tripleoclient.workflows.deployment.get_horizon_url',
                 autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch("heatclient.common.event_utils.get_events")
     @mock.patch('tripleo_common.update.add_breakpoints_cleanup_into_env',
@@ -125,7 +125,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                        mock_deploy_postconfig,
                        mock_create_parameters_env,
                        mock_breakpoints_cleanupm,
-                       mock_events, mock_tarball,
+                       mock_events, mock_upload_archive,
                        mock_get_horizon_url,
                        mock_list_plans,
                        mock_config_download,
@@ -213,7 +213,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
     @mock.patch('tripleoclient.utils.get_overcloud_endpoint', autospec=True)
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_deploy_postconfig', autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch('tripleo_common.update.add_breakpoints_cleanup_into_env',
                 autospec=True)
@@ -235,7 +235,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                         mock_write_overcloudrc,
                         mock_create_tempest_deployer_input,
                         mock_validate_args,
-                        mock_breakpoints_cleanup, mock_tarball,
+                        mock_breakpoints_cleanup, mock_upload_archive,
                         mock_postconfig, mock_get_overcloud_endpoint,
                         mock_invoke_plan_env_wf,
                         mock_get_horizon_url,
@@ -306,10 +306,8 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
 
         mock_validate_args.assert_called_once_with(parsed_args)
 
-        mock_tarball.create_tarball.assert_called_with(
-            self.tmp_dir.join('tripleo-heat-templates'), mock.ANY)
-        mock_tarball.tarball_extract_to_swift_container.assert_called_with(
-            clients.tripleoclient.object_store, mock.ANY, 'overcloud')
+        mock_upload_archive.assert_called_with(
+            clients.tripleoclient.object_store, 'overcloud', mock.ANY)
         self.assertFalse(mock_invoke_plan_env_wf.called)
 
         calls = [
@@ -351,7 +349,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
     @mock.patch('tripleoclient.utils.get_overcloud_endpoint', autospec=True)
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_deploy_postconfig', autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch('tripleo_common.update.add_breakpoints_cleanup_into_env',
                 autospec=True)
@@ -377,7 +375,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
             mock_create_tempest_deployer, mock_create_parameters_env,
             mock_validate_args,
             mock_breakpoints_cleanup,
-            mock_tarball, mock_postconfig,
+            mock_upload_archive, mock_postconfig,
             mock_get_overcloud_endpoint, mock_shutil_rmtree,
             mock_invoke_plan_env_wf, mock_get_horizon_url,
             mock_list_plans, mock_config_download,
@@ -468,16 +466,14 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         mock_create_tempest_deployer.assert_called_with()
         mock_validate_args.assert_called_once_with(parsed_args)
 
-        mock_tarball.create_tarball.assert_called_with(
-            '/tmp/tht/tripleo-heat-templates', mock.ANY)
-        mock_tarball.tarball_extract_to_swift_container.assert_called_with(
-            clients.tripleoclient.object_store, mock.ANY, 'overcloud')
+        mock_upload_archive.assert_called_with(
+            clients.tripleoclient.object_store, 'overcloud', mock.ANY)
 
         workflow_client.action_executions.create.assert_called()
         workflow_client.executions.create.assert_called()
 
         mock_open_context.assert_has_calls(
-            [mock.call('the-plan-environment.yaml')])
+            [mock.call('the-plan-environment.yaml', 'rb')])
         clients.tripleoclient.object_store.put_object.assert_called()
         self.assertTrue(mock_invoke_plan_env_wf.called)
 
@@ -494,7 +490,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
     @mock.patch('tripleoclient.utils.get_overcloud_endpoint', autospec=True)
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_deploy_postconfig', autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch('tripleo_common.update.add_breakpoints_cleanup_into_env',
                 autospec=True)
@@ -520,7 +516,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
             mock_write_overcloudrc,
             mock_create_tempest_deployer_input,
             mock_create_parameters_env, mock_validate_args,
-            mock_breakpoints_cleanup, mock_tarball,
+            mock_breakpoints_cleanup, mock_upload_archive,
             mock_postconfig, mock_get_overcloud_endpoint,
             mock_deprecated_params, mock_get_horizon_url,
             mock_list_plans, mock_config_downlad,
@@ -591,7 +587,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         autospec=True)
     @mock.patch('tripleoclient.workflows.deployment.get_horizon_url',
                 autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch("heatclient.common.event_utils.get_events", autospec=True)
     @mock.patch('tripleo_common.update.add_breakpoints_cleanup_into_env',
@@ -613,7 +609,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                                      mock_create_tempest_deployer_input,
                                      mock_deploy_postconfig,
                                      mock_breakpoints_cleanup,
-                                     mock_events, mock_tarball,
+                                     mock_events, mock_upload_archive,
                                      mock_get_horizon_url,
                                      mock_list_plans,
                                      mock_config_download,
@@ -711,7 +707,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         autospec=True)
     @mock.patch('tripleoclient.workflows.deployment.get_horizon_url',
                 autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
                 autospec=True)
@@ -726,7 +722,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
     def test_environment_dirs(self, mock_deploy_heat,
                               mock_update_parameters, mock_post_config,
                               mock_utils_endpoint, mock_utils_createrc,
-                              mock_utils_tempest, mock_tarball,
+                              mock_utils_tempest, mock_upload_archive,
                               mock_get_horizon_url, mock_list_plans,
                               mock_config_download,
                               mock_enable_ssh_admin,
@@ -782,7 +778,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
     @mock.patch(
         'tripleoclient.workflows.plan_management.list_deployment_plans',
         autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
                 autospec=True)
@@ -799,7 +795,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                                   mock_update_parameters, mock_post_config,
                                   mock_utils_get_stack, mock_utils_endpoint,
                                   mock_utils_createrc, mock_utils_tempest,
-                                  mock_tarball, mock_list_plans):
+                                  mock_upload_archive, mock_list_plans):
 
         clients = self.app.client_manager
         mock_list_plans.return_value = []
@@ -844,7 +840,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
     @mock.patch(
         'tripleoclient.workflows.plan_management.list_deployment_plans',
         autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
                 autospec=True)
@@ -862,7 +858,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                                                   mock_utils_endpoint,
                                                   mock_utils_createrc,
                                                   mock_utils_tempest,
-                                                  mock_tarball,
+                                                  mock_upload_archive,
                                                   mock_list_plans):
 
         clients = self.app.client_manager
@@ -906,7 +902,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                                   parsed_args)
         self.assertIn('tmp/doesnexit.yaml', str(error))
 
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
                 autospec=True)
@@ -924,7 +920,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                                                 mock_utils_endpoint,
                                                 mock_utils_createrc,
                                                 mock_utils_tempest,
-                                                mock_tarball):
+                                                mock_upload_archive):
 
         clients = self.app.client_manager
         workflow_client = clients.workflow_engine
@@ -998,7 +994,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         autospec=True)
     @mock.patch('tripleoclient.workflows.deployment.get_horizon_url',
                 autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch("heatclient.common.event_utils.get_events", autospec=True)
     @mock.patch('tripleo_common.update.add_breakpoints_cleanup_into_env',
@@ -1024,7 +1020,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                              mock_create_tempest_deployer_input,
                              mock_deploy_postconfig,
                              mock_breakpoints_cleanup,
-                             mock_events, mock_tarball,
+                             mock_events, mock_upload_archive,
                              mock_get_horizon_url,
                              mock_list_plans,
                              mock_config_download,
@@ -1247,7 +1243,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         autospec=True)
     @mock.patch('tripleoclient.workflows.deployment.get_horizon_url',
                 autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
                 autospec=True)
@@ -1262,7 +1258,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                           mock_oc_endpoint,
                           mock_create_ocrc,
                           mock_create_tempest_deployer_input,
-                          mock_tarball, mock_get_horizon_url,
+                          mock_upload_archive, mock_get_horizon_url,
                           mock_list_plans,
                           mock_config_download,
                           mock_enable_ssh_admin,
@@ -1378,7 +1374,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
     @mock.patch(
         'tripleoclient.workflows.plan_management.list_deployment_plans',
         autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_create_parameters_env', autospec=True)
@@ -1391,7 +1387,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                                   mock_process_env,
                                   mock_write_overcloudrc,
                                   mock_create_parameters_env,
-                                  mock_tarball,
+                                  mock_upload_archive,
                                   mock_list_plans):
 
         arglist = ['--templates', '--control-scale', '3']
@@ -1438,7 +1434,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                 autospec=True)
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_deploy_postconfig', autospec=True)
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
     @mock.patch('tripleo_common.update.add_breakpoints_cleanup_into_env')
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
@@ -1464,7 +1460,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
                                  mock_create_parameters_env,
                                  mock_validate_args,
                                  mock_breakpoints_cleanup,
-                                 mock_tarball,
+                                 mock_upload_archive,
                                  mock_deploy_post_config,
                                  mock_get_horizon_url,
                                  mock_list_plans,
@@ -1598,6 +1594,7 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         mock_get_template_contents.return_value = [{}, {}]
 
         self.cmd.clients = {}
+        self.cmd.object_client = object_client
 
         self.cmd._heat_deploy(mock_stack, 'mock_stack', '/tmp', {},
                               {}, 1, '/tmp', {}, True, False, False, None)
@@ -1754,6 +1751,76 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
         self.assertTrue(mock_get_overcloud_hosts.called)
         self.assertTrue(mock_config_download.called)
 
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_deploy_postconfig', autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_update_parameters', autospec=True)
+    @mock.patch('tripleoclient.utils.get_stack', autospec=True)
+    @mock.patch('tripleoclient.workflows.deployment.get_overcloud_hosts')
+    @mock.patch('tripleoclient.workflows.deployment.enable_ssh_admin')
+    @mock.patch('tripleoclient.workflows.deployment.get_horizon_url',
+                autospec=True)
+    @mock.patch('tripleoclient.workflows.deployment.config_download')
+    @mock.patch('tripleoclient.utils.create_tempest_deployer_input',
+                autospec=True)
+    @mock.patch('tripleoclient.utils.get_overcloud_endpoint', autospec=True)
+    @mock.patch('tripleoclient.utils.write_overcloudrc', autospec=True)
+    @mock.patch('tripleoclient.workflows.deployment.create_overcloudrc',
+                autospec=True)
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_deploy_tripleo_heat_templates_tmpdir', autospec=True)
+    def test_config_download_resume(
+            self, mock_deploy_tmpdir,
+            mock_overcloudrc, mock_write_overcloudrc,
+            mock_overcloud_endpoint,
+            mock_create_tempest_deployer_input,
+            mock_config_download, mock_get_horizon_url,
+            mock_enable_ssh_admin,
+            mock_get_overcloud_hosts, mock_get_stack,
+            mock_update_parameters, mock_deploy_postconfig):
+        stack = mock.Mock(stack_name='overcloud',
+                          stack_status='UPDATE_COMPLETE')
+        mock_get_stack.return_value = stack
+
+        arglist = ['--templates', '--resume', 'EXEC-ID']
+        verifylist = [
+            ('templates', '/usr/share/openstack-tripleo-heat-templates/'),
+            ('resume', 'EXEC-ID'),
+        ]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+
+        self.cmd.take_action(parsed_args)
+        self.assertFalse(mock_deploy_tmpdir.called)
+        self.assertFalse(mock_enable_ssh_admin.called)
+        self.assertFalse(mock_get_overcloud_hosts.called)
+        self.assertEqual('EXEC-ID',
+                         mock_config_download.call_args[1]['execution_id'])
+        self.assertIs(stack, mock_config_download.call_args[0][2])
+        mock_overcloudrc.assert_called_once_with(
+            mock.ANY, container='overcloud', no_proxy=mock.ANY)
+
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_update_parameters', autospec=True)
+    @mock.patch('tripleoclient.utils.get_stack', autospec=True)
+    @mock.patch('tripleoclient.workflows.deployment.config_download')
+    @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
+                '_deploy_tripleo_heat_templates_tmpdir', autospec=True)
+    def test_config_download_resume_without_config_download(
+            self, mock_deploy_tmpdir, mock_config_download, mock_get_stack,
+            mock_update_parameters):
+        arglist = ['--templates', '--resume', 'EXEC-ID', '--stack-only']
+        verifylist = [
+            ('resume', 'EXEC-ID'),
+            ('config_download', False),
+        ]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+
+        self.assertRaises(oscexc.CommandError,
+                          self.cmd.take_action, parsed_args)
+        self.assertFalse(mock_get_stack.called)
+        self.assertFalse(mock_deploy_tmpdir.called)
+        self.assertFalse(mock_config_download.called)
+
     def test_download_missing_files_from_plan(self):
         # Restore the real function so we don't accidentally call the mock
         self.cmd._download_missing_files_from_plan = self.real_download_missing
@@ -1765,16 +1832,42 @@ class TestDeployOvercloud(fakes.TestDeployOvercloud):
 
         mock_open = mock.mock_open()
         mock_makedirs = mock.Mock()
-        builtin_mod = six.moves.builtins.__name__
 
         with mock.patch('os.makedirs', mock_makedirs):
-            with mock.patch('%s.open' % builtin_mod, mock_open):
+            with mock.patch('tripleoclient.utils.replace_file', mock_open):
                 self.cmd._download_missing_files_from_plan(dirname,
                                                            'overcast')
 
         mock_makedirs.assert_called_with(dirname)
         mock_open.assert_called()
 
+    def test_write_user_environment_linked(self):
+        tmp_dir = self.useFixture(fixtures.TempDir()).path
+        self.cmd.object_client = mock.Mock()
+        source = os.path.join(tmp_dir, 'source', 'user-environments',
+                              'tripleoclient-parameters.yaml')
+        os.makedirs(os.path.dirname(source))
+        with open(source, 'w') as f:
+            f.write('source')
+        tht_root = os.path.join(tmp_dir, 'tht')
+        user_env = os.path.join(tht_root, 'user-environments',
+                                'tripleoclient-parameters.yaml')
+        os.makedirs(os.path.dirname(user_env))
+        os.link(source, user_env)
+
+        env_path, swift_path = self.cmd._write_user_environment(
+            {'parameter_defaults': {'Foo': 'bar'}},
+            'tripleoclient-parameters.yaml', tht_root, 'overcloud')
+
+        self.assertEqual(user_env, env_path)
+        self.cmd.object_client.put_object.assert_called_once_with(
+            'overcloud', swift_path, mock.ANY)
+        with open(user_env) as f:
+            self.assertEqual({'parameter_defaults': {'Foo': 'bar'}},
+                             yaml.safe_load(f))
+        with open(source) as f:
+            self.assertEqual('source', f.read())
+
 
 class TestArgumentValidation(fakes.TestDeployOvercloud):
 
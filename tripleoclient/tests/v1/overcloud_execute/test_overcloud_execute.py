@@ -0,0 +1,137 @@
+#   Copyright 2018 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+import os
+
+import fixtures
+import mock
+
+from tripleoclient import exceptions
+from tripleoclient.tests import fakes as tests_fakes
+from tripleoclient.tests.v1.overcloud_deploy import fakes
+from tripleoclient.v1 import overcloud_execute
+
+
+class TestRemoteExecute(fakes.TestDeployOvercloud):
+
+    def setUp(self):
+        super(TestRemoteExecute, self).setUp()
+
+        self.cmd = overcloud_execute.RemoteExecute(self.app, None)
+        self.tmp_dir = self.useFixture(fixtures.TempDir()).path
+        self.script = os.path.join(self.tmp_dir, 'my-script.sh')
+        with open(self.script, 'w') as f:
+            f.write('#!/bin/sh\necho hello\n')
+
+        servers = []
+        for name in ('overcloud-controller-0', 'overcloud-compute-0',
+                     'overcloud-compute-1'):
+            server = mock.Mock()
+            server.name = name
+            servers.append(server)
+        self.app.client_manager.compute.servers.list.return_value = servers
+
+        self.workflow = self.app.client_manager.workflow_engine
+        self.workflow.executions.create.return_value = mock.Mock(id='IDID')
+        self.app.client_manager.tripleoclient = (
+            tests_fakes.FakeClientWrapper())
+        self.websocket = self.app.client_manager.tripleoclient.ws
+        self.websocket.wait_for_messages = mock.Mock()
+
+        self.useFixture(fixtures.MockPatch('sys.stdout'))
+
+    def _result(self, server_name, status_code=0, stdout='hello\n',
+                stderr=''):
+        return {
+            'execution': {'id': 'SUB-%s' % server_name},
+            'status': 'SUCCESS',
+            'server_name': server_name,
+            'server_uuid': 'UUID-%s' % server_name,
+            'config_name': 'myscriptsh',
+            'status_code': status_code,
+            'stdout': stdout,
+            'stderr': stderr,
+        }
+
+    def test_execute(self):
+        self.websocket.wait_for_messages.return_value = iter([
+            self._result('overcloud-compute-0'),
+            self._result('overcloud-compute-1'),
+            {'execution': {'id': 'IDID'}, 'status': 'SUCCESS'},
+        ])
+        arglist = ['-s', 'compute', self.script]
+        verifylist = [
+            ('server_name', 'compute'),
+            ('output_dir', None),
+            ('timeout', None),
+        ]
+        parsed_args = self.check_parser(self.cmd, arglist, verifylist)
+
+        self.cmd.take_action(parsed_args)
+
+        self.workflow.executions.create.assert_called_once_with(
+            'tripleo.deployment.v1.deploy_on_servers',
+            workflow_input={
+                'server_name': 'compute',
+                'config_name': 'myscriptsh',
+                'group': 'script',
+                'config': '#!/bin/sh\necho hello\n',
+            })
+
+    def test_execute_output_dir(self):
+        self.websocket.wait_for_messages.return_value = iter([
+            self._result('overcloud-compute-0'),
+            self._result('overcloud-compute-1', status_code=1,
+                         stderr='oops\n'),
+            {'execution': {'id': 'IDID'}, 'status': 'SUCCESS'},
+        ])
+        output_dir = os.path.join(self.tmp_dir, 'output')
+        arglist = ['-s', 'compute', '-o', output_dir, self.script]
+        parsed_args = self.check_parser(self.cmd, arglist,
+                                        [('output_dir', output_dir)])
+
+        with mock.patch.object(self.cmd, '_print_summary') as mock_summary:
+            error = self.assertRaises(exceptions.RemoteExecuteError,
+                                      self.cmd.take_action, parsed_args)
+
+        self.assertIn('overcloud-compute-1', str(error))
+        self.assertNotIn('overcloud-compute-0', str(error))
+        mock_summary.assert_called_once_with(
+            {'overcloud-compute-0': ('SUCCESS', 0),
+             'overcloud-compute-1': ('FAILED', 1)},
+            ['overcloud-compute-0', 'overcloud-compute-1'])
+        self.assertEqual(['overcloud-compute-0.stdout',
+                          'overcloud-compute-1.stderr',
+                          'overcloud-compute-1.stdout'],
+                         sorted(os.listdir(output_dir)))
+        with open(os.path.join(output_dir,
+                               'overcloud-compute-1.stderr')) as f:
+            self.assertEqual('oops\n', f.read())
+
+    @mock.patch('tripleoclient.workflows.base.check_execution_status')
+    def test_execute_timeout(self, mock_check):
+        self.websocket.wait_for_messages.side_effect = [
+            iter([self._result('overcloud-compute-0')]),
+            exceptions.WebSocketTimeout(),
+        ]
+        arglist = ['-s', 'compute', '-t', '60', self.script]
+        parsed_args = self.check_parser(self.cmd, arglist, [('timeout', 60)])
+
+        error = self.assertRaises(exceptions.RemoteExecuteError,
+                                  self.cmd.take_action, parsed_args)
+
+        self.assertIn('1 of 2 servers: overcloud-compute-1', str(error))
+        timeout = self.websocket.wait_for_messages.call_args[1]['timeout']
+        self.assertLessEqual(timeout, 60)
@@ -34,7 +34,7 @@ class TestFFWDUpgradePrepare(fakes.TestFFWDUpgradePrepare):
                                                              app_args)
         uuid4_patcher = mock.patch('uuid.uuid4', return_value="UUID4")
         self.mock_uuid4 = uuid4_patcher.start()
-        self.addCleanup(self.mock_uuid4.stop)
+        self.addCleanup(uuid4_patcher.stop)
 
     @mock.patch('tripleoclient.workflows.deployment.create_overcloudrc',
                 autospec=True)
@@ -49,7 +49,7 @@ class TestFFWDUpgradePrepare(fakes.TestFFWDUpgradePrepare):
                 autospec=True)
     @mock.patch('os.path.abspath')
     @mock.patch('yaml.load')
-    @mock.patch('shutil.copytree', autospec=True)
+    @mock.patch('tripleoclient.utils.link_templates_tree', autospec=True)
     @mock.patch('six.moves.builtins.open')
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_deploy_tripleo_heat_templates', autospec=True)
@@ -103,7 +103,7 @@ class TestFFWDUpgradePrepare(fakes.TestFFWDUpgradePrepare):
     @mock.patch('six.moves.builtins.open')
     @mock.patch('os.path.abspath')
     @mock.patch('yaml.load')
-    @mock.patch('shutil.copytree', autospec=True)
+    @mock.patch('tripleoclient.utils.link_templates_tree', autospec=True)
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_deploy_tripleo_heat_templates', autospec=True)
     def test_ffwd_upgrade_failed(
@@ -139,7 +139,7 @@ class TestFFWDUpgradeRun(fakes.TestFFWDUpgradeRun):
 
         uuid4_patcher = mock.patch('uuid.uuid4', return_value="UUID4")
         self.mock_uuid4 = uuid4_patcher.start()
-        self.addCleanup(self.mock_uuid4.stop)
+        self.addCleanup(uuid4_patcher.stop)
 
     @mock.patch('tripleoclient.workflows.package_update.update_ansible',
                 autospec=True)
@@ -34,7 +34,7 @@ class TestOvercloudUpdatePrepare(fakes.TestOvercloudUpdatePrepare):
 
         uuid4_patcher = mock.patch('uuid.uuid4', return_value="UUID4")
         self.mock_uuid4 = uuid4_patcher.start()
-        self.addCleanup(self.mock_uuid4.stop)
+        self.addCleanup(uuid4_patcher.stop)
 
     @mock.patch('tripleoclient.utils.get_stack',
                 autospec=True)
@@ -44,7 +44,7 @@ class TestOvercloudUpdatePrepare(fakes.TestOvercloudUpdatePrepare):
                 autospec=True)
     @mock.patch('os.path.abspath')
     @mock.patch('yaml.load')
-    @mock.patch('shutil.copytree', autospec=True)
+    @mock.patch('tripleoclient.utils.link_templates_tree', autospec=True)
     @mock.patch('six.moves.builtins.open')
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_deploy_tripleo_heat_templates', autospec=True)
@@ -84,7 +84,7 @@ class TestOvercloudUpdatePrepare(fakes.TestOvercloudUpdatePrepare):
     @mock.patch('six.moves.builtins.open')
     @mock.patch('os.path.abspath')
     @mock.patch('yaml.load')
-    @mock.patch('shutil.copytree', autospec=True)
+    @mock.patch('tripleoclient.utils.link_templates_tree', autospec=True)
     @mock.patch('tripleoclient.v1.overcloud_deploy.DeployOvercloud.'
                 '_deploy_tripleo_heat_templates', autospec=True)
     def test_update_failed(self, mock_deploy, mock_copy, mock_yaml,
@@ -121,7 +121,7 @@ class TestOvercloudUpdateRun(fakes.TestOvercloudUpdateRun):
 
         uuid4_patcher = mock.patch('uuid.uuid4', return_value="UUID4")
         self.mock_uuid4 = uuid4_patcher.start()
-        self.addCleanup(self.mock_uuid4.stop)
+        self.addCleanup(uuid4_patcher.stop)
 
     @mock.patch('tripleoclient.workflows.package_update.update_ansible',
                 autospec=True)
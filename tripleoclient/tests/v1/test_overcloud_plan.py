@@ -194,8 +194,8 @@ class TestOvercloudCreatePlan(utils.TestCommand):
                 'source_url': None
             })
 
-    @mock.patch("tripleoclient.workflows.plan_management.tarball")
-    def test_create_custom_plan(self, mock_tarball):
+    @mock.patch("tripleoclient.object_transfer.upload_archive")
+    def test_create_custom_plan(self, mock_upload_archive):
 
         # Setup
         arglist = ['overcast', '--templates', '/fake/path']
@@ -228,8 +228,8 @@ class TestOvercloudCreatePlan(utils.TestCommand):
                 'generate_passwords': True
             })
 
-    @mock.patch("tripleoclient.workflows.plan_management.tarball")
-    def test_create_custom_plan_failed(self, mock_tarball):
+    @mock.patch("tripleoclient.object_transfer.upload_archive")
+    def test_create_custom_plan_failed(self, mock_upload_archive):
 
         # Setup
         arglist = ['overcast', '--templates', '/fake/path']
@@ -293,9 +293,9 @@ class TestOvercloudCreatePlan(utils.TestCommand):
             mock.call('overcast', u'all-nodes-validation.yaml'),
         ], any_order=True)
 
-    @mock.patch("tripleoclient.workflows.plan_management.tarball")
+    @mock.patch("tripleoclient.object_transfer.upload_archive")
     def test_create_custom_plan_plan_environment_file(self,
-                                                      mock_tarball):
+                                                      mock_upload_archive):
         # Setup
         arglist = ['overcast', '--templates', '/fake/path',
                    '-p', 'the_plan_environment.yaml']
@@ -331,7 +331,7 @@ class TestOvercloudCreatePlan(utils.TestCommand):
             })
 
         mock_open_context.assert_has_calls(
-            [mock.call('the_plan_environment.yaml')])
+            [mock.call('the_plan_environment.yaml', 'rb')])
 
         self.tripleoclient.object_store.put_object.assert_called_once_with(
             'overcast', 'plan-environment.yaml', mock_open_context())
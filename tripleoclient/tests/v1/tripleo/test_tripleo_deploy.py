@@ -108,15 +108,15 @@ class TestDeployUndercloud(TestPluginV1):
         self.assertEqual(self.cmd._get_primary_role_name(), 'Bar')
 
     @mock.patch('os.path.exists', side_effect=[True, False])
-    @mock.patch('shutil.copytree')
+    @mock.patch('tripleoclient.utils.link_templates_tree')
     @mock.patch('tripleoclient.v1.tripleo_deploy.Deploy.'
                 '_create_working_dirs')
-    def test_populate_templates_dir(self, mock_workingdirs, mock_copy,
+    def test_populate_templates_dir(self, mock_workingdirs, mock_link,
                                     mock_exists):
         self.cmd.tht_render = '/foo'
         self.cmd._populate_templates_dir('/bar')
         mock_workingdirs.assert_called_once()
-        mock_copy.assert_called_once_with('/bar', '/foo', symlinks=True)
+        mock_link.assert_called_once_with('/bar', '/foo')
 
     @mock.patch('os.path.exists', return_value=False)
     @mock.patch('tripleoclient.v1.tripleo_deploy.Deploy.'
@@ -201,10 +201,13 @@ class TestDeployUndercloud(TestPluginV1):
                 'parse', autospec=True, return_value=dict())
     @mock.patch('tripleoclient.v1.tripleo_deploy.Deploy.'
                 '_setup_heat_environments', autospec=True)
+    @mock.patch('tripleoclient.v1.tripleo_deploy.Deploy._wait_for_heat',
+                autospec=True)
     @mock.patch('tripleo_common.image.kolla_builder.'
                 'container_images_prepare_multi')
     def test_deploy_tripleo_heat_templates_redir(self,
                                                  mock_cipm,
+                                                 mock_wait_heat,
                                                  mock_setup_heat_envs,
                                                  mock_hc_templ_parse,
                                                  mock_hc_env_parse,
@@ -227,9 +230,14 @@ class TestDeployUndercloud(TestPluginV1):
             '/tmp/thtroot/environments/myenv.yaml',
             '/tmp/thtroot42/notouch.yaml',
             '../outside.yaml']
+        # Heat is only needed by the stack create
+        mock_wait_heat.side_effect = lambda cmd, args: self.assertFalse(
+            self.orc.stacks.create.called)
 
         self.cmd._deploy_tripleo_heat_templates(self.orc, parsed_args)
 
+        mock_wait_heat.assert_called_once_with(self.cmd, parsed_args)
+        self.orc.stacks.create.assert_called_once()
         mock_hc_process.assert_has_calls([
             mock.call(env_path='./inside.yaml'),
             mock.call(env_path='/twd/templates/abs.yaml'),
@@ -238,6 +246,8 @@ class TestDeployUndercloud(TestPluginV1):
             mock.call(env_path='/tmp/thtroot42/notouch.yaml'),
             mock.call(env_path='../outside.yaml')])
 
+    @mock.patch('heatclient.common.template_utils.'
+                'resolve_environment_urls', autospec=True)
     @mock.patch('heatclient.common.template_utils.'
                 'process_environment_and_files', return_value=({}, {}),
                 autospec=True)
@@ -251,13 +261,16 @@ class TestDeployUndercloud(TestPluginV1):
     @mock.patch('tripleoclient.v1.tripleo_deploy.Deploy.'
                 '_setup_heat_environments', autospec=True)
     @mock.patch('yaml.safe_dump', autospec=True)
-    @mock.patch('yaml.safe_load', autospec=True)
+    @mock.patch('tripleoclient.yaml_cache.load_environment', autospec=True)
     @mock.patch('six.moves.builtins.open')
     @mock.patch('tempfile.NamedTemporaryFile', autospec=True)
+    @mock.patch('tripleoclient.v1.tripleo_deploy.Deploy._wait_for_heat',
+                autospec=True)
     @mock.patch('tripleo_common.image.kolla_builder.'
                 'container_images_prepare_multi')
     def test_deploy_tripleo_heat_templates_rewrite(self,
                                                    mock_cipm,
+                                                   mock_wait_heat,
                                                    mock_temp, mock_open,
                                                    mock_yaml_load,
                                                    mock_yaml_dump,
@@ -265,7 +278,8 @@ class TestDeployUndercloud(TestPluginV1):
                                                    mock_hc_templ_parse,
                                                    mock_hc_env_parse,
                                                    mock_hc_get_templ_cont,
-                                                   mock_hc_process):
+                                                   mock_hc_process,
+                                                   mock_hc_resolve):
         def hc_process(*args, **kwargs):
             if 'abs.yaml' in kwargs['env_path']:
                 raise hc_exc.CommandError
@@ -309,6 +323,30 @@ class TestDeployUndercloud(TestPluginV1):
         mock_yaml_dump.assert_has_calls([mock.call(rewritten_env,
                                         default_flow_style=False)])
 
+    @mock.patch('tripleoclient.utils.wait_api_port_ready',
+                side_effect=exceptions.ProcessExited)
+    def test_wait_for_heat_exited(self, mock_wait):
+        parsed_args = self.check_parser(self.cmd,
+                                        ['--local-ip', '127.0.0.1/8'], [])
+        self.cmd.heat_pid = 42
+
+        self.assertRaises(exceptions.ProcessExited,
+                          self.cmd._wait_for_heat, parsed_args)
+
+        mock_wait.assert_called_once_with('8006', pid=42)
+        self.assertIsNone(self.cmd.heat_pid)
+
+    @mock.patch('tripleoclient.utils.wait_api_port_ready',
+                return_value=False)
+    def test_wait_for_heat_timeout(self, mock_wait):
+        parsed_args = self.check_parser(self.cmd,
+                                        ['--local-ip', '127.0.0.1/8'], [])
+        self.cmd.heat_pid = 42
+
+        self.assertRaises(exceptions.DeploymentError,
+                          self.cmd._wait_for_heat, parsed_args)
+        self.assertEqual(42, self.cmd.heat_pid)
+
     @mock.patch('shutil.copy')
     @mock.patch('os.path.exists', return_value=False)
     def test_normalize_user_templates(self, mock_exists, mock_copy):
@@ -367,6 +405,7 @@ class TestDeployUndercloud(TestPluginV1):
     @mock.patch('yaml.safe_dump', autospec=True)
     @mock.patch('os.path.isfile', return_value=True)
     @mock.patch('six.moves.builtins.open')
+    @mock.patch('tripleoclient.utils.replace_file')
     @mock.patch('tripleoclient.v1.tripleo_deploy.Deploy.'
                 '_process_hieradata_overrides', autospec=True)
     @mock.patch('tripleoclient.v1.tripleo_deploy.Deploy.'
@@ -379,8 +418,8 @@ class TestDeployUndercloud(TestPluginV1):
                 autospec=True)
     def test_setup_heat_environments_dropin(
             self, mock_run, mock_paths, mock_norm, mock_update_pass_env,
-            mock_process_hiera, mock_open, mock_os, mock_yaml_dump,
-            mock_yaml_load):
+            mock_process_hiera, mock_replace, mock_open, mock_os,
+            mock_yaml_dump, mock_yaml_load):
 
         parsed_args = self.check_parser(self.cmd,
                                         ['--local-ip', '127.0.0.1/8',
@@ -393,7 +432,7 @@ class TestDeployUndercloud(TestPluginV1):
         environment = self.cmd._setup_heat_environments(parsed_args)
 
         self.assertIn(dropin, environment)
-        mock_open.assert_has_calls([mock.call(dropin, 'w')])
+        mock_replace.assert_has_calls([mock.call(dropin)])
 
         # unpack the dump yaml calls to verify if the produced stack update
         # dropin matches our expectations
@@ -498,6 +537,13 @@ class TestDeployUndercloud(TestPluginV1):
         with open(os.path.join(tht_outside, 'outside.yaml'),
                   mode='w') as env_file:
             yaml.dump({}, env_file)
+        # Files written by the deployment, they must not be written through
+        # the links of the templates tree
+        written = ('tripleoclient-hosts-portmaps.yaml',
+                   'standalone-stack-vstate-dropin.yaml')
+        for name in written:
+            with open(os.path.join(tht_from, name), mode='w') as env_file:
+                env_file.write('source')
 
         tht_render = os.path.join(tht_to, 'tripleo-heat-installer-templates')
         mock_update_pass_env.return_value = os.path.join(
@@ -540,6 +586,37 @@ class TestDeployUndercloud(TestPluginV1):
             environment = self.cmd._setup_heat_environments(parsed_args)
 
             self.assertEqual(expected_env, environment)
+        for name in written:
+            with open(os.path.join(tht_from, name)) as env_file:
+                self.assertEqual('source', env_file.read())
+            with open(os.path.join(tht_render, name)) as env_file:
+                self.assertIn('parameter_defaults', yaml.safe_load(env_file))
+
+    def test_process_hieradata_overrides_linked(self):
+        tmpdir = self.useFixture(fixtures.TempDir()).path
+        source = os.path.join(tmpdir, 'source.yaml')
+        with open(source, 'w') as f:
+            f.write('source')
+        legacy = os.path.join(tmpdir, 'legacy.yaml')
+        with open(legacy, 'w') as f:
+            yaml.safe_dump({'foo': 'bar'}, f)
+        self.cmd.output_dir = tmpdir
+        self.cmd.tmp_ansible_dir = tmpdir
+        self.cmd.tht_render = os.path.join(tmpdir, 'templates')
+        os.mkdir(self.cmd.tht_render)
+        override = os.path.join(self.cmd.tht_render,
+                                'tripleo-hieradata-override.yaml')
+        os.link(source, override)
+
+        self.assertEqual(override,
+                         self.cmd._process_hieradata_overrides(legacy))
+
+        with open(override) as f:
+            self.assertEqual(
+                {'parameter_defaults': {'StandaloneExtraConfig': {
+                    'foo': 'bar'}}}, yaml.safe_load(f))
+        with open(source) as f:
+            self.assertEqual('source', f.read())
 
     @mock.patch('tripleoclient.v1.tripleo_deploy.Deploy.'
                 '_create_working_dirs', autospec=True)
@@ -43,7 +43,8 @@ class TestBaseWorkflows(utils.TestCommand):
         self.assertEqual([payload_a, payload_b], messages)
 
         self.assertFalse(mistral.executions.get.called)
-        websocket.wait_for_messages.assert_called_with(timeout=None)
+        websocket.wait_for_messages.assert_called_with(timeout=None,
+                                                       execution_id=1)
 
     def test_wait_for_messages_timeout(self):
         mistral = mock.Mock()
@@ -57,7 +58,300 @@ class TestBaseWorkflows(utils.TestCommand):
         self.assertRaises(exceptions.WebSocketTimeout, list, messages)
 
         self.assertTrue(mistral.executions.get.called)
-        websocket.wait_for_messages.assert_called_with(timeout=None)
+        websocket.wait_for_messages.assert_called_with(timeout=None,
+                                                       execution_id=1)
+
+    @mock.patch('tripleoclient.workflows.base.time.time')
+    def test_wait_for_messages_rate_limits_state_checks(self, mock_time):
+        mock_time.return_value = 100
+        running = {'status': 'RUNNING', 'execution': {'id': 1}}
+        success = {'status': 'SUCCESS', 'execution': {'id': 1}}
+
+        mistral = mock.Mock()
+        mistral.executions.get.return_value.state = 'RUNNING'
+        websocket = mock.Mock()
+        websocket.wait_for_messages.side_effect = [
+            iter([running, running]),
+            iter([success]),
+        ]
+        execution = mock.Mock()
+        execution.id = 1
+
+        messages = list(base.wait_for_messages(mistral, websocket, execution,
+                                               timeout=600))
+
+        self.assertEqual([running, running, success], messages)
+        mistral.executions.get.assert_called_once_with(1)
+        websocket.wait_for_messages.assert_called_with(timeout=10,
+                                                       execution_id=1)
+
+    @mock.patch('tripleoclient.workflows.base.time.time')
+    def test_wait_for_messages_checks_state_when_idle(self, mock_time):
+        mock_time.return_value = 100
+        running = {'status': 'RUNNING', 'execution': {'id': 1}}
+
+        mistral = mock.Mock()
+        mistral.executions.get.return_value.state = 'RUNNING'
+        websocket = mock.Mock()
+
+        def idle(timeout, execution_id):
+            # The workflow ends without sending any message about it
+            mistral.executions.get.return_value.state = 'SUCCESS'
+            raise exceptions.WebSocketTimeout()
+            yield
+
+        websocket.wait_for_messages.side_effect = [
+            iter([running, running]),
+            idle(10, 1),
+        ]
+        execution = mock.Mock()
+        execution.id = 1
+
+        messages = list(base.wait_for_messages(mistral, websocket, execution,
+                                               timeout=600))
+
+        self.assertEqual([running, running], messages)
+        self.assertEqual(2, mistral.executions.get.call_count)
+
+    @mock.patch('tripleoclient.workflows.base.check_execution_status')
+    @mock.patch('tripleoclient.workflows.base.time.time')
+    def test_wait_for_messages_deadline(self, mock_time, mock_check):
+        now = [100]
+        mock_time.side_effect = lambda: now[0]
+        sub_workflow = {'status': 'SUCCESS', 'execution': {'id': 2}}
+
+        def messages(timeout, execution_id, deadline):
+            now[0] += 30
+            yield sub_workflow
+            yield sub_workflow
+
+        mistral = mock.Mock()
+        websocket = mock.Mock()
+        websocket.wait_for_messages.side_effect = messages
+        execution = mock.Mock()
+        execution.id = 1
+
+        messages = base.wait_for_messages(mistral, websocket, execution,
+                                          timeout=600, deadline=150)
+
+        self.assertEqual(sub_workflow, next(messages))
+        self.assertEqual(sub_workflow, next(messages))
+        self.assertRaises(exceptions.WebSocketTimeout, next, messages)
+        self.assertEqual([mock.call(timeout=50, execution_id=1,
+                                    deadline=150),
+                          mock.call(timeout=20, execution_id=1,
+                                    deadline=150)],
+                         websocket.wait_for_messages.call_args_list)
+        mock_check.assert_called_once_with(mistral, 1)
+
+    def test_wait_for_messages_other_root_execution(self):
+        sub_workflow = {'status': 'SUCCESS',
+                        'execution': {'id': 2, 'root_execution_id': 1}}
+        other = {'status': 'SUCCESS',
+                 'execution': {'id': 3, 'root_execution_id': 3}}
+        success = {'status': 'SUCCESS',
+                   'execution': {'id': 1, 'root_execution_id': 1}}
+
+        mistral = mock.Mock()
+        websocket = mock.Mock()
+        websocket.wait_for_messages.return_value = iter(
+            [other, sub_workflow, success])
+        execution = mock.Mock()
+        execution.id = 1
+
+        messages = list(base.wait_for_messages(mistral, websocket, execution))
+
+        self.assertEqual([sub_workflow, success], messages)
+
+    def test_wait_for_messages_no_execution(self):
+        payload = {'status': 'SUCCESS', 'message': 'done'}
+
+        mistral = mock.Mock()
+        websocket = mock.Mock()
+        websocket.wait_for_messages.return_value = iter([payload])
+        execution = mock.Mock()
+        execution.id = 1
+
+        messages = base.wait_for_messages(mistral, websocket, execution)
+
+        self.assertEqual(payload, next(messages))
+
+    def test_wait_for_messages_replay(self):
+        running = {'status': 'RUNNING', 'execution': {'id': 1}}
+        success = {'status': 'SUCCESS', 'execution': {'id': 1}}
+
+        mistral = mock.Mock()
+        mistral.executions.get.return_value.state = 'RUNNING'
+        websocket = mock.Mock()
+        websocket.replay.return_value = [running]
+        websocket.wait_for_messages.return_value = iter([success])
+        execution = mock.Mock()
+        execution.id = 1
+
+        messages = list(base.wait_for_messages(mistral, websocket, execution,
+                                               replay=True))
+
+        self.assertEqual([running, success], messages)
+        websocket.replay.assert_called_once_with(1)
+
+    def test_wait_for_messages_replay_finished(self):
+        running = {'status': 'RUNNING', 'execution': {'id': 1}}
+
+        mistral = mock.Mock()
+        mistral.executions.get.return_value.state = 'SUCCESS'
+        websocket = mock.Mock()
+        websocket.replay.return_value = [running]
+        execution = mock.Mock()
+        execution.id = 1
+
+        messages = list(base.wait_for_messages(mistral, websocket, execution,
+                                               replay=True))
+
+        self.assertEqual([running], messages)
+        self.assertFalse(websocket.wait_for_messages.called)
+
+    @mock.patch('tripleoclient.workflows.base.time.sleep')
+    def test_poll_execution_backoff(self, mock_sleep):
+        mistral = mock.Mock()
+        states = ['RUNNING', 'RUNNING', 'RUNNING', 'RUNNING', 'SUCCESS']
+        mistral.executions.get.side_effect = [mock.Mock(state=state)
+                                              for state in states]
+
+        executions = list(base.poll_execution(mistral, 1, interval=2,
+                                              max_interval=5))
+
+        self.assertEqual(states, [e.state for e in executions])
+        waits = [c[0][0] for c in mock_sleep.call_args_list]
+        self.assertEqual(4, len(waits))
+        for wait, interval in zip(waits, [2, 4, 5, 5]):
+            self.assertTrue(interval / 2.0 <= wait <= interval)
+
+    @mock.patch('tripleoclient.workflows.base.time.sleep')
+    @mock.patch('tripleoclient.workflows.base.time.time')
+    def test_poll_execution_timeout(self, mock_time, mock_sleep):
+        mock_time.side_effect = [0, 1, 11]
+        mistral = mock.Mock()
+        mistral.executions.get.return_value.state = 'RUNNING'
+
+        executions = base.poll_execution(mistral, 1, timeout=10)
+
+        self.assertRaises(exceptions.Timeout, list, executions)
+        self.assertEqual(2, mistral.executions.get.call_count)
+
+    @mock.patch('tripleoclient.workflows.base.time.sleep')
+    @mock.patch('tripleoclient.workflows.base.time.time')
+    def test_poll_execution_idle_timeout(self, mock_time, mock_sleep):
+        now = [0]
+        mock_time.side_effect = lambda: now[0]
+        mock_sleep.side_effect = lambda wait: now.__setitem__(0, now[0] + 8)
+        states = [('RUNNING', 'a'), ('RUNNING', 'b'), ('RUNNING', 'c'),
+                  ('RUNNING', 'c'), ('RUNNING', 'c')]
+        mistral = mock.Mock()
+        mistral.executions.get.side_effect = [
+            mock.Mock(state=state, state_info=info, updated_at=None)
+            for state, info in states]
+
+        executions = base.poll_execution(mistral, 1, interval=20,
+                                         max_interval=20, idle_timeout=10)
+
+        # Changes reset the idle timeout, 16 seconds without any don't
+        self.assertRaises(exceptions.Timeout, list, executions)
+        self.assertEqual(5, mistral.executions.get.call_count)
+        self.assertEqual(32, now[0])
+
+    @mock.patch('tripleoclient.workflows.base.time.sleep')
+    @mock.patch('tripleoclient.workflows.base.time.time')
+    def test_polling_client_deadline(self, mock_time, mock_sleep):
+        now = [0]
+        mock_time.side_effect = lambda: now[0]
+        mock_sleep.side_effect = lambda wait: now.__setitem__(0, now[0] + 8)
+        mistral = mock.Mock()
+        mistral.executions.get.side_effect = lambda execution_id: mock.Mock(
+            state='RUNNING', state_info=str(now[0]))
+        websocket = base.PollingClient(mistral)
+
+        messages = websocket.wait_for_messages(timeout=10, execution_id=1,
+                                               deadline=20)
+
+        # The execution keeps changing, so only the deadline is reached
+        self.assertRaises(exceptions.WebSocketTimeout, next, messages)
+        self.assertEqual(24, now[0])
+
+    @mock.patch('tripleoclient.workflows.base.time.sleep')
+    def test_polling_client(self, mock_sleep):
+        mistral = mock.Mock()
+        mistral.executions.get.side_effect = [
+            mock.Mock(state='RUNNING'),
+            mock.Mock(state='RUNNING'),
+            mock.Mock(id=1, state='ERROR', state_info='Failure',
+                      output='{"result": "a"}'),
+        ]
+        websocket = base.PollingClient(mistral)
+        execution = mock.Mock()
+        execution.id = 1
+
+        messages = list(base.wait_for_messages(mistral, websocket, execution,
+                                               replay=True))
+
+        self.assertEqual([{'status': 'FAILED', 'message': 'Failure',
+                           'result': 'a', 'execution': {'id': 1}}], messages)
+        self.assertEqual(1, mock_sleep.call_count)
+
+    def test_workflow_runner_start(self):
+        payload_a = {'status': 'RUNNING', 'execution': {'id': 2}}
+        payload_b = {'status': 'SUCCESS', 'execution': {'id': 1}}
+
+        clients = mock.Mock()
+        clients.workflow_engine.executions.create.return_value.id = 1
+        websocket = clients.tripleoclient.messaging_websocket.return_value
+        websocket.__enter__ = mock.Mock(return_value=websocket)
+        websocket.__exit__ = mock.Mock(return_value=None)
+        websocket.wait_for_messages.return_value = iter([payload_a,
+                                                         payload_b])
+        on_message = mock.Mock()
+
+        with base.WorkflowRunner(clients) as runner:
+            future = runner.start('test-workflow', {'a': 1}, timeout=60,
+                                  on_message=on_message)
+
+        self.assertEqual(payload_b, future.result())
+        clients.workflow_engine.executions.create.assert_called_once_with(
+            'test-workflow', workflow_input={'a': 1})
+        on_message.assert_has_calls([mock.call(payload_a),
+                                     mock.call(payload_b)])
+        websocket.wait_for_messages.assert_called_once_with(timeout=60,
+                                                            execution_id=1)
+        websocket.__exit__.assert_called_once_with(None, None, None)
+
+    def test_workflow_runner_start_error(self):
+        clients = mock.Mock()
+        clients.workflow_engine.executions.create.side_effect = ValueError
+        websocket = clients.tripleoclient.messaging_websocket.return_value
+
+        with base.WorkflowRunner(clients) as runner:
+            self.assertRaises(ValueError, runner.start, 'test-workflow', {})
+
+        websocket.cleanup.assert_called_once_with()
+
+    def test_workflow_runner_shut_down(self):
+        clients = mock.Mock()
+        websocket = clients.tripleoclient.messaging_websocket.return_value
+
+        runner = base.WorkflowRunner(clients)
+        runner.shutdown()
+        self.assertRaises(RuntimeError, runner.start, 'test-workflow', {})
+
+        websocket.cleanup.assert_called_once_with()
+
+    def test_workflow_runner_submit(self):
+        helper = mock.Mock(side_effect=[1, exceptions.WorkflowServiceError])
+
+        with base.WorkflowRunner(mock.Mock()) as runner:
+            first = runner.submit(helper, 'a', b='c')
+            second = runner.submit(helper, 'd')
+
+        self.assertEqual(1, first.result())
+        self.assertRaises(exceptions.WorkflowServiceError, second.result)
 
     def test_call_action_success(self):
         mistral = mock.Mock()
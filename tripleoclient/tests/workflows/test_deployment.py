@@ -16,6 +16,7 @@ import mock
 
 from osc_lib.tests import utils
 
+from tripleoclient import constants
 from tripleoclient.workflows import deployment
 
 
@@ -107,3 +108,58 @@ class TestDeploymentWorkflows(utils.TestCommand):
         expected = ['4.4.4.4', '5.5.5.5', '6.6.6.6',
                     '10.10.10.10', '11.11.11.11', '12.12.12.12']
         self.assertEqual(sorted(expected), sorted(ips))
+
+    @mock.patch('tripleoclient.workflows.base.wait_for_messages')
+    @mock.patch('tripleoclient.workflows.base.start_workflow')
+    def test_create_overcloudrc(self, start_wf_mock, messages_mock):
+        calls = []
+        self.tripleoclient.messaging_websocket.side_effect = (
+            lambda: calls.append('subscribe') or self.websocket)
+        start_wf_mock.side_effect = (
+            lambda *args, **kwargs: calls.append('start') or
+            mock.Mock(id='IDID'))
+        messages_mock.return_value = iter([
+            {'execution': {'id': 'other'}, 'status': 'SUCCESS',
+             'message': 'Not for us'},
+            {'execution': {'id': 'IDID'}, 'status': 'SUCCESS',
+             'message': {'overcloudrc': 'export OS_CLOUD=overcloud'}}])
+
+        overcloudrcs = deployment.create_overcloudrc(
+            self.app.client_manager, container='overcloud')
+
+        self.assertEqual({'overcloudrc': 'export OS_CLOUD=overcloud'},
+                         overcloudrcs)
+        # The messages of the workflow can't be sent before subscribing
+        self.assertEqual(['subscribe', 'start'], calls)
+        messages_mock.assert_called_once_with(
+            self.workflow, self.websocket, mock.ANY,
+            deployment._WORKFLOW_TIMEOUT)
+
+    @mock.patch('tripleoclient.utils.wait_for_stack_ready', autospec=True)
+    @mock.patch('tripleoclient.workflows.deployment.deploy', autospec=True)
+    def test_deploy_and_wait_timeout(self, mock_deploy, mock_wait):
+        self.app.client_manager.orchestration = mock.Mock()
+        log = mock.Mock()
+
+        deployment.deploy_and_wait(log, self.app.client_manager, None,
+                                   'overcloud', 1, timeout=480)
+
+        mock_deploy.assert_called_once_with(
+            log, self.app.client_manager, container='overcloud',
+            run_validations=False, skip_deploy_identifier=False,
+            timeout=480)
+        mock_wait.assert_called_once_with(
+            self.app.client_manager.orchestration, 'overcloud', None,
+            'CREATE', True,
+            timeout=480 * 60 + constants.STACK_EVENTS_TIMEOUT_SLACK)
+
+    @mock.patch('tripleoclient.utils.wait_for_stack_ready', autospec=True)
+    @mock.patch('tripleoclient.workflows.deployment.deploy', autospec=True)
+    def test_deploy_and_wait_no_timeout(self, mock_deploy, mock_wait):
+        self.app.client_manager.orchestration = mock.Mock()
+        deployment.deploy_and_wait(mock.Mock(), self.app.client_manager,
+                                   None, 'overcloud', 0)
+
+        mock_wait.assert_called_once_with(
+            self.app.client_manager.orchestration, 'overcloud', None,
+            'CREATE', False, timeout=None)
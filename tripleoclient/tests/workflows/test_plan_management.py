@@ -12,7 +12,10 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import fixtures
+import hashlib
 import mock
+import os
 
 from osc_lib.tests import utils
 from swiftclient import exceptions as swift_exc
@@ -39,9 +42,10 @@ class TestPlanCreationWorkflows(utils.TestCommand):
             "status": "SUCCESS",
         }])
 
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
-    def test_create_plan_from_templates_success(self, mock_tarball):
+    def test_create_plan_from_templates_success(
+            self, mock_upload_archive):
         output = mock.Mock(output='{"result": ""}')
         self.workflow.action_executions.create.return_value = output
         self.websocket.wait_for_messages.return_value = self.message_success
@@ -61,9 +65,10 @@ class TestPlanCreationWorkflows(utils.TestCommand):
             workflow_input={'container': 'test-overcloud',
                             'generate_passwords': True})
 
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
-    def test_create_plan_from_templates_container_error(self, mock_tarball):
+    def test_create_plan_from_templates_container_error(
+            self, mock_upload_archive):
         error = mock.Mock(output='{"result": "Error"}')
         self.workflow.action_executions.create.return_value = error
 
@@ -81,9 +86,10 @@ class TestPlanCreationWorkflows(utils.TestCommand):
 
         self.workflow.executions.create.assert_not_called()
 
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
-    def test_create_plan_from_templates_roles_data(self, mock_tarball):
+    def test_create_plan_from_templates_roles_data(
+            self, mock_upload_archive):
         output = mock.Mock(output='{"result": ""}')
         self.workflow.action_executions.create.return_value = output
         self.websocket.wait_for_messages.return_value = self.message_success
@@ -107,14 +113,15 @@ class TestPlanCreationWorkflows(utils.TestCommand):
                             'generate_passwords': True})
 
         mock_open_context.assert_has_calls(
-            [mock.call('the_roles_file.yaml')])
+            [mock.call('the_roles_file.yaml', 'rb')])
 
         self.tripleoclient.object_store.put_object.assert_called_once_with(
             'test-overcloud', 'roles_data.yaml', mock_open_context())
 
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
-    def test_create_plan_from_templates_plan_env_data(self, mock_tarball):
+    def test_create_plan_from_templates_plan_env_data(
+            self, mock_upload_archive):
         output = mock.Mock(output='{"result": ""}')
         self.workflow.action_executions.create.return_value = output
         self.websocket.wait_for_messages.return_value = self.message_success
@@ -138,14 +145,15 @@ class TestPlanCreationWorkflows(utils.TestCommand):
                             'generate_passwords': True})
 
         mock_open_context.assert_has_calls(
-            [mock.call('the-plan-environment.yaml')])
+            [mock.call('the-plan-environment.yaml', 'rb')])
 
         self.tripleoclient.object_store.put_object.assert_called_once_with(
             'test-overcloud', 'plan-environment.yaml', mock_open_context())
 
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
-    def test_create_plan_from_templates_networks_data(self, mock_tarball):
+    def test_create_plan_from_templates_networks_data(
+            self, mock_upload_archive):
         output = mock.Mock(output='{"result": ""}')
         self.workflow.action_executions.create.return_value = output
         self.websocket.wait_for_messages.return_value = self.message_success
@@ -169,7 +177,7 @@ class TestPlanCreationWorkflows(utils.TestCommand):
                             'generate_passwords': True})
 
         mock_open_context.assert_has_calls(
-            [mock.call('the-network-data.yaml')])
+            [mock.call('the-network-data.yaml', 'rb')])
 
         self.tripleoclient.object_store.put_object.assert_called_once_with(
             'test-overcloud', 'network_data.yaml', mock_open_context())
@@ -187,9 +195,10 @@ class TestPlanCreationWorkflows(utils.TestCommand):
             'tripleo.plan_management.v1.delete_deployment_plan',
             workflow_input={'container': 'test-overcloud'})
 
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
+    @mock.patch('tripleoclient.object_transfer.upload_archive',
                 autospec=True)
-    def test_create_plan_with_password_gen_disabled(self, mock_tarball):
+    def test_create_plan_with_password_gen_disabled(
+            self, mock_upload_archive):
         output = mock.Mock(output='{"result": ""}')
         self.workflow.action_executions.create.return_value = output
         self.websocket.wait_for_messages.return_value = self.message_success
@@ -256,22 +265,29 @@ class TestPlanUpdateWorkflows(base.TestCommand):
             return {}, '{0}: mock content\n'.format(args[1])
         self.object_store.get_object.side_effect = get_object
 
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
-                autospec=True)
-    @mock.patch('tripleo_common.utils.swift.empty_container',
-                autospec=True)
-    def test_update_plan_from_templates_keep_env(
-            self, mock_empty_container, mock_tarball):
+    def _create_templates(self, files):
+        tht_root = self.useFixture(fixtures.TempDir()).path
+        for name, content in files.items():
+            path = os.path.join(tht_root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(content)
+        return tht_root
+
+    def test_update_plan_from_templates_keep_env(self):
+        tht_root = self._create_templates({
+            'plan-environment.yaml': 'plan-environment.yaml: new\n',
+            'roles_data.yaml': 'roles_data.yaml: new\n',
+            'overcloud.yaml': 'overcloud.yaml: new\n',
+        })
 
         plan_management.update_plan_from_templates(
             self.app.client_manager,
             'test-overcloud',
-            '/tht-root/',
+            tht_root,
             keep_env=True)
 
-        mock_empty_container.assert_called_once_with(
-            self.object_store, 'test-overcloud')
-
         # make sure we're pushing the saved files back to plan
         self.object_store.put_object.assert_has_calls(
             [
@@ -288,29 +304,28 @@ class TestPlanUpdateWorkflows(base.TestCommand):
                           'user-files/somecustomfile.yaml: mock content\n'),
                 mock.call('test-overcloud', 'user-files/othercustomfile.yaml',
                           'user-files/othercustomfile.yaml: mock content\n'),
+                mock.call('test-overcloud', 'overcloud.yaml', mock.ANY),
             ],
             any_order=True,
         )
+        self.assertEqual(7, self.object_store.put_object.call_count)
+        self.object_store.delete_object.assert_called_once_with(
+            'test-overcloud', 'this-should-not-be-persisted.yaml')
 
         self.workflow.executions.create.assert_called_once_with(
             'tripleo.plan_management.v1.update_deployment_plan',
             workflow_input={'container': 'test-overcloud',
                             'generate_passwords': True, 'source_url': None})
 
-    @mock.patch('tripleoclient.workflows.plan_management.tarball',
-                autospec=True)
-    @mock.patch('tripleo_common.utils.swift.empty_container',
-                autospec=True)
-    def test_update_plan_from_templates_recreate_env(
-            self, mock_empty_container, mock_tarball):
+    def test_update_plan_from_templates_recreate_env(self):
+        tht_root = self._create_templates({
+            'plan-environment.yaml': 'plan-environment.yaml: new\n',
+        })
 
         plan_management.update_plan_from_templates(
             self.app.client_manager,
             'test-overcloud',
-            '/tht-root/')
-
-        mock_empty_container.assert_called_once_with(
-            self.object_store, 'test-overcloud')
+            tht_root)
 
         # make sure passwords got persisted
         self.object_store.put_object.assert_called_with(
@@ -324,6 +339,95 @@ class TestPlanUpdateWorkflows(base.TestCommand):
             workflow_input={'container': 'test-overcloud',
                             'generate_passwords': True, 'source_url': None})
 
+    def test_update_plan_from_templates_unchanged_files(self):
+        tht_root = self._create_templates({
+            'overcloud.yaml': 'overcloud.yaml: unchanged\n',
+            'puppet/role.yaml': 'role.yaml: changed\n',
+            'puppet/new.yaml': 'new.yaml: new\n',
+            'tools/script.pyc': 'ignored',
+            '.git/HEAD': 'ignored',
+        })
+        self.object_store.get_container.return_value = (
+            {},
+            [
+                {'name': 'overcloud.yaml',
+                 'hash': hashlib.md5(
+                     b'overcloud.yaml: unchanged\n').hexdigest()},
+                {'name': 'puppet/role.yaml', 'hash': 'outdated'},
+                {'name': 'puppet/removed.yaml', 'hash': 'removed'},
+            ]
+        )
+
+        plan_management._sync_templates(
+            self.object_store, 'test-overcloud', tht_root)
+
+        self.assertEqual(
+            ['puppet/new.yaml', 'puppet/role.yaml'],
+            sorted(c[0][1] for c in
+                   self.object_store.put_object.call_args_list))
+        self.object_store.delete_object.assert_called_once_with(
+            'test-overcloud', 'puppet/removed.yaml')
+        self.object_store.get_container.assert_called_once_with(
+            'test-overcloud', full_listing=True)
+
+    def test_sync_templates_overrides(self):
+        tht_root = self._create_templates({
+            'roles_data.yaml': 'roles: default\n',
+        })
+        roles_file = os.path.join(
+            self._create_templates({'my_roles.yaml': 'roles: custom\n'}),
+            'my_roles.yaml')
+        self.object_store.get_container.return_value = (
+            {},
+            [{'name': 'roles_data.yaml',
+              'hash': hashlib.md5(b'roles: default\n').hexdigest()}]
+        )
+
+        plan_management._sync_templates(
+            self.object_store, 'test-overcloud', tht_root,
+            roles_file=roles_file)
+
+        self.object_store.put_object.assert_called_once_with(
+            'test-overcloud', 'roles_data.yaml', mock.ANY)
+        self.object_store.delete_object.assert_not_called()
+
+
+class TestPlanObjectRequest(base.TestCase):
+
+    def setUp(self):
+        super(TestPlanObjectRequest, self).setUp()
+        self.swift_client = mock.MagicMock()
+        self.swift_client.get_object.return_value = ({}, b'from swift')
+        self.tht_root = self.useFixture(fixtures.TempDir()).path
+        for name in ('overcloud.yaml', 'changed.yaml'):
+            with open(os.path.join(self.tht_root, name), 'w') as f:
+                f.write('local %s' % name)
+        self.swift_client.get_container.return_value = ({}, [
+            {'name': 'overcloud.yaml',
+             'hash': hashlib.md5(b'local overcloud.yaml').hexdigest()},
+            {'name': 'changed.yaml', 'hash': 'changed'},
+            {'name': 'rendered.yaml', 'hash': 'rendered'},
+        ])
+
+    def test_object_request(self):
+        object_request = plan_management.plan_object_request(
+            self.swift_client, 'overcloud', self.tht_root)
+        self.swift_client.get_container.assert_not_called()
+
+        self.assertEqual(b'local overcloud.yaml',
+                         object_request('GET', 'overcloud.yaml'))
+        self.assertEqual(b'from swift',
+                         object_request('GET', 'changed.yaml'))
+        self.assertEqual(b'from swift',
+                         object_request('GET', 'rendered.yaml'))
+
+        self.swift_client.get_container.assert_called_once_with(
+            'overcloud', full_listing=True)
+        self.swift_client.get_object.assert_has_calls([
+            mock.call('overcloud', 'changed.yaml'),
+            mock.call('overcloud', 'rendered.yaml')])
+        self.assertEqual(2, self.swift_client.get_object.call_count)
+
 
 class TestUpdatePasswords(base.TestCase):
 
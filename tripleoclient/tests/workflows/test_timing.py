@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+
+import fixtures
+import mock
+
+from tripleoclient import exceptions
+from tripleoclient.tests import base
+from tripleoclient.workflows import base as workflows_base
+from tripleoclient.workflows import timing
+
+
+class TestTiming(base.TestCase):
+
+    def setUp(self):
+        super(TestTiming, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'timings.json')
+        self.useFixture(fixtures.EnvironmentVariable(
+            'TRIPLEO_WORKFLOW_TIMINGS', self.path))
+        self.addCleanup(timing.log_summary)
+        timing.log_summary()
+
+    def _read(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_workflow(self):
+        mistral = mock.Mock()
+        mistral.executions.create.return_value.id = 'ID'
+        mistral.executions.get.return_value.state = 'RUNNING'
+        websocket = mock.Mock()
+        websocket.wait_for_messages.return_value = iter([
+            {'status': 'RUNNING', 'execution': {'id': 'ID'}},
+            {'status': 'RUNNING', 'execution': {'id': 'SUB'}},
+            {'status': 'SUCCESS', 'execution': {'id': 'ID'}},
+        ])
+
+        execution = workflows_base.start_workflow(mistral, 'test-workflow',
+                                                  {})
+        messages = list(workflows_base.wait_for_messages(mistral, websocket,
+                                                         execution))
+
+        self.assertEqual(3, len(messages))
+        create, wait = self._read()
+        self.assertEqual('execution_create', create['event'])
+        self.assertEqual('test-workflow', create['name'])
+        self.assertEqual('ID', create['execution_id'])
+        self.assertEqual('wait', wait['event'])
+        self.assertEqual('test-workflow', wait['name'])
+        self.assertEqual(3, wait['messages'])
+        self.assertEqual('SUCCESS', wait['state'])
+        self.assertIn('first_message', wait)
+        self.assertIn('mean_gap', wait)
+        self.assertEqual(['execution_create test-workflow: 1 in 0.0s',
+                          'wait test-workflow: 1 in 0.0s'], timing.summary())
+
+    def test_wait_closed_early(self):
+        websocket = mock.Mock()
+        websocket.wait_for_messages.return_value = iter([
+            {'status': 'SUCCESS', 'execution': {'id': 'ID'}},
+        ])
+        execution = mock.Mock(id='ID')
+
+        for payload in workflows_base.wait_for_messages(mock.Mock(),
+                                                        websocket, execution):
+            break
+
+        wait, = self._read()
+        self.assertEqual('SUCCESS', wait['state'])
+        self.assertEqual(1, wait['messages'])
+
+    def test_wait_timeout(self):
+        websocket = mock.Mock()
+        websocket.wait_for_messages.side_effect = exceptions.WebSocketTimeout
+        execution = mock.Mock(id='ID')
+
+        messages = workflows_base.wait_for_messages(mock.Mock(), websocket,
+                                                    execution)
+
+        self.assertRaises(exceptions.WebSocketTimeout, list, messages)
+        wait, = self._read()
+        self.assertEqual('TIMEOUT', wait['state'])
+        self.assertEqual(0, wait['messages'])
+        self.assertNotIn('first_message', wait)
+
+    def test_action(self):
+        mistral = mock.Mock()
+        mistral.action_executions.create.return_value.output = (
+            '{"result": "a"}')
+        mistral.action_executions.create.return_value.state = 'SUCCESS'
+
+        workflows_base.call_action(mistral, 'test-action')
+
+        action, = self._read()
+        self.assertEqual('action', action['event'])
+        self.assertEqual('test-action', action['name'])
+        self.assertEqual('SUCCESS', action['state'])
+
+    def test_log_summary(self):
+        timing.record('queue_setup', 'tripleo', 0.25)
+        timing.record('queue_setup', 'tripleo', 0.5)
+
+        with mock.patch('tripleoclient.workflows.timing.LOG') as mock_log:
+            timing.log_summary()
+            timing.log_summary()
+
+        mock_log.info.assert_called_once_with(
+            "Time spent on workflows:\n  queue_setup tripleo: 2 in 0.8s")
+        self.assertEqual([], timing.summary())
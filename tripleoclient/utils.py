@@ -14,8 +14,14 @@
 #
 
 from __future__ import print_function
+from concurrent import futures
+import binascii
+import collections
+import contextlib
+import copy
 import csv
 import datetime
+import errno
 import getpass
 import glob
 import hashlib
@@ -27,6 +33,7 @@ import os.path
 import simplejson
 import six
 import socket
+import stat
 import subprocess
 import sys
 import tempfile
@@ -34,11 +41,13 @@ import time
 import yaml
 
 from heatclient.common import event_utils
+from heatclient.common import format_utils
 from heatclient.common import template_utils
 from heatclient.common import utils as heat_utils
 from heatclient.exc import HTTPNotFound
 from osc_lib.i18n import _
 from oslo_concurrency import processutils
+from oslo_utils import timeutils
 from six.moves import configparser
 
 from heatclient import exc as hc_exc
@@ -46,7 +55,9 @@ from six.moves.urllib import error as url_error
 from six.moves.urllib import request
 
 
+from tripleoclient import constants
 from tripleoclient import exceptions
+from tripleoclient import yaml_cache
 
 
 def bracket_ipv6(address):
@@ -167,7 +178,7 @@ def create_tempest_deployer_input(config_name='tempest-deployer-input.conf'):
 
 
 def wait_for_stack_ready(orchestration_client, stack_name, marker=None,
-                         action='CREATE', verbose=False):
+                         action='CREATE', verbose=False, timeout=None):
     """Check the status of an orchestration stack
 
     Get the status of an orchestration stack and check whether it is complete
@@ -187,23 +198,236 @@ def wait_for_stack_ready(orchestration_client, stack_name, marker=None,
 
     :param verbose: Whether to print events
     :type verbose: boolean
+
+    :param timeout: Seconds after which the stack is no longer waited for,
+                    None to wait until the action ends
+    :type timeout: integer
     """
     stack = get_stack(orchestration_client, stack_name)
     if not stack:
         return False
-    stack_name = "%s/%s" % (stack.stack_name, stack.id)
 
     if verbose:
         out = sys.stdout
     else:
         out = open(os.devnull, "w")
-    stack_status, msg = event_utils.poll_for_events(
-        orchestration_client, stack_name, action=action,
-        poll_period=5, marker=marker, out=out, nested_depth=2)
+    stack_status, msg = poll_for_stack_events(
+        orchestration_client, stack, action, marker=marker, out=out,
+        timeout=timeout)
     print(msg)
     return stack_status == '%s_COMPLETE' % action
 
 
+def _is_stack_event(event, stack):
+    """Whether event is about the stack itself rather than a resource"""
+    return (getattr(event, 'resource_name', None) == stack.stack_name and
+            getattr(event, 'physical_resource_id', None) == stack.id)
+
+
+def _stack_updated_time(stack):
+    """Return when the current action on stack started, in naive UTC"""
+    value = (getattr(stack, 'updated_time', None) or
+             getattr(stack, 'creation_time', None))
+    try:
+        return timeutils.normalize_time(timeutils.parse_isotime(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def poll_for_stack_events(orchestration_client, stack, action, marker=None,
+                          out=None, nested_depth=2,
+                          interval=constants.STACK_EVENTS_INITIAL_INTERVAL,
+                          max_interval=constants.STACK_EVENTS_MAX_INTERVAL,
+                          page_size=constants.STACK_EVENTS_PAGE_SIZE,
+                          timeout=None):
+    """Write the events of a stack to out until action on it has ended
+
+    The events after marker are fetched in pages of page_size, and the wait
+    between two fetches doubles from interval up to max_interval while no
+    event arrives. After a fetch without events, the stack is looked up
+    without resolving its outputs, but its status is only trusted once the
+    action was seen in progress: an update is started asynchronously, so
+    the stack may still have the status of the previous one. An action
+    short enough to never be seen in progress is trusted to have ended after
+    STACK_EVENTS_STALE_POLLS lookups, when the stack was updated since the
+    wait started.
+
+    Returns the final status of the stack and a message about it. The status
+    is None when the action hasn't ended after timeout seconds, if a timeout
+    is given.
+    """
+    stack_id = "%s/%s" % (stack.stack_name, stack.id)
+    stop_status = ('%s_FAILED' % action, '%s_COMPLETE' % action)
+    # Without a marker, all the events are of the current action
+    started = marker is None
+    ended = None
+    wait = interval
+    if out is None:
+        out = sys.stdout
+    event_log_context = heat_utils.EventLogContext()
+    deadline = None if timeout is None else time.time() + timeout
+    wait_start = timeutils.utcnow()
+    previous_update = _stack_updated_time(stack)
+    stale_polls = 0
+
+    while True:
+        if (ended is None and deadline is not None and
+                time.time() >= deadline):
+            return None, ("\n Stack %s timed out waiting for %s \n"
+                          % (stack_id, action))
+        events = event_utils.get_events(
+            orchestration_client, stack_id=stack_id,
+            nested_depth=nested_depth,
+            event_args={'sort_dir': 'asc', 'marker': marker,
+                        'limit': page_size})
+        if events:
+            marker = events[-1].id
+            out.write(heat_utils.event_log_formatter(events,
+                                                     event_log_context))
+            out.write('\n')
+            for event in events:
+                if _is_stack_event(event, stack):
+                    started = True
+                    if event.resource_status in stop_status:
+                        ended = event.resource_status
+            if ended is not None and len(events) < page_size:
+                break
+            if len(events) >= page_size:
+                # Fetch the next page right away
+                continue
+            wait = interval
+            time.sleep(wait)
+        elif ended is not None:
+            break
+        else:
+            current = orchestration_client.stacks.get(
+                stack_id, resolve_outputs=False)
+            status = current.stack_status
+            if status == '%s_IN_PROGRESS' % action:
+                started = True
+            elif status in stop_status and not started:
+                stale_polls += 1
+                updated = _stack_updated_time(current)
+                if (stale_polls >= constants.STACK_EVENTS_STALE_POLLS and
+                        updated is not None and
+                        (updated > wait_start or
+                         (previous_update is not None and
+                          updated > previous_update))):
+                    started = True
+            if started and status in stop_status:
+                # Fetch the last events before returning
+                ended = status
+                continue
+            if deadline is None:
+                time.sleep(wait)
+            else:
+                time.sleep(min(wait, max(0, deadline - time.time())))
+            wait = min(wait * 2, max_interval)
+
+    return ended, "\n Stack %s %s \n" % (stack_id, ended)
+
+
+def _list_resources(orchestration_client, stack_id):
+    try:
+        return orchestration_client.resources.list(stack_id)
+    except HTTPNotFound:
+        # There is a failed nested stack resource but no stack
+        return []
+
+
+def _append_failed_resources(orchestration_client, executor, failures,
+                             resources, resource_path):
+    """Add the failed resources to failures, recursing into nested stacks
+
+    A failed nested stack resource is only added when it contains no failed
+    resources. The failed nested stacks of a stack are listed concurrently.
+    """
+    failed = [rsc for rsc in resources
+              if rsc.resource_status.endswith('FAILED')]
+    nested = {}
+    for rsc in failed:
+        if 'nested' in [link['rel'] for link in rsc.links]:
+            nested[rsc.resource_name] = executor.submit(
+                _list_resources, orchestration_client,
+                rsc.physical_resource_id)
+    for rsc in failed:
+        path = resource_path + [rsc.resource_name]
+        nested_appended = False
+        if rsc.resource_name in nested:
+            nested_appended = _append_failed_resources(
+                orchestration_client, executor, failures,
+                nested[rsc.resource_name].result(), path)
+        if not nested_appended:
+            failures['.'.join(path)] = rsc
+    return bool(failed)
+
+
+def _get_software_deployment(orchestration_client, resource):
+    if resource.resource_type not in ('OS::Heat::StructuredDeployment',
+                                      'OS::Heat::SoftwareDeployment'):
+        return None
+    try:
+        return orchestration_client.software_deployments.get(
+            deployment_id=resource.physical_resource_id)
+    except HTTPNotFound:
+        return None
+
+
+def _truncate(txt, full_output):
+    return format_utils.indent_and_truncate(
+        txt, spaces=4, truncate=not full_output, truncate_prefix='...',
+        truncate_postfix='(truncated)')
+
+
+def print_stack_failures(orchestration_client, stack_name,
+                         full_output=False, out=None,
+                         concurrency=constants.STACK_FAILURES_CONCURRENCY,
+                         limit=constants.STACK_FAILURES_LIMIT):
+    """Print the failed resources of a stack
+
+    This is what "openstack stack failures list" prints, using the given
+    client rather than a new OpenStack shell. The nested stacks and the
+    software deployments are fetched concurrently, only the first limit
+    failed resources are shown and, unless full_output is True, their status
+    reason and deployment outputs are truncated to their last lines.
+    """
+    if out is None:
+        out = sys.stdout
+    stack = get_stack(orchestration_client, stack_name)
+    if stack is None or stack.status != 'FAILED':
+        return
+
+    failures = collections.OrderedDict()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        _append_failed_resources(
+            orchestration_client, executor, failures,
+            orchestration_client.resources.list(stack.id),
+            [stack.stack_name])
+        shown = list(failures.items())[:limit]
+        deployments = list(executor.map(
+            lambda item: _get_software_deployment(orchestration_client,
+                                                  item[1]),
+            shown))
+
+    for (path, rsc), deployment in zip(shown, deployments):
+        out.write('%s:\n' % path)
+        out.write('  resource_type: %s\n' % rsc.resource_type)
+        out.write('  physical_resource_id: %s\n' % rsc.physical_resource_id)
+        out.write('  status: %s\n' % rsc.resource_status)
+        out.write('  status_reason: |\n%s\n' % _truncate(
+            rsc.resource_status_reason, full_output))
+        if deployment is not None:
+            output_values = deployment.output_values or {}
+            for name in ('deploy_stdout', 'deploy_stderr'):
+                out.write('  %s: |\n%s\n' % (
+                    name, _truncate(output_values.get(name), full_output)))
+            out.write('  deploy_status_code: %s\n' %
+                      output_values.get('deploy_status_code'))
+    if len(failures) > len(shown):
+        out.write('%d more failed resources, see "openstack stack failures '
+                  'list %s"\n' % (len(failures) - len(shown), stack_name))
+
+
 def nodes_in_states(baremetal_client, states):
     """List the introspectable nodes with the right provision_states."""
     nodes = baremetal_client.node.list(maintenance=False, associated=False)
@@ -332,62 +556,86 @@ def set_nodes_state(baremetal_client, nodes, transition, target_state,
         yield node.uuid
 
 
+class StackOutputs(object):
+    """The outputs of a stack, indexed by their key
+
+    The outputs of an overcloud stack can be several megabytes, so rather
+    than copying them with stack.to_dict() and scanning them for every
+    lookup, they are indexed once and the index is kept on the stack object,
+    until its outputs are fetched again. Use StackOutputs.get(stack) to get
+    that index. The values are returned as copies, so callers are free to
+    modify them.
+    """
+
+    def __init__(self, outputs):
+        self._values = dict((output['output_key'], output.get('output_value'))
+                            for output in outputs)
+
+    @classmethod
+    def get(cls, stack):
+        """Return the outputs of stack"""
+        info = vars(stack).get('_info')
+        if not isinstance(info, dict):
+            # heatclient's to_dict() is a deep copy of _info, nothing to
+            # keep the index on
+            return cls(stack.to_dict().get('outputs') or [])
+        outputs = info.get('outputs')
+        if outputs is None:
+            # Fetched without its outputs, don't remember that
+            return cls([])
+        cached = vars(stack).get('_tripleo_outputs')
+        if cached is not None and cached[0] is outputs:
+            return cached[1]
+        stack_outputs = cls(outputs)
+        # A refreshed stack has a new list of outputs, which invalidates this
+        stack._tripleo_outputs = (outputs, stack_outputs)
+        return stack_outputs
+
+    def __getitem__(self, key):
+        return copy.deepcopy(self._values[key])
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def value(self, key, default=None):
+        if key not in self._values:
+            return default
+        return copy.deepcopy(self._values[key])
+
+    def as_dict(self):
+        return copy.deepcopy(self._values)
+
+
 def get_overcloud_endpoint(stack):
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'KeystoneURL':
-            return output['output_value']
+    return StackOutputs.get(stack).value('KeystoneURL')
 
 
 def get_service_ips(stack):
-    service_ips = {}
-    for output in stack.to_dict().get('outputs', {}):
-        service_ips[output['output_key']] = output['output_value']
-    return service_ips
+    return StackOutputs.get(stack).as_dict()
 
 
 def get_endpoint_map(stack):
-    endpoint_map = {}
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'EndpointMap':
-            endpoint_map = output['output_value']
-            break
-    return endpoint_map
+    return StackOutputs.get(stack).value('EndpointMap', {})
 
 
 def get_role_data(stack):
-    role_data = {}
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'RoleData':
-            for role in output['output_value']:
-                role_data[role] = output['output_value'][role]
-    return role_data
+    return StackOutputs.get(stack).value('RoleData', {})
 
 
 def get_role_config(stack):
-    role_data = {}
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'RoleConfig':
-            for role in output['output_value']:
-                role_data[role] = output['output_value'][role]
-    return role_data
+    return StackOutputs.get(stack).value('RoleConfig', {})
 
 
 def get_role_net_hostname_map(stack):
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'RoleNetHostnameMap':
-            return output['output_value']
+    return StackOutputs.get(stack).value('RoleNetHostnameMap')
 
 
 def get_role_net_ip_map(stack):
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'RoleNetIpMap':
-            return output['output_value']
+    return StackOutputs.get(stack).value('RoleNetIpMap')
 
 
 def get_hosts_entry(stack):
-    for output in stack.to_dict().get('outputs', {}):
-        if output['output_key'] == 'HostsEntry':
-            return output['output_value']
+    return StackOutputs.get(stack).value('HostsEntry')
 
 
 def get_endpoint(key, stack):
@@ -824,6 +1072,108 @@ def relative_link_replacement(link_replacement, current_dir):
             for k, v in six.iteritems(link_replacement)}
 
 
+def template_links(template_part):
+    """Return the get_file and type links in a Heat template
+
+    This finds the same links as replace_links_in_template replaces.
+    """
+    links = set()
+    if isinstance(template_part, dict):
+        for key, value in six.iteritems(template_part):
+            if ((key == 'get_file' or key == 'type') and
+                    isinstance(value, six.string_types)):
+                links.add(value)
+            else:
+                links.update(template_links(value))
+    elif isinstance(template_part, list):
+        for value in template_part:
+            links.update(template_links(value))
+    return links
+
+
+def _registry_links(registry_part):
+    if isinstance(registry_part, dict):
+        registry_part = list(registry_part.values())
+    if isinstance(registry_part, list):
+        return set().union(*[_registry_links(v) for v in registry_part])
+    if isinstance(registry_part, six.string_types):
+        return set([registry_part])
+    return set()
+
+
+def _file_digest(contents):
+    if isinstance(contents, six.text_type):
+        contents = contents.encode('utf-8')
+    return hashlib.sha1(contents).hexdigest()
+
+
+def file_link_graph(files):
+    """Return the links between the files passed to Heat
+
+    :param files: dict mapping file names to contents, as built by
+                  heatclient's template_utils
+    :type files: dict
+
+    :return dict mapping each file name to the sorted list of the other
+            files it links to
+
+    The graph only depends on the names and contents of the files, so it is
+    cached by a digest of both.
+    """
+    tree = sorted((name, _file_digest(contents))
+                  for name, contents in six.iteritems(files))
+    tree_hash = hashlib.sha1(repr(tree).encode('utf-8')).hexdigest()
+
+    def build():
+        graph = {}
+        for name, contents in six.iteritems(files):
+            try:
+                template = yaml_cache.safe_load(contents)
+            except yaml.YAMLError:
+                template = None
+            graph[name] = sorted(template_links(template) & set(files))
+        return graph
+
+    return yaml_cache.get_cache().get_or_parse(('file-graph', tree_hash),
+                                               build)
+
+
+def prune_unreachable_files(files, template, env):
+    """Drop the files which can't be used by a stack
+
+    Heat only reads the files linked from the template, from the resource
+    registry of the environment, or from other such files. As the registry
+    is the result of merging all the environment files, files mapped by a
+    registry entry which a later environment overrode are not used anymore.
+
+    :param files: dict mapping file names to contents
+    :type files: dict
+
+    :param template: the parsed top level template
+    :type template: dict
+
+    :param env: the merged environment
+    :type env: dict
+
+    :return dict of the reachable files
+    """
+    log = logging.getLogger(__name__ + ".prune_unreachable_files")
+    graph = file_link_graph(files)
+    pending = ((template_links(template) |
+                _registry_links(env.get('resource_registry', {}))) &
+               set(files))
+    reachable = set()
+    while pending:
+        name = pending.pop()
+        reachable.add(name)
+        pending.update(set(graph[name]) - reachable)
+    if len(reachable) < len(files):
+        log.debug("Not sending %d unreachable files: %s" % (
+            len(files) - len(reachable),
+            ", ".join(sorted(set(files) - reachable))))
+    return dict((name, files[name]) for name in reachable)
+
+
 def load_environment_directories(directories):
     log = logging.getLogger(__name__ + ".load_environment_directories")
 
@@ -864,78 +1214,112 @@ def get_tripleo_ansible_inventory(inventory_file='',
             "Inventory file %s can not be found.") % inventory_file)
 
 
+def _rewrite_registry_path(env_dirname, rsrc_path, tht_root, user_tht_root,
+                           path_cache):
+    key = (env_dirname, rsrc_path)
+    if key in path_cache:
+        return path_cache[key]
+    # We need to calculate the absolute path relative to
+    # env_path not cwd (which is what abspath uses).
+    abs_rsrc_path = os.path.normpath(
+        os.path.join(env_dirname, rsrc_path))
+    # If the absolute path matches user_tht_root, rewrite
+    # it to point at tht_root instead
+    if (abs_rsrc_path.startswith(user_tht_root) and
+        ((user_tht_root + '/') in abs_rsrc_path or
+         abs_rsrc_path == user_tht_root)):
+        new_rsrc_path = abs_rsrc_path.replace(
+            user_tht_root + '/', tht_root + '/')
+    elif rsrc_path.startswith("OS::"):
+        # Skip any resources that are mapping to OS::*
+        # resource names as these aren't paths
+        new_rsrc_path = rsrc_path
+    else:
+        new_rsrc_path = abs_rsrc_path
+    path_cache[key] = new_rsrc_path
+    return new_rsrc_path
+
+
+def _process_environment(env_path, tht_root, user_tht_root, cleanup, log,
+                         path_cache):
+    log.debug("Processing environment files %s" % env_path)
+    abs_env_path = os.path.abspath(env_path)
+    if (abs_env_path.startswith(user_tht_root) and
+        ((user_tht_root + '/') in env_path or
+         (user_tht_root + '/') in abs_env_path or
+         user_tht_root == abs_env_path or
+         user_tht_root == env_path)):
+        new_env_path = env_path.replace(user_tht_root + '/',
+                                        tht_root + '/')
+        log.debug("Redirecting env file %s to %s"
+                  % (abs_env_path, new_env_path))
+        env_path = new_env_path
+    try:
+        files, env = template_utils.process_environment_and_files(
+            env_path=env_path)
+    except hc_exc.CommandError as ex:
+        # This provides fallback logic so that we can reference files
+        # inside the resource_registry values that may be rendered via
+        # j2.yaml templates, where the above will fail because the
+        # file doesn't exist in user_tht_root, but it is in tht_root
+        # See bug https://bugs.launchpad.net/tripleo/+bug/1625783
+        # for details on why this is needed (backwards-compatibility)
+        log.debug("Error %s processing environment file %s"
+                  % (six.text_type(ex), env_path))
+        # Use the temporary path as it's possible the environment
+        # itself was rendered via jinja.
+        env = yaml_cache.load_environment(env_path)
+        env_registry = env.get('resource_registry', {})
+        env_dirname = os.path.dirname(os.path.abspath(env_path))
+        for rsrc, rsrc_path in six.iteritems(env_registry):
+            new_rsrc_path = _rewrite_registry_path(
+                env_dirname, rsrc_path, tht_root, user_tht_root, path_cache)
+            if new_rsrc_path != rsrc_path:
+                log.debug("Rewriting %s %s path to %s"
+                          % (env_path, rsrc, new_rsrc_path))
+            env_registry[rsrc] = new_rsrc_path
+        env['resource_registry'] = env_registry
+        if not cleanup:
+            # Keep a copy of the rewritten environment for debugging
+            f_name = os.path.basename(os.path.splitext(abs_env_path)[0])
+            with tempfile.NamedTemporaryFile(dir=tht_root,
+                                             prefix="env-%s-" % f_name,
+                                             suffix=".yaml",
+                                             mode="w",
+                                             delete=False) as f:
+                log.debug("Rewriting %s environment to %s"
+                          % (env_path, f.name))
+                f.write(yaml.safe_dump(env, default_flow_style=False))
+        # The registry paths are all absolute now, so the environment can
+        # be resolved in place rather than written out and parsed again
+        files = {}
+        template_utils.resolve_environment_urls(
+            env_registry, files, heat_utils.base_url_for_url(
+                heat_utils.normalise_file_path_to_url(env_path)))
+    return env_path, files, env
+
+
 def process_multiple_environments(created_env_files, tht_root,
                                   user_tht_root, cleanup=True):
+    """Process environment files and the files they reference
+
+    The environments are merged in the order they were given so later
+    environments override earlier ones.
+
+    :return tuple of the files dict and the merged environment
+    """
     log = logging.getLogger(__name__ + ".process_multiple_environments")
     env_files = {}
     localenv = {}
     # Normalize paths for full match checks
     user_tht_root = os.path.normpath(user_tht_root)
     tht_root = os.path.normpath(tht_root)
+
+    path_cache = {}
+
     for env_path in created_env_files:
-        log.debug("Processing environment files %s" % env_path)
-        abs_env_path = os.path.abspath(env_path)
-        if (abs_env_path.startswith(user_tht_root) and
-            ((user_tht_root + '/') in env_path or
-             (user_tht_root + '/') in abs_env_path or
-             user_tht_root == abs_env_path or
-             user_tht_root == env_path)):
-            new_env_path = env_path.replace(user_tht_root + '/',
-                                            tht_root + '/')
-            log.debug("Redirecting env file %s to %s"
-                      % (abs_env_path, new_env_path))
-            env_path = new_env_path
-        try:
-            files, env = template_utils.process_environment_and_files(
-                env_path=env_path)
-        except hc_exc.CommandError as ex:
-            # This provides fallback logic so that we can reference files
-            # inside the resource_registry values that may be rendered via
-            # j2.yaml templates, where the above will fail because the
-            # file doesn't exist in user_tht_root, but it is in tht_root
-            # See bug https://bugs.launchpad.net/tripleo/+bug/1625783
-            # for details on why this is needed (backwards-compatibility)
-            log.debug("Error %s processing environment file %s"
-                      % (six.text_type(ex), env_path))
-            # Use the temporary path as it's possible the environment
-            # itself was rendered via jinja.
-            with open(env_path, 'r') as f:
-                env_map = yaml.safe_load(f)
-            env_registry = env_map.get('resource_registry', {})
-            env_dirname = os.path.dirname(os.path.abspath(env_path))
-            for rsrc, rsrc_path in six.iteritems(env_registry):
-                # We need to calculate the absolute path relative to
-                # env_path not cwd (which is what abspath uses).
-                abs_rsrc_path = os.path.normpath(
-                    os.path.join(env_dirname, rsrc_path))
-                # If the absolute path matches user_tht_root, rewrite
-                # a temporary environment pointing at tht_root instead
-                if (abs_rsrc_path.startswith(user_tht_root) and
-                    ((user_tht_root + '/') in abs_rsrc_path or
-                     abs_rsrc_path == user_tht_root)):
-                    new_rsrc_path = abs_rsrc_path.replace(
-                        user_tht_root + '/', tht_root + '/')
-                    log.debug("Rewriting %s %s path to %s"
-                              % (env_path, rsrc, new_rsrc_path))
-                    env_registry[rsrc] = new_rsrc_path
-                else:
-                    # Skip any resources that are mapping to OS::*
-                    # resource names as these aren't paths
-                    if not rsrc_path.startswith("OS::"):
-                        env_registry[rsrc] = abs_rsrc_path
-            env_map['resource_registry'] = env_registry
-            f_name = os.path.basename(os.path.splitext(abs_env_path)[0])
-            with tempfile.NamedTemporaryFile(dir=tht_root,
-                                             prefix="env-%s-" % f_name,
-                                             suffix=".yaml",
-                                             mode="w",
-                                             delete=cleanup) as f:
-                log.debug("Rewriting %s environment to %s"
-                          % (env_path, f.name))
-                f.write(yaml.safe_dump(env_map, default_flow_style=False))
-                f.flush()
-                files, env = template_utils.process_environment_and_files(
-                    env_path=f.name)
+        env_path, files, env = _process_environment(
+            env_path, tht_root, user_tht_root, cleanup, log, path_cache)
         if files:
             log.debug("Adding files %s for %s" % (files, env_path))
             env_files.update(files)
@@ -1000,7 +1384,72 @@ def get_short_hostname():
     return p.communicate()[0].rstrip()
 
 
-def wait_api_port_ready(api_port, host='127.0.0.1'):
+def _check_process(pid):
+    if pid is None:
+        return
+    exited, status = os.waitpid(pid, os.WNOHANG)
+    if exited:
+        raise exceptions.ProcessExited(
+            "Process %s exited with status %s" % (pid, status))
+
+
+def _port_open(host, port):
+    try:
+        socket.create_connection((host, port), timeout=1).close()
+    except socket.error:
+        return False
+    return True
+
+
+def wait_for_port(port, host='127.0.0.1', timeout=constants.PORT_READY_TIMEOUT,
+                  probe=None, pid=None,
+                  interval=constants.PORT_READY_INITIAL_INTERVAL,
+                  max_interval=constants.PORT_READY_MAX_INTERVAL):
+    """Wait until a service accepts connections on a port
+
+    The port is tried right away, then with a wait doubling from interval
+    up to max_interval. Once a connection is accepted, the service is ready
+    unless probe, a callable, returns False. When pid is given, it is the
+    child process expected to serve the port, and ProcessExited is raised
+    as soon as it has exited.
+
+    :param port: service port
+    :type port: integer
+
+    :param host: host running the service (default: 127.0.0.1)
+    :type host: string
+
+    :param timeout: seconds to wait for the service
+    :type timeout: float
+
+    :return boolean
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    wait = interval
+    while True:
+        _check_process(pid)
+        if _port_open(host, port) and (probe is None or probe()):
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(wait, remaining))
+        wait = min(wait * 2, max_interval)
+
+
+def _http_ready(url):
+    try:
+        request.urlopen(url, timeout=1)
+    except url_error.HTTPError as he:
+        # The version discovery of the APIs answers with 300
+        return he.code < 500
+    except (url_error.URLError, socket.error):
+        return False
+    return True
+
+
+def wait_api_port_ready(api_port, host='127.0.0.1',
+                        timeout=constants.PORT_READY_TIMEOUT, pid=None):
     """Wait until an http services becomes available
 
     :param api_port: api service port
@@ -1009,21 +1458,18 @@ def wait_api_port_ready(api_port, host='127.0.0.1'):
     :param host: host running the service (default: 127.0.0.1)
     :type host: string
 
+    :param timeout: seconds to wait for the service
+    :type timeout: float
+
+    :param pid: child process serving the api, ProcessExited is raised
+                when it has exited
+    :type pid: integer
+
     :return boolean
     """
-    count = 0
-    while count < 30:
-        time.sleep(1)
-        count += 1
-        try:
-            request.urlopen("http://%s:%s/" % (host, api_port), timeout=1)
-        except url_error.HTTPError as he:
-            if he.code == 300:
-                return True
-            pass
-        except url_error.URLError:
-            pass
-    return False
+    url = "http://%s:%s/" % (host, api_port)
+    return wait_for_port(api_port, host, timeout=timeout,
+                         probe=lambda: _http_ready(url), pid=pid)
 
 
 def bulk_symlink(log, src, dst, tmpd='/tmp'):
@@ -1057,6 +1503,163 @@ def bulk_symlink(log, src, dst, tmpd='/tmp'):
         shutil.rmtree(tmp, ignore_errors=True)
 
 
+def link_templates_tree(src, dst):
+    """Create a working copy of a templates tree using hard links
+
+    Directories are created and symlinks are copied as symlinks, like
+    shutil.copytree(src, dst, symlinks=True) does, but regular files are
+    hard linked to the source instead of being copied. Files are copied
+    instead when they can't be linked, e.g. across filesystems or when
+    fs.protected_hardlinks forbids it.
+
+    Everything is copied when running as root. Root can open any linked
+    file for writing, including one of the packaged templates, and the
+    files tools like process-templates.py write aren't all known.
+
+    A linked file shares its contents with the source, so it must never be
+    modified in place. The files rewritten during a deployment, the plan
+    files and the files j2 rendering may write, are always copied. Other
+    files must be written with replace_file.
+
+    :param src: path to the source templates directory
+    :type src: string
+
+    :param dst: path to the working directory to create, must not exist
+    :type dst: string
+    """
+    log = logging.getLogger(__name__ + ".link_templates_tree")
+    src = os.path.abspath(src)
+    use_links = os.geteuid() != 0
+    if not use_links:
+        log.debug("Running as root, copying the templates of %s into %s" %
+                  (src, dst))
+    linked = copied = 0
+    for dirpath, dirnames, filenames in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target_dir)
+        shutil.copystat(dirpath, target_dir)
+        for name in list(dirnames):
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                # os.walk doesn't follow symlinks, copy them as such
+                os.symlink(os.readlink(path), os.path.join(target_dir, name))
+                dirnames.remove(name)
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            target = os.path.join(target_dir, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+                continue
+            if use_links:
+                try:
+                    os.link(path, target)
+                    linked += 1
+                    continue
+                except OSError as e:
+                    log.warning("Unable to hard link the templates of %s "
+                                "into %s, copying them instead: %s" %
+                                (src, dst, e))
+                    use_links = False
+            shutil.copy2(path, target)
+            copied += 1
+    for name in (constants.PLAN_ENVIRONMENT, constants.OVERCLOUD_ROLES_FILE,
+                 constants.UNDERCLOUD_ROLES_FILE,
+                 constants.OVERCLOUD_NETWORKS_FILE):
+        materialize_file(os.path.join(dst, name))
+    materialize_rendered_templates(dst)
+    log.info("Created templates tree %s from %s, %d files linked and %d "
+             "copied" % (dst, src, linked, copied))
+
+
+@contextlib.contextmanager
+def replace_file(path, mode='w'):
+    """Open a new file which replaces path once it has been written
+
+    The contents are written to a temporary file renamed to path when the
+    block exits without error, so a file hard linked by link_templates_tree
+    is replaced rather than written through, and path is never left half
+    written. The permissions of an existing file are kept.
+
+    :param path: path to the file
+    :type path: string
+
+    :param mode: mode to open the file with, 'w' or 'wb'
+    :type mode: string
+    """
+    tmp = os.path.join(os.path.dirname(path),
+                       '.%s-%s' % (os.path.basename(path),
+                                   binascii.hexlify(os.urandom(6)).decode()))
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        try:
+            os.chmod(tmp, stat.S_IMODE(os.stat(path).st_mode))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        with os.fdopen(fd, mode) as f:
+            fd = None
+            yield f
+        os.rename(tmp, path)
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        os.unlink(tmp)
+        raise
+
+
+def materialize_file(path):
+    """Give a hard linked file its own copy of the contents
+
+    Does nothing if path doesn't exist or has no other links, so it is safe
+    to call before writing any file of a tree created by link_templates_tree.
+
+    :param path: path to the file
+    :type path: string
+    """
+    try:
+        st = os.lstat(path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISREG(st.st_mode) or st.st_nlink < 2:
+        return
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                               prefix='.%s-' % os.path.basename(path))
+    os.close(fd)
+    try:
+        shutil.copy2(path, tmp)
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def materialize_rendered_templates(tht_root):
+    """Materialize the files of a templates tree that j2 rendering may write
+
+    process-templates.py renders foo.j2.yaml to foo.yaml, and the role and
+    network specific foo.role.j2.yaml and foo.network.j2.yaml templates to
+    per role or network files in the same directory. Any such file already
+    present in a tree created by link_templates_tree is materialized so the
+    rendering doesn't overwrite the source templates.
+
+    :param tht_root: path to the templates tree
+    :type tht_root: string
+    """
+    for dirpath, dirnames, filenames in os.walk(tht_root):
+        templates = [f for f in filenames if f.endswith('.j2.yaml')]
+        if not templates:
+            continue
+        per_item = any(f.endswith(('.role.j2.yaml', '.network.j2.yaml'))
+                       for f in templates)
+        for name in filenames:
+            if name.endswith('.j2.yaml') or not name.endswith('.yaml'):
+                continue
+            if per_item or name[:-len('.yaml')] + '.j2.yaml' in templates:
+                materialize_file(os.path.join(dirpath, name))
+
+
 def run_command_and_log(log, cmd, cwd=None):
     """Run command and log output
 
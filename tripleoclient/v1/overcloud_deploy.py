@@ -35,7 +35,9 @@ from tripleo_common import update
 from tripleoclient import command
 from tripleoclient import constants
 from tripleoclient import exceptions
+from tripleoclient import object_transfer
 from tripleoclient import utils
+from tripleoclient.workflows import base as workflow_base
 from tripleoclient.workflows import deployment
 from tripleoclient.workflows import parameters as workflow_params
 from tripleoclient.workflows import plan_management
@@ -169,7 +171,7 @@ class DeployOvercloud(command.Command):
         self.log.debug("user_env_path=%s" % user_env_path)
         if not os.path.exists(user_env_dir):
             os.makedirs(user_env_dir)
-        with open(user_env_path, 'w') as f:
+        with utils.replace_file(user_env_path) as f:
             self.log.debug("Writing user environment %s" % user_env_path)
             f.write(contents)
 
@@ -198,16 +200,15 @@ class DeployOvercloud(command.Command):
         plan_yaml_path = os.path.relpath(template_path, tht_root)
 
         # heatclient template_utils needs a function that can
-        # retrieve objects from a container by name/path
-        def do_object_request(method='GET', object_path=None):
-            obj = self.object_client.get_object(stack_name, object_path)
-            return obj and obj[1]
-
+        # retrieve objects from a container by name/path. Objects which
+        # are unchanged from the local tht_root are read from disk.
         template_files, template = template_utils.get_template_contents(
             template_object=plan_yaml_path,
-            object_request=do_object_request)
+            object_request=plan_management.plan_object_request(
+                self.object_client, stack_name, tht_root))
 
         files = dict(list(template_files.items()) + list(env_files.items()))
+        files = utils.prune_unreachable_files(files, template, env)
 
         moved_files = self._upload_missing_files(
             stack_name, files, tht_root)
@@ -321,39 +322,44 @@ class DeployOvercloud(command.Command):
                 os.path.normpath(path[1:]))
 
         # make sure links within files point to new locations, and upload them
+        uploads = []
         for orig_path, reloc_path in file_relocation.items():
             link_replacement = utils.relative_link_replacement(
                 file_relocation, os.path.dirname(reloc_path))
             contents = utils.replace_links_in_template_contents(
                 files_dict[orig_path], link_replacement)
-            self.object_client.put_object(container_name, reloc_path, contents)
+            uploads.append((reloc_path, contents))
+        object_transfer.upload_objects(
+            self.object_client, container_name, uploads)
 
         return file_relocation
 
     def _download_missing_files_from_plan(self, tht_dir, plan_name):
         # get and download missing files into tmp directory
-        plan_list = self.object_client.get_container(plan_name)
+        plan_list = self.object_client.get_container(plan_name,
+                                                     full_listing=True)
         plan_filenames = [f['name'] for f in plan_list[1]]
+        missing_files = []
         for pf in plan_filenames:
             file_path = os.path.join(tht_dir, pf)
             if not os.path.isfile(file_path):
                 self.log.debug("Missing in templates directory, downloading \
                                %s from swift into %s" % (pf, file_path))
-                if not os.path.exists(os.path.dirname(file_path)):
-                    os.makedirs(os.path.dirname(file_path))
-                with open(file_path, 'w') as f:
-                    f.write(self.object_client.get_object(plan_name, pf)[1])
+                missing_files.append((pf, file_path))
+        object_transfer.download_objects(self.object_client, plan_name,
+                                         missing_files)
 
     def _deploy_tripleo_heat_templates_tmpdir(self, stack, parsed_args):
-        # copy tht_root to temporary directory because we need to
-        # download any missing (e.g j2 rendered) files from the plan
+        # create a linked copy of tht_root in a temporary directory because
+        # we need to download any missing (e.g j2 rendered) files from the
+        # plan
         tht_root = os.path.abspath(parsed_args.templates)
         tht_tmp = tempfile.mkdtemp(prefix='tripleoclient-')
         new_tht_root = "%s/tripleo-heat-templates" % tht_tmp
         self.log.debug("Creating temporary templates tree in %s"
                        % new_tht_root)
         try:
-            shutil.copytree(tht_root, new_tht_root, symlinks=True)
+            utils.link_templates_tree(tht_root, new_tht_root)
             self._deploy_tripleo_heat_templates(stack, parsed_args,
                                                 new_tht_root, tht_root)
         finally:
@@ -534,6 +540,11 @@ class DeployOvercloud(command.Command):
             self._validate_args_environment_directory(
                 parsed_args.environment_directories)
 
+        if parsed_args.resume and not parsed_args.config_download:
+            raise oscexc.CommandError(
+                "Error: The --resume cannot be used with "
+                "--no-config-download")
+
     def _validate_args_environment_directory(self, directories):
         default = os.path.expanduser(constants.DEFAULT_ENV_DIRECTORY)
         nonexisting_dirs = []
@@ -798,6 +809,15 @@ class DeployOvercloud(command.Command):
                    'config-download workflow to apply the software '
                    'configuration.')
         )
+        parser.add_argument(
+            '--resume',
+            metavar='<execution id>',
+            help=_('Wait for the running config-download workflow execution '
+                   '<execution id>, e.g. after the previous client was '
+                   'disconnected, instead of starting a new one. The '
+                   'messages it already sent are shown first. Implies '
+                   '--config-download-only.')
+        )
         parser.add_argument(
             '--output-dir',
             action='store',
@@ -861,7 +881,7 @@ class DeployOvercloud(command.Command):
             print("Validation Finished")
             return
 
-        if not parsed_args.config_download_only:
+        if not (parsed_args.config_download_only or parsed_args.resume):
             self._deploy_tripleo_heat_templates_tmpdir(stack, parsed_args)
 
         # Get a new copy of the stack after stack update/create. If it was
@@ -877,40 +897,46 @@ class DeployOvercloud(command.Command):
         if parsed_args.config_download:
             print("Deploying overcloud configuration")
 
-            hosts = deployment.get_overcloud_hosts(
-                stack, parsed_args.overcloud_ssh_network)
-            deployment.enable_ssh_admin(self.log, self.clients,
-                                        hosts,
-                                        parsed_args.overcloud_ssh_user,
-                                        parsed_args.overcloud_ssh_key)
+            if not parsed_args.resume:
+                hosts = deployment.get_overcloud_hosts(
+                    stack, parsed_args.overcloud_ssh_network)
+                deployment.enable_ssh_admin(self.log, self.clients,
+                                            hosts,
+                                            parsed_args.overcloud_ssh_user,
+                                            parsed_args.overcloud_ssh_key)
             deployment.config_download(self.log, self.clients, stack,
                                        parsed_args.templates,
                                        parsed_args.overcloud_ssh_user,
                                        parsed_args.overcloud_ssh_key,
                                        parsed_args.overcloud_ssh_network,
                                        parsed_args.output_dir,
-                                       verbosity=self.app_args.verbose_level)
+                                       verbosity=self.app_args.verbose_level,
+                                       execution_id=parsed_args.resume)
 
         # Force fetching of attributes
         stack.get()
 
-        overcloudrcs = deployment.create_overcloudrc(
-            self.clients, container=stack.stack_name,
-            no_proxy=parsed_args.no_proxy)
+        with workflow_base.WorkflowRunner(self.clients) as runner:
+            # The Horizon URL doesn't depend on anything done below
+            horizon_url = runner.submit(deployment.get_horizon_url,
+                                        self.clients, stack=stack.stack_name)
 
-        rcpath = utils.write_overcloudrc(stack.stack_name, overcloudrcs)
-        utils.create_tempest_deployer_input()
+            overcloudrcs = deployment.create_overcloudrc(
+                self.clients, container=stack.stack_name,
+                no_proxy=parsed_args.no_proxy)
 
-        # Run postconfig on create or force. Use force to makes sure endpoints
-        # are created with deploy reruns and upgrades
-        if (stack_create or parsed_args.force_postconfig
-                and not parsed_args.skip_postconfig):
-            self._deploy_postconfig(stack, parsed_args)
+            rcpath = utils.write_overcloudrc(stack.stack_name, overcloudrcs)
+            utils.create_tempest_deployer_input()
 
-        overcloud_endpoint = utils.get_overcloud_endpoint(stack)
+            # Run postconfig on create or force. Use force to makes sure
+            # endpoints are created with deploy reruns and upgrades
+            if (stack_create or parsed_args.force_postconfig
+                    and not parsed_args.skip_postconfig):
+                self._deploy_postconfig(stack, parsed_args)
+
+            overcloud_endpoint = utils.get_overcloud_endpoint(stack)
 
-        horizon_url = deployment.get_horizon_url(
-            self.clients, stack=stack.stack_name)
+            horizon_url = horizon_url.result()
 
         print("Overcloud Endpoint: {0}".format(overcloud_endpoint))
         print("Overcloud Horizon Dashboard URL: {0}".format(horizon_url))
@@ -14,11 +14,18 @@
 #
 
 import argparse
+import collections
 import logging
 import os.path
 import re
+import time
+
+from osc_lib.i18n import _
+from prettytable import PrettyTable
 
 from tripleoclient import command
+from tripleoclient import exceptions
+from tripleoclient.workflows import base
 
 
 class RemoteExecute(command.Command):
@@ -34,16 +41,54 @@ class RemoteExecute(command.Command):
                             default='script',
                             help='Heat Software config "group" type. '
                                  'Defaults to "script".')
+        parser.add_argument('-o', '--output-dir', dest='output_dir',
+                            default=None,
+                            help=_('Directory to write the stdout and stderr '
+                                   'of each server to, as '
+                                   '<server_name>.stdout and '
+                                   '<server_name>.stderr, instead of '
+                                   'printing them.'))
+        parser.add_argument('-t', '--timeout', dest='timeout', type=int,
+                            default=None,
+                            help=_('Maximum time in seconds to wait for all '
+                                   'the servers to finish.'))
         parser.add_argument('file_in', type=argparse.FileType('r'))
         return parser
 
+    def _matching_servers(self, server_name):
+        """Return the names of the servers the config is deployed on
+
+        The servers are matched like the deploy_on_servers workflow does.
+        """
+        compute_client = self.app.client_manager.compute
+        return sorted(server.name for server in compute_client.servers.list()
+                      if server_name == 'all' or server_name in server.name)
+
+    def _write_output(self, output_dir, payload):
+        paths = []
+        for stream in ('stdout', 'stderr'):
+            if not payload[stream]:
+                continue
+            path = os.path.join(output_dir, '%s.%s' % (payload['server_name'],
+                                                       stream))
+            with open(path, 'w') as f:
+                f.write(payload[stream])
+            paths.append(path)
+        return paths
+
+    def _print_summary(self, results, servers):
+        table = PrettyTable(['Server Name', 'Status', 'Status Code'])
+        for server_name in servers:
+            status, status_code = results.get(server_name, ('NO RESULT', ''))
+            table.add_row([server_name, status, status_code])
+        print(table)
+
     def take_action(self, parsed_args):
 
         self.log.debug("take_action(%s)" % parsed_args)
         config = parsed_args.file_in.read()
         workflow_client = self.app.client_manager.workflow_engine
         tripleoclients = self.app.client_manager.tripleoclient
-        messaging_websocket = tripleoclients.messaging_websocket()
 
         # no special characters here
         config_name = re.sub('[^\w]*', '',
@@ -52,6 +97,17 @@ class RemoteExecute(command.Command):
         if not parsed_args.server_name:
             raise Exception('Please specify the -s (--server_name) option.')
 
+        if parsed_args.output_dir and not os.path.isdir(
+                parsed_args.output_dir):
+            os.makedirs(parsed_args.output_dir)
+
+        deadline = None
+        if parsed_args.timeout is not None:
+            deadline = time.time() + parsed_args.timeout
+
+        servers = self._matching_servers(parsed_args.server_name)
+        print('Running %s on %d servers' % (config_name, len(servers)))
+
         workflow_input = {
             'server_name': parsed_args.server_name,
             'config_name': config_name,
@@ -59,24 +115,49 @@ class RemoteExecute(command.Command):
             'config': config
         }
 
-        workflow_client.executions.create(
-            'tripleo.deployment.v1.deploy_on_servers',
-            workflow_input=workflow_input
-        )
-
-        while True:
-            body = messaging_websocket.recv()['body']
-            if 'tripleo.deployment.v1.deploy_on_server' == body['type']:
-                payload = body['payload']
-                status = 'SUCCESS'
-                if payload['status_code'] != 0:
-                    status = 'FAILED'
-                print('%s :: -- %s --' % (payload['server_name'], status))
-                if payload['stdout']:
-                    print('stdout\n: %s\n' % payload['stdout'])
-                if payload['stderr']:
-                    print('stderr\n: %s\n' % payload['stderr'])
-            if 'tripleo.deployment.v1.deploy_on_servers' == body['type']:
-                break
-
-        messaging_websocket.cleanup()
+        results = collections.OrderedDict()
+        with tripleoclients.messaging_websocket() as ws:
+            execution = base.start_workflow(
+                workflow_client,
+                'tripleo.deployment.v1.deploy_on_servers',
+                workflow_input=workflow_input
+            )
+
+            try:
+                for payload in base.wait_for_messages(workflow_client, ws,
+                                                      execution,
+                                                      deadline=deadline):
+                    # The messages of the deploy_on_server sub-workflows
+                    if 'server_name' not in payload:
+                        continue
+                    status = 'SUCCESS'
+                    if payload['status_code'] != 0:
+                        status = 'FAILED'
+                    results[payload['server_name']] = (
+                        status, payload['status_code'])
+                    print('[%d/%d] %s :: -- %s --' % (
+                        len(results), max(len(servers), len(results)),
+                        payload['server_name'], status))
+                    if parsed_args.output_dir:
+                        for path in self._write_output(parsed_args.output_dir,
+                                                       payload):
+                            print('%s written' % path)
+                        continue
+                    if payload['stdout']:
+                        print('stdout\n: %s\n' % payload['stdout'])
+                    if payload['stderr']:
+                        print('stderr\n: %s\n' % payload['stderr'])
+            except exceptions.WebSocketTimeout:
+                print('Timed out after %d seconds' % parsed_args.timeout)
+
+        # Servers created or renamed while the workflow ran
+        servers = servers + [name for name in results if name not in servers]
+        self._print_summary(results, servers)
+
+        failed = [name for name in servers
+                  if results.get(name, ('NO RESULT',))[0] != 'SUCCESS']
+        if failed:
+            raise exceptions.RemoteExecuteError(
+                '%s failed or did not finish on %d of %d servers: %s' % (
+                    config_name, len(failed), len(servers),
+                    ', '.join(failed)))
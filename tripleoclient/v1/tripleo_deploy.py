@@ -38,6 +38,7 @@ from tripleoclient import constants
 from tripleoclient import exceptions
 from tripleoclient import heat_launcher
 from tripleoclient import utils
+from tripleoclient import yaml_cache
 
 from tripleo_common.image import kolla_builder
 from tripleo_common.utils import passwords as password_utils
@@ -109,8 +110,7 @@ class Deploy(command.Command):
             return self.roles_data
 
         if self.roles_file and os.path.exists(self.roles_file):
-            with open(self.roles_file) as f:
-                self.roles_data = yaml.safe_load(f)
+            self.roles_data = yaml_cache.load_file(self.roles_file)
         elif self.roles_file:
             self.log.warning("roles_data '%s' is not found" % self.roles_file)
 
@@ -174,10 +174,10 @@ class Deploy(command.Command):
         if not self.tht_render:
             self.tht_render = os.path.join(self.output_dir,
                                            'tripleo-heat-installer-templates')
-            # Clear dir since we're using a static name and shutils.copytree
-            # needs the fodler to not exist. We'll generate the
-            # contents each time. This should clear the folder on the first
-            # run of this function.
+            # Clear dir since we're using a static name and
+            # utils.link_templates_tree needs the folder to not exist. We'll
+            # generate the contents each time. This should clear the folder
+            # on the first run of this function.
             shutil.rmtree(self.tht_render, ignore_errors=True)
         if not self.tmp_ansible_dir:
             self.tmp_ansible_dir = tempfile.mkdtemp(
@@ -186,7 +186,7 @@ class Deploy(command.Command):
     def _populate_templates_dir(self, source_templates_dir):
         """Creates template dir with templates
 
-        * Copy --templates content into a working dir
+        * Link --templates content into a working dir
           created as 'output_dir/tripleo-heat-installer-templates'.
 
         :param source_templates_dir: string to a directory containing our
@@ -197,8 +197,7 @@ class Deploy(command.Command):
             raise exceptions.NotFound("%s template director does not exists" %
                                       source_templates_dir)
         if not os.path.exists(self.tht_render):
-            shutil.copytree(source_templates_dir, self.tht_render,
-                            symlinks=True)
+            utils.link_templates_tree(source_templates_dir, self.tht_render)
 
     def _cleanup_working_dirs(self, cleanup=False):
         """Cleanup temporary working directories
@@ -397,6 +396,8 @@ class Deploy(command.Command):
         # it always below.
         self.heat_pid = os.fork()
         if self.heat_pid == 0:
+            # The database snapshot is only accessible to root
+            self.heat_launch.prepare_heat_db()
             if parsed_args.heat_native:
                 try:
                     uid = pwd.getpwnam(parsed_args.heat_user).pw_uid
@@ -407,9 +408,9 @@ class Deploy(command.Command):
                         "proceeding.") % parsed_args.heat_user
                     self.log.error(msg)
                     raise exceptions.DeploymentError(msg)
+                os.setgroups([])
                 os.setgid(gid)
                 os.setuid(uid)
-            self.heat_launch.heat_db_sync()
             # Exec() never returns.
             self.heat_launch.launch_heat()
 
@@ -422,6 +423,20 @@ class Deploy(command.Command):
 
         return orchestration_client
 
+    def _wait_for_heat(self, parsed_args):
+        """Wait for the heat launched by _launch_heat to serve its API"""
+        try:
+            ready = utils.wait_api_port_ready(parsed_args.heat_api_port,
+                                              pid=self.heat_pid)
+        except exceptions.ProcessExited:
+            # The heat child is already reaped, there is nothing to kill
+            self.heat_pid = None
+            raise
+        if not ready:
+            raise exceptions.DeploymentError(
+                _('Heat API is not ready on port %s') %
+                parsed_args.heat_api_port)
+
     def _normalize_user_templates(self, user_tht_root, tht_root, env_files=[]):
         """copy environment files into tht render path
 
@@ -558,7 +573,7 @@ class Deploy(command.Command):
             stack_name=parsed_args.stack,
             role_name=self._get_primary_role_name()))
 
-        with open(maps_file, 'w') as env_file:
+        with utils.replace_file(maps_file) as env_file:
             yaml.safe_dump({'parameter_defaults': tmp_env}, env_file,
                            default_flow_style=False)
         environments.append(maps_file)
@@ -575,7 +590,7 @@ class Deploy(command.Command):
         stack_vstate_dropin = os.path.join(self.tht_render,
                                            '%s-stack-vstate-dropin.yaml' %
                                            parsed_args.stack)
-        with open(stack_vstate_dropin, 'w') as dropin_file:
+        with utils.replace_file(stack_vstate_dropin) as dropin_file:
             yaml.safe_dump(
                 {'parameter_defaults': {'StackAction': self.stack_action}},
                 dropin_file, default_flow_style=False)
@@ -616,6 +631,7 @@ class Deploy(command.Command):
             template_utils.get_template_contents(template_path)
 
         files = dict(list(template_files.items()) + list(env_files.items()))
+        files = utils.prune_unreachable_files(files, template, env)
 
         stack_name = parsed_args.stack
 
@@ -634,6 +650,9 @@ class Deploy(command.Command):
         if parsed_args.timeout:
             stack_args['timeout_mins'] = parsed_args.timeout
 
+        # Heat was started before the templates were processed
+        self._wait_for_heat(parsed_args)
+
         self.log.warning(_("** Performing Heat stack create.. **"))
         stack = orchestration_client.stacks.create(**stack_args)
         stack_id = stack['stack']['id']
@@ -864,7 +883,7 @@ class Deploy(command.Command):
             self.log.info('Converting hiera overrides for t-h-t from '
                           'legacy format into a file %s' %
                           hiera_override_file)
-            with open(hiera_override_file, 'w') as override:
+            with utils.replace_file(hiera_override_file) as override:
                 yaml.safe_dump(
                     {'parameter_defaults': {
                      extra_config_var: hiera_data}},
@@ -927,10 +946,8 @@ class Deploy(command.Command):
                 _('The heat stack {0} action is {1}').format(
                     parsed_args.stack, self.stack_action))
 
-            # Launch heat.
+            # Launch heat, it starts while the templates are processed.
             orchestration_client = self._launch_heat(parsed_args)
-            # Wait for heat to be ready.
-            utils.wait_api_port_ready(parsed_args.heat_api_port)
             # Deploy TripleO Heat templates.
             stack_id = \
                 self._deploy_tripleo_heat_templates(orchestration_client,
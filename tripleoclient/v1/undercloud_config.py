@@ -20,7 +20,6 @@ import logging
 import netaddr
 import os
 import shutil
-import yaml
 
 from cryptography import x509
 
@@ -41,6 +40,7 @@ from tripleoclient import constants
 from tripleoclient import exceptions
 from tripleoclient import utils
 from tripleoclient.v1 import undercloud_preflight
+from tripleoclient import yaml_cache
 
 
 # Provides mappings for some of the instack_env tags to undercloud heat
@@ -615,15 +615,14 @@ def _get_public_tls_parameters(service_certificate_path):
 
 
 def _get_public_tls_resource_registry_overwrites(enable_tls_yaml_path):
-    with open(enable_tls_yaml_path, 'rb') as enable_tls_file:
-        enable_tls_dict = yaml.load(enable_tls_file.read())
-        try:
-            return enable_tls_dict['resource_registry']
-        except KeyError:
-            msg = _('%s is malformed and is missing the resource '
-                    'registry.') % enable_tls_yaml_path
-            LOG.error(msg)
-            raise RuntimeError(msg)
+    enable_tls_dict = yaml_cache.load_file(enable_tls_yaml_path)
+    try:
+        return enable_tls_dict['resource_registry']
+    except KeyError:
+        msg = _('%s is malformed and is missing the resource '
+                'registry.') % enable_tls_yaml_path
+        LOG.error(msg)
+        raise RuntimeError(msg)
 
 
 def _container_images_config(conf, deploy_args, env_data, tempdir):
@@ -9,10 +9,15 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+from concurrent import futures
 import json
 import logging
+import random
+import time
 
+from tripleoclient import constants
 from tripleoclient import exceptions
+from tripleoclient.workflows import timing
 
 LOG = logging.getLogger(__name__)
 
@@ -20,9 +25,11 @@ LOG = logging.getLogger(__name__)
 def call_action(workflow_client, action, **input_):
     """Trigger a Mistral action and parse the JSON response"""
 
+    start = time.time()
     result = workflow_client.action_executions.create(
         action, input_,
         save_result=True, run_sync=True)
+    timing.record('action', action, time.time() - start, state=result.state)
 
     # Parse the JSON output. Mistral client should do this for us really.
     output = json.loads(result.output)['result']
@@ -34,10 +41,14 @@ def call_action(workflow_client, action, **input_):
 
 def start_workflow(workflow_client, identifier, workflow_input):
 
+    start = time.time()
     execution = workflow_client.executions.create(
         identifier,
         workflow_input=workflow_input
     )
+    timing.set_workflow_name(execution.id, identifier)
+    timing.record('execution_create', identifier, time.time() - start,
+                  execution_id=execution.id)
 
     LOG.debug("Started Mistral Workflow {}. Execution ID: {}".format(
               identifier, execution.id))
@@ -45,7 +56,153 @@ def start_workflow(workflow_client, identifier, workflow_input):
     return execution
 
 
-def wait_for_messages(mistral, websocket, execution, timeout=None):
+# States of a Mistral execution which hasn't ended yet
+_UNFINISHED_STATES = ('IDLE', 'RUNNING', 'PAUSED')
+
+
+def _backoff(interval, max_interval):
+    """Yield wait times growing exponentially, with jitter"""
+    while True:
+        yield random.uniform(interval / 2.0, interval)
+        interval = min(interval * 2, max_interval)
+
+
+def poll_execution(workflow_client, execution_id, timeout=None,
+                   interval=constants.POLLING_INITIAL_INTERVAL,
+                   max_interval=constants.POLLING_MAX_INTERVAL,
+                   idle_timeout=None):
+    """Poll Mistral until an execution has ended
+
+    The execution is yielded every time it is looked up, the last one is no
+    longer running. The wait between two lookups doubles every time, up to
+    max_interval, so long workflows don't keep Mistral busy. Raises
+    exceptions.Timeout when timeout seconds pass and it is still running, or
+    when idle_timeout seconds pass without any change of its state.
+    """
+    now = time.time()
+    deadline = None if timeout is None else now + timeout
+    idle_deadline = None if idle_timeout is None else now + idle_timeout
+    last_seen = None
+    for wait in _backoff(interval, max_interval):
+        execution = workflow_client.executions.get(execution_id)
+        yield execution
+        if execution.state not in _UNFINISHED_STATES:
+            return
+        seen = (execution.state, getattr(execution, 'state_info', None),
+                getattr(execution, 'updated_at', None))
+        if idle_timeout is not None and seen != last_seen:
+            idle_deadline = time.time() + idle_timeout
+        last_seen = seen
+        for end in (deadline, idle_deadline):
+            if end is None:
+                continue
+            remaining = end - time.time()
+            if remaining <= 0:
+                raise exceptions.Timeout(
+                    "Timed out waiting for execution {}".format(execution_id))
+            wait = min(wait, remaining)
+        time.sleep(wait)
+
+
+def _execution_payload(execution):
+    """Make the last message of a workflow from the execution output"""
+    try:
+        output = json.loads(execution.output or '{}')
+    except (TypeError, ValueError):
+        output = {}
+    payload = dict(output) if isinstance(output, dict) else {}
+    if 'status' not in payload:
+        payload['status'] = (
+            'SUCCESS' if execution.state == 'SUCCESS' else 'FAILED')
+    payload.setdefault('message', execution.state_info or '')
+    payload['execution'] = {'id': execution.id}
+    return payload
+
+
+class PollingClient(object):
+    """A replacement for WebsocketClient which polls Mistral
+
+    It is used when the Zaqar websocket can't be reached. Only the end of an
+    execution is known this way: wait_for_messages gives a single message,
+    made from the output of the execution. That output is only decoded once
+    the execution has ended.
+    """
+
+    def __init__(self, workflow_client):
+        self._workflow_client = workflow_client
+
+    def cleanup(self):
+        pass
+
+    def replay(self, execution_id):
+        return []
+
+    def wait_for_messages(self, timeout=None, execution_id=None,
+                          deadline=None):
+        """Wait for the end of an execution
+
+        Like for WebsocketClient, timeout is the longest wait for something
+        new: it starts again whenever the state of the execution changes.
+        The deadline is the time.time() after which it isn't waited for.
+        """
+        if execution_id is None:
+            raise ValueError("Polling Mistral needs an execution id")
+        total = None if deadline is None else deadline - time.time()
+        try:
+            for execution in poll_execution(self._workflow_client,
+                                            execution_id, total,
+                                            idle_timeout=timeout):
+                pass
+        except exceptions.Timeout:
+            raise exceptions.WebSocketTimeout()
+        yield _execution_payload(execution)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+class _ExecutionStateCheck(object):
+    """Rate limited lookups of whether a Mistral execution is still running
+
+    Looking up the execution for every progress message of a chatty workflow
+    costs one Mistral API call per message. Lookups are instead done at most
+    once per interval. A lookup skipped because of that limit is pending,
+    and is done as soon as the interval ends without any new message.
+    """
+
+    def __init__(self, mistral, execution_id,
+                 interval=constants.EXECUTION_STATE_CHECK_INTERVAL):
+        self._mistral = mistral
+        self._execution_id = execution_id
+        self.interval = interval
+        self.pending = False
+        self.calls = 0
+        self.saved = 0
+        self._last = None
+
+    def remaining(self):
+        """Seconds until the pending lookup can be done"""
+        return max(0, self._last + self.interval - time.time())
+
+    def is_running(self, force=False):
+        now = time.time()
+        if (not force and self._last is not None and
+                now - self._last < self.interval):
+            self.pending = True
+            self.saved += 1
+            return True
+        self.pending = False
+        self._last = now
+        self.calls += 1
+        execution = self._mistral.executions.get(self._execution_id)
+        return execution.state == "RUNNING"
+
+
+def wait_for_messages(mistral, websocket, execution, timeout=None,
+                      replay=False, deadline=None):
     """Wait for messages on a websocket.
 
     Given an instance of mistral client, a websocket and a Mistral execution
@@ -56,25 +213,171 @@ def wait_for_messages(mistral, websocket, execution, timeout=None):
 
     If a timeout is reached, called check_execution_status which will look up
     the execution on Mistral and log information about it.
+
+    The state of the execution is looked up on Mistral at most once every
+    EXECUTION_STATE_CHECK_INTERVAL seconds while its progress messages are
+    received.
+
+    If replay is True, the messages about the execution which are still in
+    the queue are given first. This is used to resume waiting for an
+    execution started by another client.
+
+    The time to the first message, the gaps between messages and the final
+    state are recorded in the workflow timings.
+
+    Unlike the timeout, which is the longest wait for a single message, a
+    deadline is the time.time() after which no more messages are waited for.
+    Reaching it is handled like a timeout.
     """
+    timings = timing.MessageTimings(execution.id)
+    messages = _wait_for_messages(mistral, websocket, execution, timeout,
+                                  replay, deadline)
     try:
-        for payload in websocket.wait_for_messages(timeout=timeout):
+        for payload in messages:
+            timings.message(payload)
             yield payload
-            # If the message is from a sub-workflow, we just need to pass it
-            # on to be displayed. This should never be the last message - so
-            # continue and wait for the next.
-            if payload['execution']['id'] != execution.id:
-                continue
-            # Check the status of the payload, if we are not given one
-            # default to running and assume it is just an "in progress"
-            # message from the workflow.
-            # Workflows should end with SUCCESS or ERROR statuses.
-            if payload.get('status', 'RUNNING') != "RUNNING" or \
-                    mistral.executions.get(execution.id).state != "RUNNING":
+    except exceptions.WebSocketTimeout:
+        timings.timed_out = True
+        raise
+    finally:
+        messages.close()
+        timings.record()
+
+
+def _wait_for_messages(mistral, websocket, execution, timeout, replay,
+                       deadline=None):
+    check = _ExecutionStateCheck(mistral, execution.id)
+    try:
+        if replay:
+            for payload in websocket.replay(execution.id):
+                yield payload
+                if payload.get('status', 'RUNNING') != "RUNNING":
+                    return
+            # The last messages may have expired from the queue
+            if not check.is_running(force=True):
                 return
+        while True:
+            wait = timeout
+            idle_check = check.pending
+            if idle_check:
+                wait = check.remaining()
+                if not wait:
+                    # The interval has ended, do the pending lookup now
+                    if not check.is_running(force=True):
+                        return
+                    continue
+                if timeout is not None and timeout < wait:
+                    wait, idle_check = timeout, False
+            if deadline is not None:
+                left = deadline - time.time()
+                if left <= 0:
+                    raise exceptions.WebSocketTimeout()
+                if wait is None or left < wait:
+                    wait, idle_check = left, False
+            kwargs = {}
+            if deadline is not None:
+                kwargs['deadline'] = deadline
+            try:
+                for payload in websocket.wait_for_messages(
+                        timeout=wait, execution_id=execution.id, **kwargs):
+                    if payload.get('execution', {}).get(
+                            'root_execution_id',
+                            execution.id) != execution.id:
+                        # About another workflow started from the same queue
+                        continue
+                    yield payload
+                    # If the message is from a sub-workflow, we just need to
+                    # pass it on to be displayed. This should never be the
+                    # last message - so continue and wait for the next.
+                    if payload['execution']['id'] != execution.id:
+                        if deadline is not None:
+                            # Wait again, for no longer than the time left
+                            break
+                        continue
+                    # Check the status of the payload, if we are not given
+                    # one default to running and assume it is just an "in
+                    # progress" message from the workflow.
+                    # Workflows should end with SUCCESS or ERROR statuses.
+                    if payload.get('status', 'RUNNING') != "RUNNING" or \
+                            not check.is_running():
+                        return
+                    if check.pending or deadline is not None:
+                        # Wait again, for no longer than the pending lookup
+                        # or the time left
+                        break
+                else:
+                    return
+            except exceptions.WebSocketTimeout:
+                if not idle_check:
+                    raise
+                # The workflow went quiet, do the pending lookup
+                if not check.is_running(force=True):
+                    return
     except exceptions.WebSocketTimeout:
         check_execution_status(mistral, execution.id)
         raise
+    finally:
+        LOG.debug("Looked up the state of execution {} {} times, {} lookups "
+                  "saved".format(execution.id, check.calls, check.saved))
+
+
+class WorkflowRunner(object):
+    """Run Mistral workflows concurrently
+
+    Workflows are started from the calling thread, then their messages are
+    waited for by a pool of threads. This lets a command run independent
+    workflows at the same time, or drive many executions at once. All of them
+    share the websocket connection of their queue.
+
+    The blocking helpers of the workflows modules can also be run in the pool
+    with submit().
+    """
+
+    def __init__(self, clients, max_workers=constants.WORKFLOW_CONCURRENCY):
+        self._clients = clients
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, fn, *args, **kwargs):
+        """Call fn in the pool and return a future of its result"""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def start(self, identifier, workflow_input, timeout=None,
+              on_message=None, queue_name='tripleo'):
+        """Start a workflow and return a future of its last message
+
+        on_message is called from the pool with every message received,
+        including the last one.
+        """
+        workflow_client = self._clients.workflow_engine
+        # Subscribe before starting the workflow, so no message is missed
+        ws = self._clients.tripleoclient.messaging_websocket(queue_name)
+        try:
+            execution = start_workflow(workflow_client, identifier,
+                                       workflow_input)
+            return self._executor.submit(self._wait, workflow_client, ws,
+                                         execution, timeout, on_message)
+        except BaseException:
+            ws.cleanup()
+            raise
+
+    @staticmethod
+    def _wait(workflow_client, ws, execution, timeout, on_message):
+        payload = None
+        with ws:
+            for payload in wait_for_messages(workflow_client, ws, execution,
+                                             timeout):
+                if on_message is not None:
+                    on_message(payload)
+        return payload
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
 
 
 def check_execution_status(workflow_client, execution_id):
@@ -14,13 +14,11 @@ from __future__ import print_function
 import os
 import pprint
 import shutil
-import socket
 import subprocess
 import tempfile
 import time
 
 from heatclient.common import event_utils
-from openstackclient import shell
 
 from tripleoclient import constants
 from tripleoclient import exceptions
@@ -94,12 +92,15 @@ def deploy_and_wait(log, clients, stack, plan_name, verbose_level,
         marker = events[0].id if events else None
         action = 'UPDATE'
 
-    time.sleep(10)
     verbose_events = verbose_level >= 1
+    if timeout is not None:
+        # Heat fails the stack after timeout minutes, give it time to do so
+        timeout = timeout * 60 + constants.STACK_EVENTS_TIMEOUT_SLACK
     create_result = utils.wait_for_stack_ready(
-        orchestration_client, plan_name, marker, action, verbose_events)
+        orchestration_client, plan_name, marker, action, verbose_events,
+        timeout=timeout)
     if not create_result:
-        shell.OpenStackShell().run(["stack", "failures", "list", plan_name])
+        utils.print_stack_failures(orchestration_client, plan_name)
         if stack is None:
             raise exceptions.DeploymentError("Heat Stack create failed.")
         else:
@@ -110,14 +111,18 @@ def create_overcloudrc(clients, **workflow_input):
     workflow_client = clients.workflow_engine
     tripleoclients = clients.tripleoclient
 
-    execution = base.start_workflow(
-        workflow_client,
-        'tripleo.deployment.v1.create_overcloudrc',
-        workflow_input=workflow_input
-    )
-
     with tripleoclients.messaging_websocket() as ws:
-        for payload in base.wait_for_messages(workflow_client, ws, execution):
+        execution = base.start_workflow(
+            workflow_client,
+            'tripleo.deployment.v1.create_overcloudrc',
+            workflow_input=workflow_input
+        )
+
+        for payload in base.wait_for_messages(workflow_client, ws, execution,
+                                              _WORKFLOW_TIMEOUT):
+            if payload.get('execution', {}).get(
+                    'id', execution.id) != execution.id:
+                continue
             # the workflow will return the overcloudrc data, an error message
             # or blank.
             if payload.get('status') == 'SUCCESS':
@@ -138,20 +143,10 @@ def get_overcloud_hosts(stack, ssh_network):
 
 
 def wait_for_ssh_port(host):
-    start = int(time.time())
-    while True:
-        now = int(time.time())
-        if (now - start) > constants.ENABLE_SSH_ADMIN_SSH_PORT_TIMEOUT:
-            raise exceptions.DeploymentError(
-                "Timed out waiting for port 22 from %s" % host)
-
-        try:
-            socket.socket().connect((host, 22))
-            return
-        except socket.error:
-            pass
-
-        time.sleep(1)
+    if not utils.wait_for_port(
+            22, host, timeout=constants.ENABLE_SSH_ADMIN_SSH_PORT_TIMEOUT):
+        raise exceptions.DeploymentError(
+            "Timed out waiting for port 22 from %s" % host)
 
 
 def enable_ssh_admin(log, clients, hosts, ssh_user, ssh_key):
@@ -203,28 +198,25 @@ def enable_ssh_admin(log, clients, hosts, ssh_user, ssh_key):
             workflow_input=workflow_input
         )
 
-        start = int(time.time())
-        while True:
-            now = int(time.time())
-            if (now - start) > constants.ENABLE_SSH_ADMIN_TIMEOUT:
-                raise exceptions.DeploymentError(
-                    "ssh admin enablement workflow - TIMED OUT.")
-
-            time.sleep(1)
-            execution = workflow_client.executions.get(execution.id)
-            state = execution.state
-
-            if state == 'RUNNING':
-                if (now - start) % constants.ENABLE_SSH_ADMIN_STATUS_INTERVAL\
-                        == 0:
+        last_status = time.time()
+        try:
+            for execution in base.poll_execution(
+                    workflow_client, execution.id,
+                    constants.ENABLE_SSH_ADMIN_TIMEOUT):
+                now = time.time()
+                if (execution.state == 'RUNNING' and now - last_status >=
+                        constants.ENABLE_SSH_ADMIN_STATUS_INTERVAL):
                     print("ssh admin enablement workflow - RUNNING.")
-                continue
-            elif state == 'SUCCESS':
-                print("ssh admin enablement workflow - COMPLETE.")
-                break
-            elif state == 'FAILED':
-                raise exceptions.DeploymentError(
-                    "ssh admin enablement workflow - FAILED.")
+                    last_status = now
+        except exceptions.Timeout:
+            raise exceptions.DeploymentError(
+                "ssh admin enablement workflow - TIMED OUT.")
+
+        if execution.state == 'SUCCESS':
+            print("ssh admin enablement workflow - COMPLETE.")
+        else:
+            raise exceptions.DeploymentError(
+                "ssh admin enablement workflow - FAILED.")
 
         for host in hosts:
             rm_tmp_key_command = ["ssh"] + ssh_options.split()
@@ -242,7 +234,14 @@ def enable_ssh_admin(log, clients, hosts, ssh_user, ssh_key):
 
 
 def config_download(log, clients, stack, templates,
-                    ssh_user, ssh_key, ssh_network, output_dir, verbosity=1):
+                    ssh_user, ssh_key, ssh_network, output_dir, verbosity=1,
+                    execution_id=None):
+    """Run the config-download workflow and print its messages
+
+    If execution_id is given, no workflow is started and the messages of that
+    running config-download execution are printed instead, starting with
+    those still in the queue.
+    """
     workflow_client = clients.workflow_engine
     tripleoclients = clients.tripleoclient
 
@@ -254,18 +253,27 @@ def config_download(log, clients, stack, templates,
     if output_dir:
         workflow_input.update(dict(work_dir=output_dir))
 
+    payload = {}
     with tripleoclients.messaging_websocket() as ws:
-        execution = base.start_workflow(
-            workflow_client,
-            'tripleo.deployment.v1.config_download_deploy',
-            workflow_input=workflow_input
-        )
+        if execution_id is None:
+            execution = base.start_workflow(
+                workflow_client,
+                'tripleo.deployment.v1.config_download_deploy',
+                workflow_input=workflow_input
+            )
+        else:
+            execution = workflow_client.executions.get(execution_id)
 
         for payload in base.wait_for_messages(workflow_client, ws, execution,
-                                              3600):
+                                              3600,
+                                              replay=execution_id is not None):
             print(payload['message'])
 
-    if payload['status'] == 'SUCCESS':
+    status = payload.get('status')
+    if execution_id is not None and status in (None, 'RUNNING'):
+        # The last message was not in the queue anymore
+        status = workflow_client.executions.get(execution_id).state
+    if status == 'SUCCESS':
         print("Overcloud configuration completed.")
     else:
         raise exceptions.DeploymentError("Overcloud configuration failed.")
@@ -284,6 +292,9 @@ def get_horizon_url(clients, **workflow_input):
 
         for payload in base.wait_for_messages(workflow_client, ws, execution,
                                               360):
+            if payload.get('execution', {}).get(
+                    'id', execution.id) != execution.id:
+                continue
             assert payload['status'] == "SUCCESS"
 
             return payload['horizon_url']
@@ -293,13 +304,13 @@ def get_deployment_status(clients, **workflow_input):
     workflow_client = clients.workflow_engine
     tripleoclients = clients.tripleoclient
 
-    execution = base.start_workflow(
-        workflow_client,
-        'tripleo.deployment.v1.get_deployment_status',
-        workflow_input=workflow_input
-    )
-
     with tripleoclients.messaging_websocket() as ws:
+        execution = base.start_workflow(
+            workflow_client,
+            'tripleo.deployment.v1.get_deployment_status',
+            workflow_input=workflow_input
+        )
+
         for payload in base.wait_for_messages(workflow_client, ws, execution,
                                               _WORKFLOW_TIMEOUT):
             if 'message' in payload:
@@ -317,13 +328,13 @@ def get_deployment_failures(clients, **workflow_input):
     workflow_client = clients.workflow_engine
     tripleoclients = clients.tripleoclient
 
-    execution = base.start_workflow(
-        workflow_client,
-        'tripleo.deployment.v1.get_deployment_failures',
-        workflow_input=workflow_input
-    )
-
     with tripleoclients.messaging_websocket() as ws:
+        execution = base.start_workflow(
+            workflow_client,
+            'tripleo.deployment.v1.get_deployment_failures',
+            workflow_input=workflow_input
+        )
+
         for payload in base.wait_for_messages(workflow_client, ws, execution,
                                               _WORKFLOW_TIMEOUT):
             if 'message' in payload:
@@ -12,11 +12,9 @@
 from __future__ import print_function
 
 import pprint
-import time
 
 
 from heatclient.common import event_utils
-from openstackclient import shell
 from tripleoclient import exceptions
 from tripleoclient import utils
 
@@ -46,11 +44,10 @@ def update(clients, **workflow_input):
                                                 'limit': 1})
     marker = events[0].id if events else None
 
-    time.sleep(10)
     create_result = utils.wait_for_stack_ready(
         orchestration_client, plan_name, marker, 'UPDATE', 1)
     if not create_result:
-        shell.OpenStackShell().run(["stack", "failures", "list", plan_name])
+        utils.print_stack_failures(orchestration_client, plan_name)
         raise exceptions.DeploymentError("Heat Stack update failed.")
 
 
@@ -142,11 +139,10 @@ def converge_nodes(clients, **workflow_input):
                                                 'limit': 1})
     marker = events[0].id if events else None
 
-    time.sleep(10)
     create_result = utils.wait_for_stack_ready(
         orchestration_client, plan_name, marker, 'UPDATE', 1)
     if not create_result:
-        shell.OpenStackShell().run(["stack", "failures", "list", plan_name])
+        utils.print_stack_failures(orchestration_client, plan_name)
         raise exceptions.DeploymentError("Heat Stack update failed.")
 
 
@@ -9,9 +9,11 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import fnmatch
+import hashlib
 import logging
 import os
-import tempfile
+import six
 import yaml
 
 from swiftclient import exceptions as swift_exc
@@ -20,6 +22,8 @@ from tripleo_common.utils import tarball
 
 from tripleoclient import constants
 from tripleoclient import exceptions
+from tripleoclient import object_transfer
+from tripleoclient import utils
 from tripleoclient.workflows import base
 
 LOG = logging.getLogger(__name__)
@@ -32,30 +36,109 @@ _WORKFLOW_TIMEOUT = 360  # 6 * 60 seconds
 
 def _upload_templates(swift_client, container_name, tht_root, roles_file=None,
                       plan_env_file=None, networks_file=None):
-    """tarball up a given directory and upload it to Swift to be extracted"""
-
-    with tempfile.NamedTemporaryFile() as tmp_tarball:
-        tarball.create_tarball(tht_root, tmp_tarball.name)
-        tarball.tarball_extract_to_swift_container(
-            swift_client, tmp_tarball.name, container_name)
-
-    # Optional override of the roles_data.yaml file
-    if roles_file:
-        _upload_file(swift_client, container_name,
-                     constants.OVERCLOUD_ROLES_FILE, roles_file)
-
-    # Optional override of the network_data.yaml file
-    if networks_file:
-        _upload_file(swift_client, container_name,
-                     constants.OVERCLOUD_NETWORKS_FILE, networks_file)
-
-    # Optional override of the plan-environment.yaml file
-    if plan_env_file:
-        # TODO(jpalanis): Instead of overriding default file,
-        # merging the user override plan-environment with default
-        # plan-environment file will avoid explict merging issues.
-        _upload_file(swift_client, container_name,
-                     constants.PLAN_ENVIRONMENT, plan_env_file)
+    """Stream an archive of a directory to Swift to be extracted"""
+
+    object_transfer.upload_archive(swift_client, container_name,
+                                   _list_template_files(tht_root))
+
+    # Optional overrides of the roles_data.yaml, network_data.yaml and
+    # plan-environment.yaml files
+    # TODO(jpalanis): Instead of overriding default file,
+    # merging the user override plan-environment with default
+    # plan-environment file will avoid explict merging issues.
+    overrides = _template_overrides(roles_file, plan_env_file, networks_file)
+    object_transfer.upload_objects(
+        swift_client, container_name,
+        [(filename, object_transfer.local_file(local_filename))
+         for filename, local_filename in overrides.items()])
+
+
+def _template_overrides(roles_file=None, plan_env_file=None,
+                        networks_file=None):
+    overrides = {
+        constants.OVERCLOUD_ROLES_FILE: roles_file,
+        constants.OVERCLOUD_NETWORKS_FILE: networks_file,
+        constants.PLAN_ENVIRONMENT: plan_env_file,
+    }
+    return dict((filename, local_filename)
+                for filename, local_filename in overrides.items()
+                if local_filename)
+
+
+def _list_template_files(tht_root):
+    """List the files under tht_root that would be uploaded to a plan
+
+    Returns a dict mapping object names to local paths. The same excludes as
+    the plan tarball are applied and, like Swift's archive extraction, only
+    regular files are considered.
+    """
+
+    def excluded(name):
+        return any(fnmatch.fnmatch(name, pattern)
+                   for pattern in tarball.DEFAULT_TARBALL_EXCLUDES)
+
+    template_files = {}
+    for root, dirs, files in os.walk(tht_root):
+        dirs[:] = [d for d in dirs if not excluded(d)]
+        for filename in files:
+            path = os.path.join(root, filename)
+            if excluded(filename) or os.path.islink(path):
+                continue
+            template_files[os.path.relpath(path, tht_root)] = path
+    return template_files
+
+
+def _content_checksum(content):
+    if isinstance(content, six.text_type):
+        content = content.encode('utf-8')
+    return hashlib.md5(content).hexdigest()
+
+
+def _sync_templates(swift_client, container_name, tht_root, roles_file=None,
+                    plan_env_file=None, networks_file=None,
+                    keep_contents=None):
+    """Synchronise a plan container with a local templates directory
+
+    The container is listed once and the ETag of each object is compared with
+    the checksum of the matching local file. Only new or changed objects are
+    uploaded and only objects which no longer exist locally are deleted, so
+    unchanged templates stay in place for the whole update.
+
+    keep_contents maps object names to contents which take precedence over
+    the local files, e.g. the plan files preserved with keep_env.
+    """
+
+    keep_contents = keep_contents or {}
+    local_files = _list_template_files(tht_root)
+    local_files.update(
+        _template_overrides(roles_file, plan_env_file, networks_file))
+
+    remote_files = _list_plan_objects(swift_client, container_name)
+    uploads = []
+
+    for filename in sorted(local_files):
+        if filename in keep_contents:
+            continue
+        local_filename = local_files[filename]
+        if remote_files.get(filename) != utils.file_checksum(local_filename):
+            uploads.append(
+                (filename, object_transfer.local_file(local_filename)))
+
+    for filename in sorted(keep_contents):
+        content = keep_contents[filename]
+        if remote_files.get(filename) != _content_checksum(content):
+            uploads.append((filename, content))
+
+    removals = [filename for filename in sorted(remote_files)
+                if filename not in local_files and
+                filename not in keep_contents]
+
+    object_transfer.upload_objects(swift_client, container_name, uploads)
+    object_transfer.delete_objects(swift_client, container_name, removals)
+
+    unchanged = len(set(local_files) | set(keep_contents)) - len(uploads)
+    print("Uploaded {0}, removed {1} and kept {2} unchanged plan "
+          "files".format(len(uploads), len(removals), unchanged))
 
 
 def _create_update_deployment_plan(clients, workflow, **workflow_input):
@@ -90,13 +173,13 @@ def delete_deployment_plan(clients, **workflow_input):
     workflow_client = clients.workflow_engine
     tripleoclients = clients.tripleoclient
 
-    execution = base.start_workflow(
-        workflow_client,
-        'tripleo.plan_management.v1.delete_deployment_plan',
-        workflow_input=workflow_input
-    )
-
     with tripleoclients.messaging_websocket() as ws:
+        execution = base.start_workflow(
+            workflow_client,
+            'tripleo.plan_management.v1.delete_deployment_plan',
+            workflow_input=workflow_input
+        )
+
         for payload in base.wait_for_messages(workflow_client, ws, execution,
                                               _WORKFLOW_TIMEOUT):
             if 'message' in payload:
@@ -194,11 +277,6 @@ def update_plan_from_templates(clients, name, tht_root, roles_file=None,
     elif not plan_env_file:
         passwords = _load_passwords(swift_client, name)
 
-    # TODO(dmatthews): Removing the existing plan files should probably be
-    #                  a Mistral action.
-    print("Removing the current plan files")
-    swiftutils.empty_container(swift_client, name)
-
     # Until we have a well defined plan update workflow in
     # tripleo-common we need to manually reset the environments and
     # parameter_defaults here. This is to ensure that no environments
@@ -210,15 +288,13 @@ def update_plan_from_templates(clients, name, tht_root, roles_file=None,
     # when updating the templates. Once LP#1623431 is resolved we may
     # need to special-case plan-environment.yaml to avoid this.
 
-    print("Uploading new plan files")
+    print("Synchronising the plan files")
     if keep_env:
-        _upload_templates(swift_client, name, tht_root)
-        for filename in keep_file_contents:
-            _upload_file_content(swift_client, name, filename,
-                                 keep_file_contents[filename])
+        _sync_templates(swift_client, name, tht_root,
+                        keep_contents=keep_file_contents)
     else:
-        _upload_templates(swift_client, name, tht_root, roles_file,
-                          plan_env_file, networks_file)
+        _sync_templates(swift_client, name, tht_root, roles_file,
+                        plan_env_file, networks_file)
         _update_passwords(swift_client, name, passwords)
 
     update_deployment_plan(clients, container=name,
@@ -264,15 +340,38 @@ def _list_plan_files(swift_client, container):
                         container, full_listing=True)[1]))
 
 
-def _upload_file(swift_client, container, filename, local_filename):
-    with open(local_filename) as file_content:
-        swift_client.put_object(container, filename, file_content)
+def _list_plan_objects(swift_client, container):
+    """Return a dict mapping plan object names to their ETags"""
+    return dict((i['name'], i.get('hash'))
+                for i in swift_client.get_container(
+                    container, full_listing=True)[1])
 
 
-# short function, just alias for interface parity with _upload_plan_file
-def _upload_file_content(swift_client, container, filename, content):
-    LOG.debug("Uploading {0} to plan".format(filename))
-    swift_client.put_object(container, filename, content)
+def plan_object_request(swift_client, container, tht_root):
+    """Return an object_request callable for heatclient's template_utils
+
+    Templates are read from tht_root when the local file has the same
+    checksum as the object in the plan, so only the objects which exist only
+    in the plan (or differ from the local copy) are fetched from Swift. The
+    plan container is listed once, on the first request.
+    """
+    plan_objects = []
+
+    def object_request(method='GET', object_path=None):
+        if not plan_objects:
+            plan_objects.append(_list_plan_objects(swift_client, container))
+        etag = plan_objects[0].get(object_path)
+        local_path = os.path.join(tht_root, object_path)
+        if etag and os.path.isfile(local_path):
+            with open(local_path, 'rb') as local_content:
+                content = local_content.read()
+            if _content_checksum(content) == etag:
+                return content
+        LOG.debug("Fetching {0} from plan {1}".format(object_path, container))
+        obj = swift_client.get_object(container, object_path)
+        return obj and obj[1]
+
+    return object_request
 
 
 def _load_passwords(swift_client, name):
@@ -304,13 +403,13 @@ def export_deployment_plan(clients, **workflow_input):
     workflow_client = clients.workflow_engine
     tripleoclients = clients.tripleoclient
 
-    execution = base.start_workflow(
-        workflow_client,
-        'tripleo.plan_management.v1.export_deployment_plan',
-        workflow_input=workflow_input
-    )
-
     with tripleoclients.messaging_websocket() as ws:
+        execution = base.start_workflow(
+            workflow_client,
+            'tripleo.plan_management.v1.export_deployment_plan',
+            workflow_input=workflow_input
+        )
+
         for payload in base.wait_for_messages(workflow_client, ws, execution,
                                               _WORKFLOW_TIMEOUT):
             if 'message' in payload:
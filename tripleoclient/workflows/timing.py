@@ -0,0 +1,136 @@
+#   Copyright 2018 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Timings of the Mistral workflows and actions run by a command
+
+Every event is kept in memory and summarized at the end of the command. When
+the TRIPLEO_WORKFLOW_TIMINGS environment variable is set to a file path, the
+events are also appended to that file, one JSON object per line.
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+_events = []
+_workflow_names = {}
+_lock = threading.Lock()
+
+
+def get_timings_file():
+    return os.environ.get('TRIPLEO_WORKFLOW_TIMINGS')
+
+
+def record(event, name, duration, **fields):
+    """Record that event took duration seconds
+
+    name identifies what the event was about, e.g. the workflow, action or
+    queue name. Any other field is only written to the timings file.
+    """
+    fields.update(event=event, name=name, duration=round(duration, 3),
+                  time=time.time())
+    with _lock:
+        _events.append(fields)
+        path = get_timings_file()
+        if not path:
+            return
+        try:
+            with open(path, 'a') as f:
+                f.write(json.dumps(fields, sort_keys=True, default=str))
+                f.write('\n')
+        except (IOError, OSError) as e:
+            LOG.warning("Could not write workflow timings to {}: {}".format(
+                path, e))
+
+
+def set_workflow_name(execution_id, name):
+    with _lock:
+        _workflow_names[execution_id] = name
+
+
+def get_workflow_name(execution_id):
+    with _lock:
+        return _workflow_names.get(execution_id)
+
+
+class MessageTimings(object):
+    """Timings of the messages received about a workflow execution"""
+
+    def __init__(self, execution_id):
+        self.execution_id = execution_id
+        self.start = time.time()
+        self.first = None
+        self.last = None
+        self.count = 0
+        self.max_gap = 0
+        self.status = None
+        self.timed_out = False
+
+    def message(self, payload):
+        now = time.time()
+        if self.last is None:
+            self.first = now
+        else:
+            self.max_gap = max(self.max_gap, now - self.last)
+        self.last = now
+        self.count += 1
+        try:
+            if payload['execution']['id'] == self.execution_id:
+                self.status = payload.get('status', self.status)
+        except (KeyError, TypeError):
+            pass
+
+    def record(self):
+        fields = {
+            'execution_id': self.execution_id,
+            'messages': self.count,
+            'max_gap': round(self.max_gap, 3),
+            'state': 'TIMEOUT' if self.timed_out else self.status,
+        }
+        if self.first is not None:
+            fields['first_message'] = round(self.first - self.start, 3)
+        if self.count > 1:
+            fields['mean_gap'] = round(
+                (self.last - self.first) / (self.count - 1), 3)
+        record('wait', get_workflow_name(self.execution_id),
+               time.time() - self.start, **fields)
+
+
+def summary():
+    """Return the lines summarizing the events, grouped by event and name"""
+    with _lock:
+        events = list(_events)
+    totals = collections.OrderedDict()
+    for event in events:
+        key = (event['event'], event['name'])
+        count, duration = totals.get(key, (0, 0))
+        totals[key] = (count + 1, duration + event['duration'])
+    return ["{} {}: {} in {:.1f}s".format(event, name, count, duration)
+            for (event, name), (count, duration) in totals.items()]
+
+
+def log_summary():
+    """Log the summary of the events and forget them"""
+    lines = summary()
+    with _lock:
+        del _events[:]
+        _workflow_names.clear()
+    if lines:
+        LOG.info("Time spent on workflows:\n  {}".format("\n  ".join(lines)))
@@ -0,0 +1,241 @@
+#   Copyright 2018 Red Hat, Inc.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+#
+
+"""Persistent cache of parsed YAML files and templates"""
+
+import hashlib
+import logging
+import marshal
+import os
+import stat
+import sys
+import tempfile
+import threading
+
+from heatclient.common import environment_format
+import yaml
+
+from tripleoclient import constants
+
+LOG = logging.getLogger(__name__)
+
+# Use the libyaml based loader when PyYAML was built with it
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Bump when the format of the cached entries changes
+_CACHE_FORMAT = 2
+
+
+def safe_load(stream):
+    """Equivalent of yaml.safe_load, using libyaml when available"""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def get_cache_dir():
+    """Return the directory used to store the cache
+
+    Defaults to tripleo/yaml in the user's cache directory and can be
+    overridden with the TRIPLEO_YAML_CACHE_DIR environment variable. Setting
+    it to an empty string disables the on-disk cache. The directory is only
+    used when it is owned by the current user and not accessible to anyone
+    else.
+    """
+    cache_dir = os.environ.get('TRIPLEO_YAML_CACHE_DIR')
+    if cache_dir is not None:
+        return cache_dir
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'),
+                                             '.cache'))
+    return os.path.join(cache_home, 'tripleo', 'yaml')
+
+
+class YamlCache(object):
+    """Cache of parsed documents, stored with marshal in a directory
+
+    Entries are kept in memory for the life of the process, and on disk
+    until the total size of the directory goes above max_size, at which
+    point the least recently used entries are removed. Values are returned
+    as new copies, so callers are free to modify them. Values marshal can't
+    store, such as dates, are returned without being cached.
+
+    Any error reading or writing the cache directory is logged and the
+    cache is then only used in memory.
+    """
+
+    def __init__(self, cache_dir, max_size=constants.YAML_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._checked = False
+
+    def _entry_path(self, key):
+        digest = hashlib.sha1(repr(
+            (_CACHE_FORMAT, sys.version_info[:2], marshal.version,
+             key)).encode('utf-8'))
+        return os.path.join(self.cache_dir, digest.hexdigest() + '.marshal')
+
+    def _check_dir(self):
+        """Disable the on-disk cache unless only we can write to it"""
+        if self._checked or not self.cache_dir:
+            return
+        self._checked = True
+        try:
+            if not os.path.lexists(self.cache_dir):
+                os.makedirs(self.cache_dir, 0o700)
+            st = os.lstat(self.cache_dir)
+        except OSError as e:
+            LOG.debug("Unable to create the YAML cache in %s, disabling "
+                      "it: %s" % (self.cache_dir, e))
+            self.cache_dir = None
+            return
+        if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() or
+                stat.S_IMODE(st.st_mode) & 0o077):
+            LOG.warning("Not using the YAML cache in %s, it must be a "
+                        "directory owned by the current user with mode "
+                        "0700" % self.cache_dir)
+            self.cache_dir = None
+
+    def _read(self, key):
+        self._check_dir()
+        if not self.cache_dir:
+            return None
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Refresh the modification time, which is what eviction uses
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return data
+
+    def _write(self, key, data):
+        self._check_dir()
+        if not self.cache_dir:
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, self._entry_path(key))
+        except (IOError, OSError) as e:
+            LOG.debug("Unable to write to the YAML cache in %s, disabling "
+                      "it: %s" % (self.cache_dir, e))
+            self.cache_dir = None
+            return
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % constants.YAML_CACHE_EVICT_INTERVAL == 1
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries above max_size"""
+        if not self.cache_dir:
+            return
+        entries = []
+        total = 0
+        try:
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        except OSError as e:
+            LOG.debug("Unable to list the YAML cache in %s: %s"
+                      % (self.cache_dir, e))
+            return
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def get_or_parse(self, key, parse):
+        """Return the cached value for key, or cache and return parse()"""
+        data = self._memory.get(key)
+        if data is None:
+            data = self._read(key)
+            if data is not None:
+                try:
+                    value = marshal.loads(data)
+                except Exception as e:
+                    LOG.debug("Ignoring corrupted YAML cache entry: %s" % e)
+                else:
+                    self._memory[key] = data
+                    return value
+        else:
+            return marshal.loads(data)
+
+        value = parse()
+        try:
+            data = marshal.dumps(value)
+        except ValueError:
+            return value
+        self._memory[key] = data
+        self._write(key, data)
+        return value
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the YamlCache for the current cache directory"""
+    cache_dir = get_cache_dir()
+    with _caches_lock:
+        if cache_dir not in _caches:
+            _caches[cache_dir] = YamlCache(cache_dir)
+        return _caches[cache_dir]
+
+
+def _load(path, kind, parse):
+    path = os.path.abspath(path)
+
+    def read_and_parse():
+        with open(path) as f:
+            return parse(f)
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return read_and_parse()
+    key = (kind, path, st.st_size, st.st_mtime, st.st_ino)
+    return get_cache().get_or_parse(key, read_and_parse)
+
+
+def load_file(path):
+    """Parse a YAML file, using the cache when possible
+
+    Entries are looked up by the path, size, modification time and inode
+    of the file, so any change to it is picked up.
+    """
+    return _load(path, 'file', safe_load)
+
+
+def load_environment(path):
+    """Parse a Heat environment file like heatclient does, using the cache
+
+    Unlike load_file, the sections of the environment are validated and
+    values such as dates are kept as strings.
+    """
+    return _load(path, 'environment',
+                 lambda f: environment_format.parse(f.read()))